@@ -1,8 +1,89 @@
-from time import mktime
-from datetime import datetime
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
 import numpy as np
+import os
+from collections import deque
+from time import monotonic
+from centroid_log import CentroidLog, CentroidTail, choose_level
+from centroid_bus import CentroidSubscriber
+import drift_stats
+from drift_stats import AXES
+
+LOG = 'positions.sglog'
+STATS = 'drift_stats.npz'  # saved by StarGuide, see StarGuide.DRIFT_SNAPSHOT
+WINDOW = 100000  # newest log samples shown
+TAIL_LIMIT = 10000  # most log records read per tick, so catching up never stalls the GUI
+LOG_INTERVAL = 0.1  # s between logged samples, see uEyeViewer
+DECIMATE = 10  # log samples per plotted point
+PLOT_INTERVAL = DECIMATE * LOG_INTERVAL  # s between plotted points
+UM_PER_PX = 5
+RECONNECT_INTERVAL = 5.  # s between attempts to subscribe to StarGuide
+HISTORY_INTERVAL = 0.3  # s between reloads of the history while zooming or panning
+STATS_INTERVAL = 1.  # s between checks for new drift statistics
+STATS_COLORS = ('r', 'w', 'y', 'c')  # pen of each axis in drift_stats.AXES
+
+
+class ScrollingCurve:
+    """Curve of the newest `window` points, drawn as a ring of segments of CHUNK points.
+
+    New points only redraw the segment they go into; once the window is
+    full the oldest segment is cleared and reused for the newest points.
+    Each segment starts with the last point of the one before, so the line
+    stays continuous.
+    """
+    CHUNK = 500
+
+    def __init__(self, plot, window, **kwargs):
+        self.plot = plot
+        self.kwargs = kwargs
+        self.max_segments = -(-window // self.CHUNK) + 1
+        self.segments = deque()  # [item, x, y, n]
+
+    def _next_segment(self):
+        if len(self.segments) < self.max_segments:
+            # only the first segment gets a legend entry
+            kwargs = self.kwargs if not self.segments else {k: v for k, v in self.kwargs.items() if k != 'name'}
+            segment = [self.plot.plot(**kwargs), np.empty(self.CHUNK + 1), np.empty(self.CHUNK + 1), 0]
+        else:
+            segment = self.segments.popleft()
+            segment[3] = 0
+        if self.segments:
+            _, x, y, n = self.segments[-1]
+            segment[1][0], segment[2][0], segment[3] = x[n - 1], y[n - 1], 1
+        self.segments.append(segment)
+        return segment
+
+    def add(self, x, y):
+        while len(x):
+            segment = self.segments[-1] if self.segments and self.segments[-1][3] <= self.CHUNK else self._next_segment()
+            item, sx, sy, n = segment
+            take = min(self.CHUNK + 1 - n, len(x))
+            sx[n:n + take], sy[n:n + take] = x[:take], y[:take]
+            segment[3] = n + take
+            item.setData(sx[:n + take], sy[:n + take])
+            x, y = x[take:], y[take:]
+
+
+class HistoryBand:
+    """Mean and min-max band of one axis over the visible time range.
+
+    The data come from the pyramid level of the centroid log with about one
+    bucket per pixel (see centroid_log.py), so reloading it costs the same
+    for an hour as for months.
+    """
+    def __init__(self, plot, color):
+        color = pg.mkColor(color)
+        color.setAlpha(90)
+        self.mean = plot.plot(pen=pg.mkPen(color))
+        self.lo, self.hi = pg.PlotDataItem(), pg.PlotDataItem()
+        color.setAlpha(40)
+        plot.addItem(pg.FillBetweenItem(self.lo, self.hi, brush=pg.mkBrush(color)))
+
+    def set(self, x, mean, lo, hi):
+        self.mean.setData(x, mean)
+        self.lo.setData(x, lo)
+        self.hi.setData(x, hi)
+
 
 app = QtWidgets.QApplication([])
 
@@ -14,10 +95,11 @@ plot2 = win.addPlot()
 plot1.addLegend()
 plot2.addLegend()
 
-curve1_x = plot1.plot(pen='r', name = 'cam1 x')
-curve1_y = plot1.plot(pen='w', name = 'cam1 y')
-curve2_x = plot2.plot(pen='r', name = 'cam2 x')
-curve2_y = plot2.plot(pen='w',  name = 'cam2 y')
+n_points = WINDOW // DECIMATE
+curve1_x = ScrollingCurve(plot1, n_points, pen='r', name = 'cam1 x')
+curve1_y = ScrollingCurve(plot1, n_points, pen='w', name = 'cam1 y')
+curve2_x = ScrollingCurve(plot2, n_points, pen='r', name = 'cam2 x')
+curve2_y = ScrollingCurve(plot2, n_points, pen='w',  name = 'cam2 y')
 axis = pg.DateAxisItem()
 plot1.setAxisItems({'bottom': axis})
 plot2.setAxisItems({'bottom': pg.DateAxisItem()})
@@ -26,23 +108,159 @@ plot2.setAxisItems({'bottom': pg.DateAxisItem()})
 plot1.setLabel('left', "CAM1 dPOS [um]")
 plot2.setLabel('left', "CAM2 dPOS [um]")
 
+history1 = [HistoryBand(plot1, 'r'), HistoryBand(plot1, 'w')]
+history2 = [HistoryBand(plot2, 'r'), HistoryBand(plot2, 'w')]
+
+win.nextRow()
+stats_row = win.addLayout()
+adev_plot = stats_row.addPlot()
+adev_plot.setLogMode(x=True, y=True)
+adev_plot.setLabel('bottom', "tau [s]")
+adev_plot.setLabel('left', "Allan deviation [um]")
+adev_plot.addLegend()
+psd_plot = stats_row.addPlot()
+psd_plot.setLogMode(x=True, y=True)
+psd_plot.setLabel('bottom', "f [Hz]")
+psd_plot.setLabel('left', "PSD [um^2/Hz]")
+adev_curves = [adev_plot.plot(pen=color, symbol='o', symbolSize=4, symbolPen=color, name=name) for name, color in zip(AXES, STATS_COLORS)]
+psd_curves = [psd_plot.plot(pen=color) for color in STATS_COLORS]
+
+tail = None  # new records of the log, see open_log
+log = None  # the whole log, for the history
+levels = {}  # pyramid levels of the log opened so far
+history_dirty = True
+last_history = -np.inf
+bus = None  # live samples from StarGuide, see centroid_bus.py; the log when not running
+last_connect = -np.inf
+last_bucket = -np.inf
+stats_mtime = None  # of the drift statistics shown
+last_stats = -np.inf
+
+
+def plot(d):
+    """Add the records `d`, one point per PLOT_INTERVAL, after the last point plotted."""
+    global last_bucket
+    if not len(d):
+        return
+    buckets = np.floor(d['time'] / PLOT_INTERVAL)
+    # a record is plotted when it opens a later bucket than any before it
+    keep = buckets > np.maximum.accumulate(np.concatenate(([last_bucket], buckets[:-1])))
+    last_bucket = max(last_bucket, buckets.max())
+    d = d[keep]
+    if not len(d):
+        return
+    x, c, t = d['time'], d['centroids'], d['targets']
+    curve1_x.add(x, deviation(c, t, 0, 0))
+    curve1_y.add(x, deviation(c, t, 0, 1))
+    curve2_x.add(x, deviation(c, t, 1, 0))
+    curve2_y.add(x, deviation(c, t, 1, 1))
+
+
+def deviation(v, targets, cam, axis):
+    """Distance of the `axis` coordinate of camera `cam` to its target [um]."""
+    return (v[:,cam,axis]-targets[:,cam,1-axis])*UM_PER_PX
+
+
+def open_log():
+    """Open the log once it exists; False until then, e.g. before StarGuide has logged anything."""
+    global tail, log
+    if tail is None:
+        try:
+            tail, log = CentroidTail(LOG, backlog=WINDOW), CentroidLog(LOG)
+        except (OSError, ValueError):
+            # not created yet, or its header not written yet
+            return False
+    return True
+
+
+def load_history():
+    global history_dirty, last_history
+    history_dirty, last_history = False, monotonic()
+    for plot, cam, bands in ((plot1, 0, history1), (plot2, 1, history2)):
+        t0, t1 = plot.viewRange()[0]
+        pixels = max(int(plot.getViewBox().width()), 1)
+        name = choose_level(t1 - t0, pixels)
+        try:
+            if name is not None and name not in levels:
+                levels[name] = log.level(name)
+        except (OSError, ValueError):
+            # a log written without its pyramid; centroid_log.py -r builds it
+            name = None
+        if name is None:
+            log.refresh()
+            d = log.range(t0, t1)
+            d = d[::max(len(d) // (2 * pixels), 1)]
+            mean = lo = hi = d['centroids']
+        else:
+            level = levels[name]
+            level.refresh()
+            d = level.range(t0 - level.interval, t1)
+            mean, lo, hi = d['mean'], d['min'], d['max']
+        for axis, band in enumerate(bands):
+            t = d['targets']
+            band.set(d['time'], deviation(mean, t, cam, axis), deviation(lo, t, cam, axis), deviation(hi, t, cam, axis))
+
+
+def show_stats():
+    """Show the drift statistics StarGuide last saved, if they changed since."""
+    global last_stats, stats_mtime
+    last_stats = monotonic()
+    try:
+        mtime = os.stat(STATS).st_mtime
+        if mtime == stats_mtime:
+            return
+        s = drift_stats.load(STATS)
+    except (OSError, ValueError, KeyError):
+        # not saved yet, or by another version
+        return
+    stats_mtime = mtime
+    for curve, a in zip(adev_curves, s.adev.T):
+        ok = a > 0
+        curve.setData(s.taus[ok], a[ok]*UM_PER_PX)
+    for curve, p in zip(psd_curves, s.psd.T):
+        ok = (s.freqs > 0) & (p > 0)
+        curve.setData(s.freqs[ok], p[ok]*UM_PER_PX**2)
+    adev_plot.setTitle(f"RMS of the last {s.window} samples [um]: " +
+                       ", ".join(f"{name} {rms:.3f}" for name, rms in zip(AXES, s.rms*UM_PER_PX)))
+
+
+def mark_history(*args):
+    global history_dirty
+    history_dirty = True
+
+
+plot1.sigXRangeChanged.connect(mark_history)
+plot2.sigXRangeChanged.connect(mark_history)
+
 
 def update():
-    d = np.load('positions.npz', allow_pickle=True)
-    x, c, t1, t2 = d['times'][-100000::10], d['centroids'][-100000::10], d['targets'][0], d['targets'][1]
-    c =  np.array(c)
-
-    # x = [datetime for t in x]
-    x = [mktime(dt.timetuple()) for dt in x]
-    curve1_x.setData((c[:,0,0]-t1[1])*5, x=x)
-    curve1_y.setData((c[:,0,1]-t1[0])*5, x=x)
-    curve2_x.setData((c[:,1,0]-t2[1])*5, x=x)
-    curve2_y.setData((c[:,1,1]-t2[0])*5, x=x)
-    
+    global bus, last_connect
+    if (bus is None or not bus.connected) and monotonic() - last_connect > RECONNECT_INTERVAL:
+        last_connect = monotonic()
+        try:
+            bus = CentroidSubscriber(timeout=0.05)
+        except OSError:
+            bus = None
+    if bus is not None and bus.connected:
+        d = bus.poll()
+        if open_log():
+            # the bus shows these; the tail stays at the end of the log for when the bus drops
+            tail.skip()
+    elif open_log():
+        # only the records logged since the last tick
+        d = tail.poll(TAIL_LIMIT)
+    else:
+        return
+    plot(d)
+    if monotonic() - last_stats > STATS_INTERVAL:
+        show_stats()
+    if history_dirty and monotonic() - last_history > HISTORY_INTERVAL and open_log():
+        load_history()
+
 
 timer = QtCore.QTimer()
 timer.timeout.connect(update)
-timer.start(1000)
+timer.start(100)
 
 if __name__ == '__main__':
     app.exec_()
@@ -0,0 +1,102 @@
+"""
+Speed/accuracy benchmark of the centroid algorithms in `centroids.py`.
+
+Renders synthetic beam images, a Gaussian spot at a random subpixel
+position on a noisy background, optionally saturated and with a stray
+light patch, and runs every algorithm on them. For every algorithm and
+image size it reports ms per frame (p50/p99), the rms and worst position
+error against the true centre, the share of frames without a spot and
+the mean quality:
+
+    full    the whole sensor, as searched without ROI tracking
+    roi     a 2 * ROI_HALF_SIZE window around the spot, as when tracking
+"""
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+from centroids import ALGORITHMS, get_algorithm
+
+
+def beam_image(shape, center, sigma=6., amplitude=230., background=20., noise=4., channels=1, stray=0., rng=None):
+    """Synthetic uint8 (h, w, channels) frame of a Gaussian spot at `center` (y, x)."""
+    rng = np.random.default_rng() if rng is None else rng
+    h, w = shape
+    gy = np.exp(-0.5 * ((np.arange(h) - center[0]) / sigma) ** 2)
+    gx = np.exp(-0.5 * ((np.arange(w) - center[1]) / sigma) ** 2)
+    img = amplitude * np.outer(gy, gx) + background + rng.normal(0, noise, shape)
+    if stray:
+        # a dim wide patch of stray light in a corner
+        yy, xx = np.ogrid[:h, :w]
+        img += stray * np.exp(-0.5 * (((yy - h / 5) / (h / 10)) ** 2 + ((xx - w / 5) / (w / 10)) ** 2))
+    img = np.clip(np.rint(img), 0, 255).astype(np.uint8)
+    return np.repeat(img[:, :, None], channels, axis=2)
+
+
+def make_images(n, shape, margin=40, rng=None, **kwargs):
+    rng = np.random.default_rng(0) if rng is None else rng
+    h, w = shape
+    centers = np.column_stack([rng.uniform(margin, h - margin, n), rng.uniform(margin, w - margin, n)])
+    return [beam_image(shape, c, rng=rng, **kwargs) for c in centers], centers
+
+
+def bench(algorithm, images, centers):
+    """Run `algorithm` on every image and return the result row."""
+    latencies = np.empty(len(images))
+    positions = np.empty((len(images), 2))
+    quality = np.empty(len(images))
+    for i, image in enumerate(images):
+        t = perf_counter()
+        result = algorithm(image)
+        latencies[i] = perf_counter() - t
+        positions[i] = result.position
+        quality[i] = result.quality
+    errors = np.hypot(*(positions - centers).T)
+    found = ~np.isnan(errors)
+    return {
+        'p50_ms': np.percentile(latencies, 50) * 1e3,
+        'p99_ms': np.percentile(latencies, 99) * 1e3,
+        'rms_px': float(np.sqrt(np.mean(errors[found] ** 2))) if found.any() else np.nan,
+        'max_px': float(errors[found].max()) if found.any() else np.nan,
+        'lost': float(1 - found.mean()),
+        'quality': float(quality.mean()),
+    }
+
+
+def report(name, size, r):
+    r = {'name': name, 'size': size, **r}
+    print(f"{name:>10} {size:>5}: p50 {r['p50_ms']:8.3f} ms   p99 {r['p99_ms']:8.3f} ms   "
+          f"rms {r['rms_px']:6.3f} px   max {r['max_px']:6.3f} px   "
+          f"lost {100 * r['lost']:5.1f} %   quality {r['quality']:.2f}")
+    return r
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='n', help='Images per run', type=int, default=50)
+    parser.add_argument('-W', '--width', dest='width', help='Sensor width [px]', type=int, default=1280)
+    parser.add_argument('-H', '--height', dest='height', help='Sensor height [px]', type=int, default=1024)
+    parser.add_argument('-R', '--roi', dest='roi', help='Half side of the ROI window [px]', type=int, default=48)
+    parser.add_argument('-C', '--channels', dest='channels', help='Channels per pixel', type=int, default=1)
+    parser.add_argument('-s', '--sigma', dest='sigma', help='Spot Gaussian width [px]', type=float, default=6.)
+    parser.add_argument('-a', '--amplitude', dest='amplitude', help='Spot peak counts, above 255 saturates', type=float, default=230.)
+    parser.add_argument('-N', '--noise', dest='noise', help='Background noise [counts]', type=float, default=4.)
+    parser.add_argument('-S', '--stray', dest='stray', help='Peak counts of a stray light patch', type=float, default=0.)
+    parser.add_argument('-A', '--algorithms', dest='algorithms', help='Algorithms to compare', nargs='+', default=list(ALGORITHMS))
+    parser.add_argument('-o', '--output', dest='output', help='Also write the results to this JSON file', type=str)
+    args = parser.parse_args()
+
+    spot = dict(sigma=args.sigma, amplitude=args.amplitude, noise=args.noise, channels=args.channels, stray=args.stray)
+    sizes = {
+        'full': make_images(args.n, (args.height, args.width), **spot),
+        'roi': make_images(args.n, (2 * args.roi, 2 * args.roi), margin=args.roi / 2, **spot),
+    }
+    results = []
+    for name in args.algorithms:
+        algorithm = get_algorithm(name)
+        for size, (images, centers) in sizes.items():
+            results.append(report(name, size, bench(algorithm, images, centers)))
+
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
@@ -0,0 +1,187 @@
+"""
+Live publish/subscribe of the StarGuide centroid samples over local TCP.
+
+:class:`CentroidPublisher` listens on 127.0.0.1:PORT; every published sample
+goes out to every connected :class:`CentroidSubscriber` as one fixed size
+little-endian record (:data:`RECORD`):
+
+    time        float64         s since epoch
+    centroids   float64 (2, 2)  (y, x) centroid of camera 1 and 2 [px], NaN without a spot
+    targets     float64 (2, 2)  (x, y) target of camera 1 and 2 [px], NaN if none
+    motors      float64 (4,)    relative moves sent to each motor channel since the previous sample [steps]
+    locked      uint8           1 while the alignment loop runs
+
+The publisher never waits for a subscriber: its sockets are non-blocking,
+bytes a subscriber has not taken yet wait in a per-subscriber backlog of
+at most MAX_BACKLOG records, and records that do not fit are dropped for
+that subscriber only (counted in `dropped`). Subscribers see each sample
+as soon as it is published.
+
+    bus = CentroidPublisher()
+    bus.publish(time(), centroids, targets, motors, locked)
+
+    sub = CentroidSubscriber()
+    records = sub.poll(timeout=0.1)
+"""
+import socket
+import selectors
+import argparse
+import numpy as np
+
+PORT = 50742
+
+RECORD = np.dtype([('time', '<f8'), ('centroids', '<f8', (2, 2)), ('targets', '<f8', (2, 2)), ('motors', '<f8', (4,)),
+                   ('locked', 'u1'), ('reserved', 'u1', 7)])
+
+
+class _Subscriber:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.backlog = bytearray()
+        self.dropped = 0
+
+
+class CentroidPublisher:
+    """Sends samples to the subscribers connected to `port` on `host`.
+
+    :meth:`publish` accepts new subscribers and sends without blocking, so
+    it can be called from the control loop. One publisher per port, used
+    from one thread.
+    """
+    MAX_BACKLOG = 1024  # records waiting for a slow subscriber
+
+    def __init__(self, host='127.0.0.1', port=PORT):
+        self.address = (host, port)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if hasattr(socket, 'SO_EXCLUSIVEADDRUSE'):
+            # Windows: SO_REUSEADDR would let a second publisher bind the port in use
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            # POSIX: rebind while the previous run's connections are in TIME_WAIT
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(self.address)
+        self._server.listen()
+        self._server.setblocking(False)
+        self.subscribers = []
+        self.dropped = 0  # records dropped for slow subscribers
+        self._record = np.zeros((), dtype=RECORD)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.subscribers.append(_Subscriber(sock, address))
+
+    def _send(self, subscriber):
+        """Send what the socket takes of the subscriber's backlog; False if it went away."""
+        try:
+            sent = subscriber.sock.send(subscriber.backlog)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        del subscriber.backlog[:sent]
+        return True
+
+    def publish(self, t, centroids, targets=None, motors=None, locked=False):
+        """Send one sample to every subscriber, see :data:`RECORD` for the fields."""
+        self._accept()
+        record = self._record
+        record['time'] = t
+        record['centroids'] = centroids
+        record['targets'] = np.nan if targets is None else [(np.nan, np.nan) if tg is None else tg for tg in targets]
+        record['motors'] = 0 if motors is None else motors
+        record['locked'] = locked
+        data = record.tobytes()
+        alive = []
+        for subscriber in self.subscribers:
+            if len(subscriber.backlog) >= self.MAX_BACKLOG * RECORD.itemsize:
+                subscriber.dropped += 1
+                self.dropped += 1
+            else:
+                subscriber.backlog += data
+            if self._send(subscriber):
+                alive.append(subscriber)
+            else:
+                subscriber.sock.close()
+        self.subscribers = alive
+
+    def close(self):
+        for subscriber in self.subscribers:
+            subscriber.sock.close()
+        self.subscribers = []
+        self._server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CentroidSubscriber:
+    """Receives the samples of a :class:`CentroidPublisher`.
+
+    Args:
+        timeout (float): seconds to wait for the connection
+
+    Raises:
+        OSError: no publisher on `port`.
+    """
+    def __init__(self, host='127.0.0.1', port=PORT, timeout=None):
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        self._buffer = bytearray()
+        self.connected = True
+
+    def poll(self, timeout=0):
+        """The records received since the last poll, waiting up to `timeout` s for the first."""
+        if self.connected and not self._buffer and timeout:
+            self._selector.select(timeout)
+        while self.connected:
+            try:
+                data = self._sock.recv(1 << 16)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                data = b''
+            if not data:
+                # the publisher went away
+                self.connected = False
+                break
+            self._buffer += data
+        n = len(self._buffer) // RECORD.itemsize * RECORD.itemsize
+        records = np.frombuffer(bytes(self._buffer[:n]), dtype=RECORD)
+        del self._buffer[:n]
+        return records
+
+    def close(self):
+        self._selector.close()
+        self._sock.close()
+        self.connected = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the centroid samples published by StarGuide.')
+    parser.add_argument('-p', '--port', dest='port', help='Port of the publisher', type=int, default=PORT)
+    args = parser.parse_args()
+
+    with CentroidSubscriber(port=args.port) as sub:
+        while sub.connected:
+            for r in sub.poll(timeout=1.):
+                (y1, x1), (y2, x2) = r['centroids']
+                print(f"{r['time']:.3f}  cam1 ({x1:7.2f}, {y1:7.2f})  cam2 ({x2:7.2f}, {y2:7.2f})  "
+                      f"motors {r['motors']}  {'locked' if r['locked'] else ''}")
@@ -0,0 +1,379 @@
+"""
+Append-only binary log of the StarGuide beam centroids.
+
+The file is a 64 byte header followed by fixed size little-endian records
+(:data:`RECORD`), one per logged sample:
+
+    time        float64         s since epoch
+    centroids   float64 (2, 2)  (y, x) centroid of camera 1 and 2 [px], NaN without a spot
+    targets     float64 (2, 2)  (x, y) target of camera 1 and 2 [px], NaN if none
+    locked      uint8           1 while the alignment loop runs
+
+:class:`CentroidLogWriter` buffers records in a preallocated chunk and
+appends whole chunks, so the cost of a sample does not depend on the length
+of the run and a killed process loses at most the last chunk; a partial
+record at the end is cut off when the file is opened again.
+:class:`CentroidLog` maps the file read-only and finds a time range by
+binary search on the record times, without reading the rest of the file.
+:class:`CentroidTail` follows a log being written, reading only the
+records appended since its last poll.
+
+Next to the log the writer keeps a pyramid of downsampled levels, one file
+per bucket size in :data:`LEVELS` (`path`.1s, `path`.10s, ...), with the
+:data:`LEVEL` record of every bucket: sample count, share of locked
+samples and the min, max and mean of each centroid coordinate. Each level
+is fed the closed buckets of the one below, so a sample costs the same
+whatever the run length, and a plot of any time span reads about as many
+records as it has pixels (:func:`choose_level`). A bucket still open when
+the writer closes is written as it is; after a restart the rest of it
+follows as a second record with the same time.
+
+    with CentroidLogWriter('positions.sglog') as log:
+        log.append(time(), [[547., 610.], [581., 560.]], [(610, 547), (560, 581)], locked=True)
+    CentroidLog('positions.sglog').range(t0, t1)['centroids']
+"""
+import os
+import argparse
+from time import time
+import numpy as np
+
+MAGIC = b'SGCLOG'  # null padded to 8 bytes
+VERSION = 1
+
+# `interval` is the bucket size [s] of a pyramid level, 0 in the log itself
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4'), ('created', '<f8'), ('interval', '<f8'),
+                   ('reserved', 'u1', 32)])
+RECORD = np.dtype([('time', '<f8'), ('centroids', '<f8', (2, 2)), ('targets', '<f8', (2, 2)), ('locked', 'u1'), ('reserved', 'u1', 7)])
+# one bucket of a pyramid level: start `time`, samples, locked share, and per centroid coordinate
+# (NaN where no sample had a spot) the min, max and mean, plus the last targets
+LEVEL = np.dtype([('time', '<f8'), ('count', '<u4'), ('locked', '<f4'), ('min', '<f8', (2, 2)), ('max', '<f8', (2, 2)),
+                  ('mean', '<f8', (2, 2)), ('targets', '<f8', (2, 2))])
+LEVELS = {'1s': 1., '10s': 10., '1min': 60., '10min': 600., '1h': 3600.}  # name: bucket size [s]
+
+
+def level_path(path, name):
+    """File of the pyramid level `name` of the log at `path`."""
+    return f'{path}.{name}'
+
+
+def choose_level(span, points):
+    """Coarsest level in LEVELS with at least `points` buckets in `span` s, None for the log itself."""
+    level = None
+    for name, interval in LEVELS.items():
+        if span / interval >= points:
+            level = name
+    return level
+
+
+def _check_header(header, path, dtype=RECORD):
+    if header['magic'] != MAGIC or header['version'] != VERSION or header['record_size'] != dtype.itemsize:
+        raise ValueError(f'{path} is not a version {VERSION} centroid log')
+
+
+class _ChunkedFile:
+    """Record file opened for appending, with a preallocated buffer of `chunk` records."""
+    def __init__(self, path, dtype, chunk, interval=0.):
+        self.path = path
+        self.buffer = np.zeros(chunk, dtype=dtype)
+        self.count = 0
+        self.fh = open(path, 'a+b')
+        size = self.fh.seek(0, os.SEEK_END)
+        if size < HEADER.itemsize:
+            # new file, or killed before the header was complete
+            self.fh.truncate(0)
+            header = np.zeros((), dtype=HEADER)
+            header['magic'], header['version'], header['record_size'] = MAGIC, VERSION, dtype.itemsize
+            header['created'], header['interval'] = time(), interval
+            self.fh.write(header.tobytes())
+            self.fh.flush()
+        else:
+            self.fh.seek(0)
+            _check_header(np.frombuffer(self.fh.read(HEADER.itemsize), dtype=HEADER)[0], path, dtype)
+            # a record cut short by a crash is dropped
+            whole = size - (size - HEADER.itemsize) % dtype.itemsize
+            if whole != size:
+                self.fh.truncate(whole)
+
+    def add(self):
+        """Next free record of the buffer, to be filled in; the buffer is written when full."""
+        if self.count == len(self.buffer):
+            self.flush()
+        record = self.buffer[self.count]
+        self.count += 1
+        return record
+
+    def flush(self):
+        if self.count:
+            self.fh.write(self.buffer[:self.count].tobytes())
+            self.fh.flush()
+            self.count = 0
+
+    def close(self):
+        if not self.fh.closed:
+            self.flush()
+            self.fh.close()
+
+
+class _Bucket:
+    """Open bucket of a pyramid level: sample count, locked count, and per coordinate valid count, sum, min and max."""
+    def __init__(self):
+        self.index = None
+        self.reset()
+
+    def reset(self):
+        self.count, self.locked = 0, 0
+        self.valid, self.total = np.zeros((2, 2)), np.zeros((2, 2))
+        self.min, self.max = np.full((2, 2), np.inf), np.full((2, 2), -np.inf)
+        self.targets = np.full((2, 2), np.nan)
+
+    def merge(self, count, locked, valid, total, lo, hi, targets):
+        self.count += count
+        self.locked += locked
+        self.valid += valid
+        self.total += total
+        np.minimum(self.min, lo, out=self.min)
+        np.maximum(self.max, hi, out=self.max)
+        self.targets = targets
+
+    def aggregate(self):
+        return self.count, self.locked, self.valid, self.total, self.min, self.max, self.targets
+
+
+class _Pyramid:
+    """The LEVELS files of a log, each fed the closed buckets of the level below."""
+    def __init__(self, path, chunk):
+        self.intervals = list(LEVELS.values())
+        self.files = [_ChunkedFile(level_path(path, name), LEVEL, chunk, interval) for name, interval in LEVELS.items()]
+        self.buckets = [_Bucket() for _ in LEVELS]
+
+    def add(self, t, centroids, targets, locked):
+        centroids = np.asarray(centroids, dtype=float)
+        valid = ~np.isnan(centroids)
+        self._feed(0, t, (1, int(bool(locked)), valid, np.where(valid, centroids, 0.),
+                          np.where(valid, centroids, np.inf), np.where(valid, centroids, -np.inf), targets))
+
+    def _feed(self, level, t, aggregate):
+        bucket = self.buckets[level]
+        index = t // self.intervals[level]
+        if bucket.index is not None and index != bucket.index:
+            self._close(level)
+        bucket.index = index
+        bucket.merge(*aggregate)
+
+    def _close(self, level):
+        """Write the open bucket of `level` and pass it on to the next level."""
+        bucket = self.buckets[level]
+        if not bucket.count:
+            return
+        t = bucket.index * self.intervals[level]
+        record = self.files[level].add()
+        found = bucket.valid > 0
+        record['time'], record['count'], record['locked'] = t, bucket.count, bucket.locked / bucket.count
+        record['min'] = np.where(found, bucket.min, np.nan)
+        record['max'] = np.where(found, bucket.max, np.nan)
+        record['mean'] = np.where(found, bucket.total / np.maximum(bucket.valid, 1), np.nan)
+        record['targets'] = bucket.targets
+        if level + 1 < len(self.buckets):
+            self._feed(level + 1, t, bucket.aggregate())
+        bucket.reset()
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+
+    def close(self):
+        # the open buckets, finest first so each reaches the levels above
+        for level in range(len(self.buckets)):
+            self._close(level)
+        for f in self.files:
+            f.close()
+
+
+class CentroidLogWriter:
+    """Appends records to a centroid log, created with its header if missing, and updates its pyramid.
+
+    Records are written once `chunk` of them are buffered, or at the first
+    append `flush_interval` s after the last write. One writer per file,
+    used from one thread.
+
+    Args:
+        levels (bool): also keep the LEVELS files
+    """
+    CHUNK = 256  # records per write
+    FLUSH_INTERVAL = 1.  # s
+
+    def __init__(self, path, chunk=CHUNK, flush_interval=FLUSH_INTERVAL, levels=True):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = _ChunkedFile(path, RECORD, chunk)
+        self._pyramid = _Pyramid(path, chunk) if levels else None
+        self._flushed = time()
+
+    def append(self, t, centroids, targets=None, locked=False):
+        """Log the (2, 2) `centroids` ((y, x) per camera) and `targets` ((x, y) per camera) at time `t`."""
+        record = self._file.add()
+        record['time'] = t
+        record['centroids'] = centroids
+        record['targets'] = np.nan if targets is None else [(np.nan, np.nan) if tg is None else tg for tg in targets]
+        record['locked'] = locked
+        if self._pyramid is not None:
+            self._pyramid.add(t, record['centroids'], record['targets'].copy(), locked)
+        if t - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records."""
+        self._file.flush()
+        if self._pyramid is not None:
+            self._pyramid.flush()
+        self._flushed = time()
+
+    def close(self):
+        """Write the buffered records and the open pyramid buckets."""
+        if self._pyramid is not None:
+            self._pyramid.close()
+            self._pyramid = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def rebuild_levels(path, chunk=4096):
+    """Recompute the pyramid of the log at `path` from its records, e.g. for a log written without it."""
+    for name in LEVELS:
+        if os.path.exists(level_path(path, name)):
+            os.remove(level_path(path, name))
+    pyramid = _Pyramid(path, chunk)
+    for record in CentroidLog(path).records:
+        pyramid.add(float(record['time']), record['centroids'], record['targets'].copy(), record['locked'])
+    pyramid.close()
+
+
+class CentroidLog:
+    """Read-only, memory-mapped view of a centroid log, or of one of its pyramid levels.
+
+    The mapping covers the whole records present when it was made;
+    :meth:`refresh` extends it to records appended since. Indexing and the
+    read methods return copies, so they stay valid after a refresh.
+    Records are :data:`RECORD`, or :data:`LEVEL` for a level file, whose
+    bucket size is `interval` (0 for the log).
+    """
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER, count=1)
+        if len(header) != 1:
+            raise ValueError(f'{path} is not a centroid log')
+        self.interval = float(header[0]['interval'])
+        self.dtype = LEVEL if self.interval else RECORD
+        _check_header(header[0], path, self.dtype)
+        self.created = float(header[0]['created'])
+        self.records = np.zeros(0, dtype=self.dtype)
+        self.refresh()
+
+    def refresh(self):
+        """Map the records appended since the last refresh; returns the record count."""
+        n = (os.path.getsize(self.path) - HEADER.itemsize) // self.dtype.itemsize
+        if n != len(self.records):
+            # np.memmap cannot map zero records
+            self.records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER.itemsize, shape=(n,)) if n else np.zeros(0, dtype=self.dtype)
+        return n
+
+    def level(self, name):
+        """The pyramid level `name` (a key of LEVELS) of this log."""
+        return CentroidLog(level_path(self.path, name))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return np.array(self.records[index])
+
+    def read(self, start=0, stop=None):
+        """Records `start` to `stop` (the end if None)."""
+        return np.array(self.records[start:stop])
+
+    def index(self, t):
+        """Index of the first record at or after time `t`."""
+        return int(np.searchsorted(self.records['time'], t))
+
+    def range(self, start=None, end=None):
+        """Records from time `start` up to, not including, `end` (s since epoch); None for open ends."""
+        i = 0 if start is None else self.index(start)
+        j = len(self.records) if end is None else self.index(end)
+        return self.read(i, j)
+
+    def tail(self, n):
+        """The last `n` records."""
+        return self.read(max(len(self.records) - n, 0))
+
+
+class CentroidTail:
+    """Reads the records appended to a centroid log since the last :meth:`poll`.
+
+    The file stays open and the tail keeps its record `offset`, so a poll
+    costs the new records only, however long the log.
+
+    Args:
+        backlog (int): records already in the file that the first poll also
+            returns, counted from the end; all of them if None
+    """
+    def __init__(self, path, backlog=None):
+        self.path = path
+        self._fh = open(path, 'rb')
+        header = np.frombuffer(self._fh.read(HEADER.itemsize), dtype=HEADER)
+        if len(header) != 1:
+            raise ValueError(f'{path} is not a centroid log')
+        _check_header(header[0], path)
+        n = self.records()
+        self.offset = 0 if backlog is None else max(n - backlog, 0)
+
+    def records(self):
+        """Whole records in the file now."""
+        return (os.fstat(self._fh.fileno()).st_size - HEADER.itemsize) // RECORD.itemsize
+
+    def poll(self, limit=None):
+        """The records appended since the last poll, at most `limit` of them."""
+        stop = self.records() if limit is None else min(self.records(), self.offset + limit)
+        if stop <= self.offset:
+            return np.zeros(0, dtype=RECORD)
+        self._fh.seek(HEADER.itemsize + self.offset * RECORD.itemsize)
+        records = np.frombuffer(self._fh.read((stop - self.offset) * RECORD.itemsize), dtype=RECORD)
+        self.offset += len(records)
+        return records
+
+    def skip(self):
+        """Move past every record in the file now, unread; the next poll starts after them."""
+        self.offset = max(self.offset, self.records())
+
+    def close(self):
+        self._fh.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize a centroid log, or export a time range of it.')
+    parser.add_argument('path', help='Centroid log file')
+    parser.add_argument('-s', '--start', dest='start', help='First time to export [s since epoch]', type=float)
+    parser.add_argument('-e', '--end', dest='end', help='End time of the export [s since epoch]', type=float)
+    parser.add_argument('-o', '--output', dest='output', help='Write the range to this .npz file', type=str)
+    parser.add_argument('-r', '--rebuild', dest='rebuild', help='Recompute the pyramid levels first', action='store_true')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_levels(args.path)
+    log = CentroidLog(args.path)
+    records = log.range(args.start, args.end)
+    print(f'{args.path}: {len(log)} records', end='')
+    if len(records):
+        print(f', {len(records)} from {records["time"][0]:.3f} to {records["time"][-1]:.3f} s, '
+              f'{100 * records["locked"].mean():.1f} % locked')
+    else:
+        print()
+    if args.output is not None:
+        np.savez(args.output, **{name: records[name] for name in ('time', 'centroids', 'targets', 'locked')})
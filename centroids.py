@@ -0,0 +1,354 @@
+"""
+Beam spot centroid algorithms for the StarGuide cameras.
+
+Every algorithm is a callable ``algorithm(image, threshold=None)`` that takes
+a (h, w) or (h, w, channels) frame and returns a :class:`CentroidResult`:
+the (y, x) position in pixels of `image`, NaN when there is no spot, plus
+the spot width, its signal-to-noise ratio and a quality in [0, 1]. The
+threshold of a full frame can be passed back in to centroid a window of a
+later frame with the same level, as the ROI tracking of `uEyeCamera` does.
+
+    threshold   binary moments of the pixels above a percentile threshold
+    weighted    intensity weighted moments above the threshold
+    windowed    iterated centre of mass in a window around the spot
+    gaussian    least squares 2D Gaussian fit around the spot
+
+Image statistics (threshold, background, noise) come from a bincount
+histogram for uint8 frames, which avoids the partition of `np.percentile`.
+`centroid_bench.py` compares the algorithms on synthetic beam images.
+"""
+from collections import namedtuple
+import numpy as np
+
+CentroidResult = namedtuple('CentroidResult', ['position', 'width', 'snr', 'quality'])
+CentroidResult.__doc__ = """Result of a centroid algorithm: (y, x) `position` [px], rms radius
+`width` [px], peak signal-to-noise ratio `snr` and `quality`, 0 (no or bad
+spot) to 1, see the algorithms for its meaning."""
+
+StackCentroid = namedtuple('StackCentroid', ['mean', 'median', 'std', 'count', 'positions'])
+StackCentroid.__doc__ = """Centroid statistics of a stack of frames: (y, x) `mean`, `median` and
+`std` [px] over the `count` frames with a spot, and the (N, 2) `positions`
+of every frame (NaN without a spot)."""
+
+NOISE_CUT = 3  # pixels more than NOISE_CUT noise above the background are signal
+
+
+def no_spot(snr=0.):
+    return CentroidResult(np.array([np.nan, np.nan]), np.nan, snr, 0.)
+
+
+def mono(image):
+    """2D view of a frame, the brightest channel of colour frames."""
+    if image.ndim == 3:
+        return image[..., 0] if image.shape[2] == 1 else image.max(axis=2)
+    return image
+
+
+class ImageLevels:
+    """Percentiles of an image, from a bincount histogram for uint8 images.
+
+    Args:
+        image (ndarray): 2D image
+    """
+    def __init__(self, image):
+        self.size = image.size
+        if image.dtype == np.uint8:
+            self.counts = np.bincount(image.ravel(), minlength=256)
+            self.cumulative = np.cumsum(self.counts)
+            self.image = None
+        else:
+            self.counts = None
+            self.image = image
+
+    def percentile(self, q):
+        """Lower `q` percentile, as ``np.percentile(image, q, method='lower')``."""
+        if self.counts is None:
+            return np.percentile(self.image, q, method='lower')
+        rank = int(q / 100 * (self.size - 1))
+        return int(np.searchsorted(self.cumulative, rank, side='right'))
+
+    def background(self):
+        """Median level and noise (half the 16-84 percentile spread) of the image."""
+        low, median, high = (self.percentile(q) for q in (15.87, 50, 84.13))
+        return float(median), max((high - low) / 2, 0.5)
+
+    def signal_above(self, level, floor):
+        """Summed counts above `floor` of the pixels brighter than `level` (uint8 only)."""
+        k = np.arange(256)
+        weights = np.where(k > level, np.clip(k - floor, 0, None), 0)
+        return float(self.counts @ weights)
+
+
+def histogram_threshold(image, percentile=99., floor=127):
+    """Spot threshold: the `percentile` of `image`, at least `floor`."""
+    return max(ImageLevels(mono(image)).percentile(percentile), floor)
+
+
+def stack_moments(weights):
+    """(N, 2) (y, x) means of an (N, h, w) stack of weights, NaN for empty frames."""
+    # integer sums of masks are exact and cheaper than float ones
+    dtype = np.float64 if weights.dtype.kind == 'f' else np.int64
+    wy, wx = weights.sum(axis=2, dtype=dtype), weights.sum(axis=1, dtype=dtype)
+    m00 = wy.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.column_stack([wy @ np.arange(wy.shape[1]) / m00, wx @ np.arange(wx.shape[1]) / m00])
+
+
+def summarize(positions):
+    """:class:`StackCentroid` of (N, 2) centroid `positions`."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    valid = positions[~np.isnan(positions).any(axis=1)]
+    if not len(valid):
+        nan = np.array([np.nan, np.nan])
+        return StackCentroid(nan, nan.copy(), nan.copy(), 0, positions)
+    return StackCentroid(valid.mean(axis=0), np.median(valid, axis=0), valid.std(axis=0), len(valid), positions)
+
+
+class CentroidAlgorithm:
+    """Base class of the centroid algorithms.
+
+    Subclasses implement :meth:`_centroid` on the 2D image; this class works
+    out the threshold and the background statistics.
+
+    Args:
+        percentile (float): threshold percentile of the image
+        floor (float): lowest threshold, so a frame without beam gives no spot
+    """
+    name = None
+
+    def __init__(self, percentile=99., floor=127):
+        self.percentile = percentile
+        self.floor = floor
+
+    def threshold(self, image):
+        """Spot threshold of a full frame."""
+        return histogram_threshold(image, self.percentile, self.floor)
+
+    def __call__(self, image, threshold=None):
+        img = mono(image)
+        if img.size == 0:
+            return no_spot()
+        levels = ImageLevels(img)
+        if threshold is None:
+            threshold = max(levels.percentile(self.percentile), self.floor)
+        background, noise = levels.background()
+        return self._centroid(img, threshold, levels, background, noise)
+
+    def _centroid(self, img, threshold, levels, background, noise):
+        raise NotImplementedError
+
+    def stack_thresholds(self, stack):
+        """Spot threshold of every frame of an (N, h, w) stack."""
+        return np.array([self.threshold(img) for img in stack])
+
+    def stack(self, stack, threshold=None):
+        """(N, 2) centroid positions of an (N, h, w) stack, NaN without a spot.
+
+        Frame by frame here; the moment algorithms do all frames in one pass.
+
+        Args:
+            threshold (float or ndarray): for all frames or per frame,
+                each frame's own if None
+        """
+        thresholds = np.broadcast_to(self.stack_thresholds(stack) if threshold is None else threshold, len(stack))
+        return np.array([self(img, thr).position for img, thr in zip(stack, thresholds)]).reshape(-1, 2)
+
+    @staticmethod
+    def _captured(levels, img, threshold, background, noise, inside=None):
+        """Fraction of the signal above the noise floor in the spot (above `threshold`, or `inside`)."""
+        floor = background + NOISE_CUT * noise
+        if levels.counts is not None:
+            total = levels.signal_above(floor, floor)
+            if inside is None:
+                inside = levels.signal_above(threshold, floor)
+        else:
+            signal = np.clip(img - floor, 0, None)
+            total = float(signal.sum())
+            if inside is None:
+                inside = float(signal[img > threshold].sum())
+        return min(inside / total, 1.) if total > 0 else 0.
+
+    @staticmethod
+    def _moments(weights):
+        """(y, x) mean and rms radius of `weights`, from its projections; None if empty."""
+        wy, wx = weights.sum(axis=1, dtype=np.float64), weights.sum(axis=0, dtype=np.float64)
+        m00 = wy.sum()
+        if m00 <= 0:
+            return None
+        ry, rx = np.arange(len(wy)), np.arange(len(wx))
+        y, x = wy @ ry / m00, wx @ rx / m00
+        var = wy @ (ry - y) ** 2 / m00 + wx @ (rx - x) ** 2 / m00
+        return np.array([y, x]), np.sqrt(var)
+
+
+class ThresholdMoments(CentroidAlgorithm):
+    """Centre of the pixels above the threshold, all weighted equally.
+
+    The original StarGuide method (``cv2.threshold`` then ``cv2.moments``).
+    Quality is the fraction of the spot signal above the noise floor that
+    lies above the threshold.
+    """
+    name = 'threshold'
+
+    def _centroid(self, img, threshold, levels, background, noise):
+        snr = (float(img.max()) - background) / noise
+        moments = self._moments(img > threshold)
+        if moments is None:
+            return no_spot(snr)
+        position, width = moments
+        return CentroidResult(position, width, snr, self._captured(levels, img, threshold, background, noise))
+
+    def stack(self, stack, threshold=None):
+        thresholds = self.stack_thresholds(stack) if threshold is None else threshold
+        return stack_moments(stack > np.broadcast_to(thresholds, len(stack))[:, None, None])
+
+
+class WeightedMoments(CentroidAlgorithm):
+    """Intensity weighted centre of the pixels above the threshold.
+
+    Weights are the counts above the threshold, so it is less sensitive to
+    where the threshold cuts the spot than :class:`ThresholdMoments`.
+    Quality as for :class:`ThresholdMoments`.
+    """
+    name = 'weighted'
+
+    def _centroid(self, img, threshold, levels, background, noise):
+        snr = (float(img.max()) - background) / noise
+        weights = np.subtract(img, threshold, dtype=np.float32)
+        np.clip(weights, 0, None, out=weights)
+        moments = self._moments(weights)
+        if moments is None:
+            return no_spot(snr)
+        position, width = moments
+        return CentroidResult(position, width, snr, self._captured(levels, img, threshold, background, noise))
+
+    def stack(self, stack, threshold=None):
+        thresholds = self.stack_thresholds(stack) if threshold is None else threshold
+        weights = np.subtract(stack, np.broadcast_to(thresholds, len(stack))[:, None, None], dtype=np.float32)
+        np.clip(weights, 0, None, out=weights)
+        return stack_moments(weights)
+
+
+class WindowedCentroid(CentroidAlgorithm):
+    """Background subtracted centre of mass, iterated in a window on the spot.
+
+    Starts from :class:`ThresholdMoments` and re-centres a window of
+    2 * `half_size` px on the centre of mass of the counts above the noise
+    floor until it moves less than `tolerance` px. Only the window is
+    weighted, so stray light elsewhere does not pull the centroid. Quality
+    is the fraction of the signal above the noise floor inside the window.
+
+    Args:
+        half_size (int): half side of the window [px]
+        iterations (int): most re-centering steps, at least 1
+        tolerance (float): [px]
+    """
+    name = 'windowed'
+
+    def __init__(self, half_size=16, iterations=5, tolerance=0.01, **kwargs):
+        super().__init__(**kwargs)
+        if iterations < 1:
+            raise ValueError(f'iterations must be at least 1, got {iterations}')
+        self.half_size = half_size
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.start = ThresholdMoments()
+
+    def _window(self, img, center):
+        h, w = img.shape
+        y0 = int(np.clip(np.rint(center[0]) - self.half_size, 0, max(h - 1, 0)))
+        x0 = int(np.clip(np.rint(center[1]) - self.half_size, 0, max(w - 1, 0)))
+        return y0, x0, img[y0:y0 + 2 * self.half_size + 1, x0:x0 + 2 * self.half_size + 1]
+
+    def _centroid(self, img, threshold, levels, background, noise):
+        start = self.start._centroid(img, threshold, levels, background, noise)
+        if np.isnan(start.position).any():
+            return start
+        floor = background + NOISE_CUT * noise
+        position, width = start.position, start.width
+        for _ in range(self.iterations):
+            y0, x0, window = self._window(img, position)
+            weights = np.subtract(window, floor, dtype=np.float32)
+            np.clip(weights, 0, None, out=weights)
+            moments = self._moments(weights)
+            if moments is None:
+                return no_spot(start.snr)
+            shift = moments[0] + (y0, x0) - position
+            position, width = moments[0] + (y0, x0), moments[1]
+            if np.abs(shift).max() < self.tolerance:
+                break
+        inside = float(weights.sum())
+        return CentroidResult(position, width, start.snr, self._captured(levels, img, threshold, background, noise, inside))
+
+
+class GaussianFit(CentroidAlgorithm):
+    """Subpixel centre from a least squares fit of an elliptical 2D Gaussian.
+
+    Fits amplitude, centre, widths along y and x and a constant background
+    by Gauss-Newton iterations in a window around the :class:`WindowedCentroid`
+    estimate, leaving out saturated pixels. Quality is the R^2 of the fit;
+    when the fit fails the windowed estimate is returned with quality 0.
+
+    Args:
+        half_size (int): half side of the fit window [px]
+        iterations (int): most Gauss-Newton steps
+        saturation (int): counts of a saturated pixel
+    """
+    name = 'gaussian'
+
+    def __init__(self, half_size=12, iterations=10, saturation=255, **kwargs):
+        super().__init__(**kwargs)
+        self.half_size = half_size
+        self.iterations = iterations
+        self.saturation = saturation
+        self.start = WindowedCentroid(half_size=half_size)
+
+    def _centroid(self, img, threshold, levels, background, noise):
+        start = self.start._centroid(img, threshold, levels, background, noise)
+        if np.isnan(start.position).any():
+            return start
+        y0, x0, window = self.start._window(img, start.position)
+        data = window.astype(np.float64)
+        valid = (window < self.saturation).ravel()
+        yy, xx = np.indices(window.shape)
+        yy, xx, d = yy.ravel()[valid], xx.ravel()[valid], data.ravel()[valid]
+        if d.size < 8:
+            return start._replace(quality=0.)
+        sigma = max(start.width / np.sqrt(2), 0.5)
+        p = np.array([data.max() - background, start.position[0] - y0, start.position[1] - x0, sigma, sigma, background])
+        with np.errstate(all='ignore'):
+            for _ in range(self.iterations):
+                amplitude, cy, cx, sy, sx, offset = p
+                dy, dx = (yy - cy) / sy, (xx - cx) / sx
+                g = np.exp(-0.5 * (dy ** 2 + dx ** 2))
+                r = d - (amplitude * g + offset)
+                ag = amplitude * g
+                J = np.stack([g, ag * dy / sy, ag * dx / sx, ag * dy ** 2 / sy, ag * dx ** 2 / sx, np.ones_like(g)], axis=1)
+                step = np.linalg.lstsq(J, r, rcond=None)[0]
+                p = p + step
+                if not np.isfinite(p).all():
+                    return start._replace(quality=0.)
+                if np.abs(step[1:3]).max() < 1e-4:
+                    break
+            amplitude, cy, cx, sy, sx, offset = p
+            h, w = window.shape
+            if amplitude <= 0 or not (0 <= cy < h and 0 <= cx < w):
+                return start._replace(quality=0.)
+            r = d - (amplitude * np.exp(-0.5 * (((yy - cy) / sy) ** 2 + ((xx - cx) / sx) ** 2)) + offset)
+        ss_tot = ((d - d.mean()) ** 2).sum()
+        quality = float(np.clip(1 - (r ** 2).sum() / ss_tot, 0, 1)) if ss_tot > 0 else 0.
+        width = np.sqrt(sy ** 2 + sx ** 2)
+        return CentroidResult(np.array([cy + y0, cx + x0]), width, start.snr, quality)
+
+
+ALGORITHMS = {cls.name: cls for cls in (ThresholdMoments, WeightedMoments, WindowedCentroid, GaussianFit)}
+
+
+def get_algorithm(algorithm='threshold', **kwargs):
+    """Centroid algorithm by name (see ALGORITHMS), or `algorithm` itself if already one."""
+    if callable(algorithm):
+        return algorithm
+    try:
+        return ALGORITHMS[algorithm](**kwargs)
+    except KeyError:
+        raise ValueError(f'unknown centroid algorithm {algorithm!r}, choose from {", ".join(ALGORITHMS)}')
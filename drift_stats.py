@@ -0,0 +1,293 @@
+"""
+Streaming drift statistics of the StarGuide beam centroids.
+
+:class:`DriftStats` is fed the centroid samples one at a time and keeps,
+for each centroid coordinate (:data:`AXES`):
+
+- the overlapping Allan deviation at log-spaced averaging times tau. The
+  full rate series gives tau = 1, 2, 3, 4 and 6 samples; each octave below
+  it is the series averaged in pairs once more and gives 4 and 6 of its
+  samples, so tau = 8, 12, 16, 24, ... samples. Successive estimates at an
+  octave overlap by all but 2**octave samples.
+- a Welch PSD: Hann windowed segments of `nfft` samples, overlapping by
+  half, averaged since the start or the last :meth:`DriftStats.reset`.
+- the RMS deviation from the mean of the last `window` samples.
+
+Memory is fixed by the constructor arguments and a sample costs the same
+however long the run (a PSD segment is transformed every nfft/2 samples),
+and the queries read the accumulators instead of going over the history.
+Samples are taken as evenly spaced at their mean interval; a sample
+without a spot (NaN) only drops the estimates it is part of.
+
+    stats = DriftStats()
+    stats.add(time(), centroids)
+    taus, adev, counts = stats.allan()
+    freqs, psd, segments = stats.psd()
+    stats.rms()
+
+Other processes see the statistics through a snapshot file, which
+:meth:`DriftStats.save` replaces as a whole, so :func:`load` never reads
+a half written one:
+
+    stats.save('drift_stats.npz')
+    snapshot = load('drift_stats.npz')
+"""
+import os
+import argparse
+import threading
+from time import time
+from collections import namedtuple
+import numpy as np
+from centroid_log import CentroidLog
+
+AXES = ('cam1 y', 'cam1 x', 'cam2 y', 'cam2 x')  # order of the flattened (2, 2) centroids
+ALLAN_LAGS = (1, 2, 3, 4, 6)  # averaging windows of the full rate series [samples]
+OCTAVE_LAGS = (4, 6)  # averaging windows of each octave below [samples of that octave]
+
+DriftSnapshot = namedtuple('DriftSnapshot', ['time', 'n', 'interval', 'window', 'taus', 'adev', 'counts',
+                                             'freqs', 'psd', 'segments', 'rms'])
+DriftSnapshot.__doc__ = """The statistics of a :class:`DriftStats` at `time` [s since epoch],
+after `n` samples `interval` [s] apart: the results of its
+:meth:`~DriftStats.allan`, :meth:`~DriftStats.psd` and
+:meth:`~DriftStats.rms` over the last `window` samples."""
+
+
+class _Octave:
+    """Allan variance accumulators of the series averaged in pairs `level` times."""
+    def __init__(self, level, lags):
+        self.level = level
+        self.lags = np.array(lags)
+        # the values before the next ones that the longest lag reaches back to, NaN before the first
+        self._history = np.full((2 * max(lags) - 1, len(AXES)), np.nan)
+        self._pair = None  # value waiting for its pair
+        self.sq = np.zeros((len(lags), len(AXES)))  # sums of the squared differences of adjacent means
+        self.count = np.zeros((len(lags), len(AXES)), dtype=np.int64)
+
+    def add(self, y):
+        """Add the (n, 4) values `y`; the means of their pairs, for the octave below."""
+        h = len(self._history)
+        values = np.concatenate((self._history, y))
+        bad = ~np.isfinite(values)
+        zero = np.zeros((1, len(AXES)))
+        sums = np.concatenate((zero, np.cumsum(np.where(bad, 0., values), axis=0)))
+        bads = np.concatenate((zero, np.cumsum(bad, axis=0)))
+        end = np.arange(h + 1, len(values) + 1)  # index in sums just past each new value
+        for j, m in enumerate(self.lags):
+            # mean of the m values up to the new one minus the mean of the m before them
+            d = (sums[end] - 2 * sums[end - m] + sums[end - 2 * m]) / m
+            ok = bads[end] == bads[end - 2 * m]
+            self.sq[j] += np.where(ok, d * d, 0.).sum(axis=0)
+            self.count[j] += ok.sum(axis=0)
+        self._history = values[-h:]
+        if self._pair is not None:
+            y = np.concatenate((self._pair[None], y))
+        n = len(y) // 2 * 2
+        self._pair = y[n] if len(y) > n else None
+        return (y[0:n:2] + y[1:n:2]) / 2
+
+
+class DriftStats:
+    """Allan deviation, PSD and rolling RMS of the centroid stream, updated with every sample.
+
+    Samples are collected in blocks of BLOCK and worked in one go when the
+    block is full or the statistics are queried. They may be added from one
+    thread and queried from others.
+
+    Args:
+        octaves (int): octaves of tau past ALLAN_LAGS, the longest tau is 6 * 2**octaves samples
+        nfft (int): samples per PSD segment, even
+        window (int): samples of the rolling RMS
+    """
+    BLOCK = 1024
+
+    def __init__(self, octaves=20, nfft=1024, window=1000):
+        self.octaves = octaves
+        self.nfft = nfft
+        self.window = window
+        self._lock = threading.Lock()
+        self._hann = np.hanning(nfft)[:, None]
+        self._block = np.empty((self.BLOCK, len(AXES)))
+        self.reset()
+
+    def reset(self):
+        """Forget all samples."""
+        with self._lock:
+            self.n = 0
+            self._t_first = self._t_last = np.nan
+            self._b = 0  # samples in the block
+            self._octaves = [_Octave(0, ALLAN_LAGS)] + [_Octave(level, OCTAVE_LAGS) for level in range(1, self.octaves + 1)]
+            self._segment = np.empty((self.nfft, len(AXES)))
+            self._k = 0  # samples in the current segment
+            self._power = np.zeros((self.nfft // 2 + 1, len(AXES)))
+            self._segments = np.zeros(len(AXES), dtype=np.int64)
+            self._ring = np.full((self.window, len(AXES)), np.nan)
+            self._j = 0
+            self._sum = np.zeros(len(AXES))
+            self._sumsq = np.zeros(len(AXES))
+            self._finite = np.zeros(len(AXES), dtype=np.int64)
+
+    def add(self, t, centroids):
+        """Add the sample taken at `t` [s]: (2, 2) `centroids` [px], NaN without a spot."""
+        with self._lock:
+            if not self.n:
+                self._t_first = t
+            self._t_last = t
+            self.n += 1
+            self._block[self._b] = np.reshape(centroids, len(AXES))
+            self._b += 1
+            if self._b == self.BLOCK:
+                self._flush()
+
+    def extend(self, times, centroids):
+        """Add the samples at `times`, e.g. the records of a centroid log."""
+        if not len(times):
+            return
+        y = np.asarray(centroids, dtype=float).reshape(len(times), len(AXES))
+        with self._lock:
+            self._flush()
+            if not self.n:
+                self._t_first = times[0]
+            self._t_last = times[-1]
+            self.n += len(times)
+            for i in range(0, len(y), self.BLOCK):
+                self._work(y[i:i + self.BLOCK])
+
+    def _flush(self):
+        if self._b:
+            self._work(self._block[:self._b])
+            self._b = 0
+
+    def _work(self, y):
+        values = y
+        for octave in self._octaves:
+            values = octave.add(values)
+            if not len(values):
+                break
+        self._add_psd(y)
+        self._add_rms(y)
+
+    def _add_psd(self, y):
+        half = self.nfft // 2
+        while len(y):
+            k = min(self.nfft - self._k, len(y))
+            self._segment[self._k:self._k + k] = y[:k]
+            self._k += k
+            y = y[k:]
+            if self._k < self.nfft:
+                return
+            segment = self._segment
+            ok = np.isfinite(segment).all(axis=0)
+            x = (segment[:, ok] - segment[:, ok].mean(axis=0)) * self._hann
+            self._power[:, ok] += np.abs(np.fft.rfft(x, axis=0)) ** 2
+            self._segments += ok
+            segment[:half] = segment[half:]
+            self._k = half
+
+    def _add_rms(self, y):
+        while len(y):
+            j = self._j
+            k = min(self.window - j, len(y))
+            for values, sign in ((self._ring[j:j + k], -1), (y[:k], 1)):
+                ok = np.isfinite(values)
+                self._sum += sign * np.where(ok, values, 0.).sum(axis=0)
+                self._sumsq += sign * np.where(ok, values * values, 0.).sum(axis=0)
+                self._finite += sign * ok.sum(axis=0)
+            self._ring[j:j + k] = y[:k]
+            y = y[k:]
+            self._j = (j + k) % self.window
+            if not self._j:
+                # the running sums start over from the ring once per window, so rounding does not pile up
+                self._sum = np.nansum(self._ring, axis=0)
+                self._sumsq = np.nansum(self._ring * self._ring, axis=0)
+                self._finite = np.isfinite(self._ring).sum(axis=0)
+
+    @property
+    def interval(self):
+        """Mean interval between the samples [s], NaN before the second."""
+        return (self._t_last - self._t_first) / (self.n - 1) if self.n > 1 else np.nan
+
+    def allan(self):
+        """Overlapping Allan deviation of each axis.
+
+        Returns:
+            tuple: (taus [s], adev [px] of shape (len(taus), 4), number of
+            differences behind each value), for the taus with an estimate
+            on any axis; NaN where an axis has none.
+        """
+        with self._lock:
+            self._flush()
+            interval = self.interval
+            lags = np.concatenate([octave.lags * 2 ** octave.level for octave in self._octaves])
+            sq = np.concatenate([octave.sq for octave in self._octaves])
+            counts = np.concatenate([octave.count for octave in self._octaves])
+        used = counts.any(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            adev = np.sqrt(sq[used] / (2 * counts[used]))
+        return lags[used] * interval, adev, counts[used]
+
+    def psd(self):
+        """Welch PSD of each axis.
+
+        Returns:
+            tuple: (frequencies [Hz], one-sided PSD [px**2/Hz] of shape
+            (nfft/2 + 1, 4), segments averaged per axis); empty before the
+            first segment, NaN on an axis without one.
+        """
+        with self._lock:
+            self._flush()
+            interval = self.interval
+            power = self._power.copy()
+            segments = self._segments.copy()
+        if not segments.any():
+            return np.empty(0), np.empty((0, len(AXES))), segments
+        with np.errstate(invalid='ignore', divide='ignore'):
+            psd = power / segments * interval / (self._hann ** 2).sum()
+        psd[1:-1] *= 2
+        return np.fft.rfftfreq(self.nfft, interval), psd, segments
+
+    def rms(self):
+        """RMS deviation of each axis from its mean over the last `window` samples [px], NaN without samples."""
+        with self._lock:
+            self._flush()
+            n, total, total_sq = self._finite.copy(), self._sum.copy(), self._sumsq.copy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+            return np.sqrt(np.maximum(total_sq / n - mean * mean, 0.))
+
+    def snapshot(self):
+        """The current statistics, as a :class:`DriftSnapshot`."""
+        taus, adev, counts = self.allan()
+        freqs, psd, segments = self.psd()
+        return DriftSnapshot(time(), self.n, self.interval, self.window, taus, adev, counts, freqs, psd, segments, self.rms())
+
+    def save(self, path):
+        """Write :meth:`snapshot` to `path`, replacing the previous one in one step."""
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **self.snapshot()._asdict())
+        os.replace(tmp, path)
+
+
+def load(path):
+    """The :class:`DriftSnapshot` last saved to `path`."""
+    with np.load(path) as f:
+        return DriftSnapshot(*(f[name][()] for name in DriftSnapshot._fields))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Allan deviation, PSD and RMS of a centroid log.')
+    parser.add_argument('path', help='Centroid log, see centroid_log.py')
+    parser.add_argument('-s', '--start', dest='start', help='Start time [s since epoch]', type=float, default=-np.inf)
+    parser.add_argument('-e', '--end', dest='end', help='End time [s since epoch]', type=float, default=np.inf)
+    parser.add_argument('-n', '--nfft', dest='nfft', help='Samples per PSD segment', type=int, default=1024)
+    args = parser.parse_args()
+
+    records = CentroidLog(args.path).range(args.start, args.end)
+    stats = DriftStats(nfft=args.nfft, window=max(len(records), 1))
+    stats.extend(records['time'], records['centroids'])
+    print(f'{stats.n} samples, {stats.interval * 1e3:.2f} ms apart')
+    print('rms [px]      ' + ''.join(f'{a:>10}' for a in AXES))
+    print('              ' + ''.join(f'{v:10.4f}' for v in stats.rms()))
+    print('tau [s]       ' + ''.join(f'{a:>10}' for a in AXES))
+    for tau, adev in zip(*stats.allan()[:2]):
+        print(f'{tau:<14.4g}' + ''.join(f'{v:10.4f}' for v in adev))
@@ -0,0 +1,560 @@
+"""
+Stand-in for the pyueye ``ueye`` API, for running uEyeCamera without a camera.
+
+Implements the subset of the API used in `newfocus_v2.py` on top of a
+simulated sensor that renders a Gaussian beam spot (plus noise) at a set
+frame rate into the image memory sequence, with the same queue semantics
+as the driver: completed frames wait, locked, until :func:`is_WaitForNextImage`
+hands them out and :func:`is_UnlockSeqBuf` returns them; when no memory is
+free the frame is dropped.
+
+    import fake_ueye
+    fake_ueye.configure(1, spot=(610, 547), fps=30)
+    cam = uEyeCamera(1, backend=fake_ueye)
+"""
+import ctypes
+import threading
+from collections import deque
+from time import monotonic, sleep
+import numpy as np
+
+IS_SUCCESS = 0
+IS_NO_SUCCESS = -1
+IS_INVALID_PARAMETER = 125
+IS_TIMED_OUT = 122
+IS_DONT_WAIT = 0
+IS_WAIT = 1
+IS_FORCE_VIDEO_STOP = 0x4000
+IS_SET_DM_DIB = 1
+IS_COLORMODE_MONOCHROME = 1
+IS_COLORMODE_BAYER = 2
+IS_COLORMODE_CBYCRY = 4
+IS_CM_BGRA8_PACKED = 0
+IS_CM_BGR8_PACKED = 1
+IS_CM_MONO8 = 6
+IS_CM_SENSOR_RAW8 = 11
+IS_AOI_IMAGE_SET_AOI = 0x0001
+IS_AOI_IMAGE_GET_AOI = 0x0002
+IS_PIXELCLOCK_CMD_GET_RANGE = 3
+IS_PIXELCLOCK_CMD_GET = 5
+IS_PIXELCLOCK_CMD_SET = 6
+IS_GET_BINNING = 0x8000
+IS_GET_SUPPORTED_BINNING = 0x8001
+IS_BINNING_DISABLE = 0
+IS_BINNING_2X_VERTICAL = 0x0001
+IS_BINNING_2X_HORIZONTAL = 0x0020
+IS_BINNING_3X_VERTICAL = 0x0002
+IS_BINNING_3X_HORIZONTAL = 0x0040
+IS_BINNING_4X_VERTICAL = 0x0004
+IS_BINNING_4X_HORIZONTAL = 0x0080
+IS_GET_SUBSAMPLING = 0x8000
+IS_GET_SUPPORTED_SUBSAMPLING = 0x8001
+IS_SUBSAMPLING_DISABLE = 0
+IS_SUBSAMPLING_2X_VERTICAL = 0x0001
+IS_SUBSAMPLING_2X_HORIZONTAL = 0x0002
+IS_SUBSAMPLING_4X_VERTICAL = 0x0004
+IS_SUBSAMPLING_4X_HORIZONTAL = 0x0008
+IS_SUBSAMPLING_3X_VERTICAL = 0x0010
+IS_SUBSAMPLING_3X_HORIZONTAL = 0x0020
+IS_EXPOSURE_CMD_GET_EXPOSURE = 7
+IS_EXPOSURE_CMD_GET_EXPOSURE_RANGE = 11
+IS_EXPOSURE_CMD_SET_EXPOSURE = 12
+IS_GET_EXTERNALTRIGGER = 0x8000
+IS_SET_TRIGGER_OFF = 0x0000
+IS_SET_TRIGGER_HI_LO = 0x0001
+IS_SET_TRIGGER_LO_HI = 0x0002
+IS_SET_TRIGGER_SOFTWARE = 0x0008
+
+
+class _value:
+    """Arithmetic on the wrapped value, as the pyueye ctypes types allow."""
+    def __int__(self):
+        return self.value.__int__()
+
+    def __index__(self):
+        return self.value.__index__()
+
+    def __float__(self):
+        return float(self.value)
+
+    def __eq__(self, other):
+        return self.value == getattr(other, 'value', other)
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __truediv__(self, other):
+        return self.value / getattr(other, 'value', other)
+
+    def __floordiv__(self, other):
+        return self.value // getattr(other, 'value', other)
+
+    def __mul__(self, other):
+        return self.value * getattr(other, 'value', other)
+
+    __rmul__ = __mul__
+
+
+class HIDS(_value, ctypes.c_uint):
+    pass
+
+
+class INT(_value, ctypes.c_int):
+    pass
+
+
+class UINT(_value, ctypes.c_uint):
+    pass
+
+
+class double(_value, ctypes.c_double):
+    pass
+
+
+int = INT  # as in pyueye; shadows the builtin in this module, avoid int() below
+c_mem_p = ctypes.c_void_p
+
+
+def sizeof(obj):
+    return UINT(0)
+
+
+class IS_RECT:
+    def __init__(self):
+        self.s32X, self.s32Y = INT(0), INT(0)
+        self.s32Width, self.s32Height = INT(0), INT(0)
+
+
+class SENSORINFO:
+    def __init__(self):
+        self.strSensorName = b''
+        self.nColorMode = ctypes.c_char(b'\x00')
+        self.nMaxWidth, self.nMaxHeight = UINT(0), UINT(0)
+
+
+class CAMINFO:
+    def __init__(self):
+        self.SerNo = b''
+
+
+class UEYEIMAGEINFO:
+    def __init__(self):
+        self.u64FrameNumber = ctypes.c_uint64(0)
+        self.u64TimestampDevice = ctypes.c_uint64(0)
+
+
+class FakeCamera:
+    """Simulated sensor of one camera handle.
+
+    Args:
+        width, height (int): sensor size [px]
+        fps (float): frame rate in free run mode, at most what the pixel
+            clock allows for the AOI
+        spot (tuple): beam centre (x, y) [px], or a callable of time [s]
+            returning it, to make the beam move
+        sigma (float): Gaussian width of the spot [px]
+        amplitude (float): peak counts
+        noise (float): background noise standard deviation [counts]
+        color_mode (int): IS_COLORMODE_* of the sensor
+    """
+    binning_modes = {2: IS_BINNING_2X_VERTICAL | IS_BINNING_2X_HORIZONTAL,
+                     4: IS_BINNING_4X_VERTICAL | IS_BINNING_4X_HORIZONTAL}
+    subsampling_modes = {2: IS_SUBSAMPLING_2X_VERTICAL | IS_SUBSAMPLING_2X_HORIZONTAL,
+                         4: IS_SUBSAMPLING_4X_VERTICAL | IS_SUBSAMPLING_4X_HORIZONTAL}
+    pixelclock_range = (5, 86, 1)  # MHz
+
+    def __init__(self, width=1280, height=1024, fps=14., spot=(640, 512), sigma=6.,
+                 amplitude=230., noise=4., color_mode=IS_COLORMODE_MONOCHROME, name=b'FAKE-SENSOR'):
+        self.sensor = (width, height)
+        self.binning = self.subsampling = 1
+        self.fps = fps
+        self.exposure = 10.  # ms
+        self.spot = spot
+        self.sigma = sigma
+        self.amplitude = amplitude
+        self.noise = noise
+        self.color_mode = color_mode
+        self.name = name
+        self.aoi = (0, 0, width, height)
+        self.pixelclock = 30
+        self.memories = {}  # MemID -> (ndarray, bits per pixel, width, height)
+        self.sequence = []  # MemIDs in capture order
+        self.free = deque()
+        self.queue = deque()  # (MemID, frame number, device timestamp) ready
+        self.locked = {}  # MemID -> (frame number, device timestamp) handed out
+        self.cond = threading.Condition()
+        self.frame_number = 0
+        self.dropped = 0
+        self.running = False
+        self.trigger_mode = IS_SET_TRIGGER_OFF
+        self.triggers = 0  # triggers waiting for an exposure
+        self._noise = np.random.default_rng(0).normal(0, 1, 2 * width * height).astype(np.float32)
+
+    @property
+    def factor(self):
+        return self.binning * self.subsampling
+
+    @property
+    def width(self):
+        return self.sensor[0] // self.factor
+
+    @property
+    def height(self):
+        return self.sensor[1] // self.factor
+
+    def frame_time_range(self):
+        """Shortest and longest frame time [s] at the pixel clock and AOI."""
+        _, _, w, h = self.aoi
+        return 1.1 * w * h / (self.pixelclock * 1e6) + 2e-4, 10.
+
+    def render(self, t):
+        """Synthetic mono frame of the current AOI at time `t`."""
+        x0, y0, w, h = self.aoi
+        sx, sy = self.spot(t) if callable(self.spot) else self.spot
+        # binned/subsampled pixels cover `factor` sensor pixels
+        f = self.factor
+        sx, sy, sigma = (sx - (f - 1) / 2) / f, (sy - (f - 1) / 2) / f, self.sigma / f
+        gx = np.exp(-0.5 * ((np.arange(x0, x0 + w) - sx) / sigma) ** 2)
+        gy = np.exp(-0.5 * ((np.arange(y0, y0 + h) - sy) / sigma) ** 2)
+        img = self.amplitude * np.outer(gy, gx)
+        k = (self.frame_number * 7919) % (self._noise.size - w * h)
+        img += 20 + self.noise * self._noise[k:k + w * h].reshape(h, w)
+        return np.clip(img, 0, 255).astype(np.uint8)
+
+    def capture_worker(self):
+        t0 = monotonic()
+        next_t = t0
+        while self.running:
+            if self.trigger_mode != IS_SET_TRIGGER_OFF:
+                # one exposure per trigger
+                with self.cond:
+                    while self.running and not self.triggers:
+                        self.cond.wait()
+                    if not self.running:
+                        return
+                    self.triggers -= 1
+                sleep(self.exposure * 1e-3)
+                self.expose(monotonic() - t0)
+                next_t = monotonic()
+                continue
+            next_t += 1. / self.fps
+            delay = next_t - monotonic()
+            if delay > 0:
+                with self.cond:
+                    self.cond.wait(delay)
+                    if not self.running:
+                        return
+            self.expose(monotonic() - t0)
+
+    def expose(self, t):
+        """Render one frame into the next free image memory."""
+        with self.cond:
+            if not self.free:
+                self.dropped += 1
+                self.frame_number += 1
+                return
+            mem_id = self.free.popleft()
+        buf, bits, width, _ = self.memories[mem_id]
+        img = self.render(t)
+        h, w = img.shape
+        # an AOI smaller than the memory fills its top left corner, rows keep the memory pitch
+        view = buf.reshape(-1, width * bits // 8)[:h, :w * bits // 8].reshape(h, w, bits // 8)
+        view[...] = img[:, :, None]
+        with self.cond:
+            self.frame_number += 1
+            self.queue.append((mem_id, self.frame_number, round(t * 1e7)))
+            self.cond.notify_all()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        busy = {q[0] for q in self.queue} | set(self.locked)
+        self.free = deque(m for m in self.sequence if m not in busy)
+        self.thread = threading.Thread(target=self.capture_worker, daemon=True)
+        self.thread.start()
+
+    def trigger(self):
+        with self.cond:
+            self.triggers += 1
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.triggers = 0
+            self.cond.notify_all()
+        if getattr(self, 'thread', None) is not None:
+            self.thread.join()
+
+
+# camera ID -> FakeCamera; configure() before opening the camera to change the defaults
+CAMERAS = {}
+_handles = {}
+_next_mem = [1]
+
+
+def configure(hid, **kwargs):
+    CAMERAS[hid] = FakeCamera(**kwargs)
+    return CAMERAS[hid]
+
+
+def _cam(hCam):
+    return _handles[hCam.value if hasattr(hCam, 'value') else hCam]
+
+
+def is_InitCamera(hCam, hWnd):
+    hid = hCam.value
+    if hid not in CAMERAS:
+        configure(hid)
+    _handles[hid] = CAMERAS[hid]
+    return IS_SUCCESS
+
+
+def is_ExitCamera(hCam):
+    _cam(hCam).stop()
+    _handles.pop(hCam.value, None)
+    return IS_SUCCESS
+
+
+def is_GetCameraInfo(hCam, cInfo):
+    cInfo.SerNo = b'%010d' % hCam.value
+    return IS_SUCCESS
+
+
+def is_GetSensorInfo(hCam, sInfo):
+    cam = _cam(hCam)
+    sInfo.strSensorName = cam.name
+    sInfo.nColorMode = ctypes.c_char(bytes([cam.color_mode]))
+    sInfo.nMaxWidth.value, sInfo.nMaxHeight.value = cam.sensor
+    return IS_SUCCESS
+
+
+def is_ResetToDefault(hCam):
+    cam = _cam(hCam)
+    cam.binning = cam.subsampling = 1
+    cam.aoi = (0, 0, cam.width, cam.height)
+    return IS_SUCCESS
+
+
+def is_SetDisplayMode(hCam, mode):
+    return IS_SUCCESS
+
+
+def is_GetColorDepth(hCam, nBitsPerPixel, nColorMode):
+    nBitsPerPixel.value, nColorMode.value = 24, IS_CM_BGR8_PACKED
+    return IS_SUCCESS
+
+
+def is_SetColorMode(hCam, mode):
+    return IS_SUCCESS
+
+
+def is_AOI(hCam, command, rect, size):
+    cam = _cam(hCam)
+    if command == IS_AOI_IMAGE_GET_AOI:
+        x, y, w, h = cam.aoi
+        rect.s32X.value, rect.s32Y.value, rect.s32Width.value, rect.s32Height.value = x, y, w, h
+        return IS_SUCCESS
+    if command == IS_AOI_IMAGE_SET_AOI:
+        x, y, w, h = rect.s32X.value, rect.s32Y.value, rect.s32Width.value, rect.s32Height.value
+        if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > cam.width or y + h > cam.height:
+            return IS_INVALID_PARAMETER
+        cam.aoi = (x, y, w, h)
+        return IS_SUCCESS
+    return IS_INVALID_PARAMETER
+
+
+def _set_factor(cam, mode, attr, modes, get, get_supported):
+    if mode == get_supported:
+        supported = 0
+        for m in modes.values():
+            supported |= m
+        return supported
+    if mode == get:
+        return modes.get(getattr(cam, attr), 0)
+    factors = [f for f, m in modes.items() if m == mode]
+    if mode and not factors:
+        return IS_INVALID_PARAMETER
+    setattr(cam, attr, factors[0] if factors else 1)
+    cam.aoi = (0, 0, cam.width, cam.height)
+    return IS_SUCCESS
+
+
+def is_SetBinning(hCam, mode):
+    return _set_factor(_cam(hCam), mode, 'binning', FakeCamera.binning_modes, IS_GET_BINNING, IS_GET_SUPPORTED_BINNING)
+
+
+def is_SetSubSampling(hCam, mode):
+    return _set_factor(_cam(hCam), mode, 'subsampling', FakeCamera.subsampling_modes,
+                       IS_GET_SUBSAMPLING, IS_GET_SUPPORTED_SUBSAMPLING)
+
+
+def is_GetFrameTimeRange(hCam, min, max, intervall):
+    min.value, max.value = _cam(hCam).frame_time_range()
+    intervall.value = 1e-5
+    return IS_SUCCESS
+
+
+def is_SetFrameRate(hCam, FPS, newFPS):
+    cam = _cam(hCam)
+    t_min, t_max = cam.frame_time_range()
+    cam.fps = float(np.clip(FPS.value, 1 / t_max, 1 / t_min))
+    cam.exposure = float(np.minimum(cam.exposure, 1e3 / cam.fps))
+    newFPS.value = cam.fps
+    return IS_SUCCESS
+
+
+def is_Exposure(hCam, nCommand, pParam, cbSizeOfParam):
+    cam = _cam(hCam)
+    if nCommand == IS_EXPOSURE_CMD_GET_EXPOSURE_RANGE:
+        pParam[0], pParam[1], pParam[2] = 0.01, 1e3 / cam.fps, 0.01
+    elif nCommand == IS_EXPOSURE_CMD_GET_EXPOSURE:
+        pParam.value = cam.exposure
+    elif nCommand == IS_EXPOSURE_CMD_SET_EXPOSURE:
+        cam.exposure = float(np.clip(pParam.value, 0.01, 1e3 / cam.fps))
+        pParam.value = cam.exposure
+    else:
+        return IS_INVALID_PARAMETER
+    return IS_SUCCESS
+
+
+def is_PixelClock(hCam, command, param, size):
+    cam = _cam(hCam)
+    if command == IS_PIXELCLOCK_CMD_GET_RANGE:
+        param[0], param[1], param[2] = cam.pixelclock_range
+    elif command == IS_PIXELCLOCK_CMD_SET:
+        low, high, _ = cam.pixelclock_range
+        if not low <= param.value <= high:
+            return IS_INVALID_PARAMETER
+        cam.pixelclock = param.value
+    elif command == IS_PIXELCLOCK_CMD_GET:
+        param.value = cam.pixelclock
+    else:
+        return IS_INVALID_PARAMETER
+    return IS_SUCCESS
+
+
+def is_AllocImageMem(hCam, width, height, bits, pcMem, memID):
+    cam = _cam(hCam)
+    mem_id = _next_mem[0]
+    _next_mem[0] += 1
+    buf = np.zeros(width.value * height.value * bits.value // 8, dtype=np.uint8)
+    cam.memories[mem_id] = (buf, bits.value, width.value, height.value)
+    pcMem.value, memID.value = mem_id, mem_id
+    return IS_SUCCESS
+
+
+def is_SetImageMem(hCam, pcMem, memID):
+    return IS_SUCCESS
+
+
+def is_AddToSequence(hCam, pcMem, memID):
+    _cam(hCam).sequence.append(memID.value)
+    return IS_SUCCESS
+
+
+def is_ClearSequence(hCam):
+    cam = _cam(hCam)
+    cam.sequence = []
+    cam.free.clear()
+    cam.queue.clear()
+    return IS_SUCCESS
+
+
+def is_FreeImageMem(hCam, pcMem, memID):
+    cam = _cam(hCam)
+    cam.memories.pop(memID.value, None)
+    return IS_SUCCESS
+
+
+def is_InitImageQueue(hCam, mode):
+    return IS_SUCCESS
+
+
+def is_ExitImageQueue(hCam):
+    # frames not yet handed out are discarded
+    cam = _cam(hCam)
+    with cam.cond:
+        cam.queue.clear()
+    return IS_SUCCESS
+
+
+def is_CaptureVideo(hCam, wait):
+    _cam(hCam).start()
+    return IS_SUCCESS
+
+
+def is_FreezeVideo(hCam, wait):
+    # in software trigger mode: one frame per call
+    cam = _cam(hCam)
+    cam.start()
+    cam.trigger()
+    return IS_SUCCESS
+
+
+def is_SetExternalTrigger(hCam, nTriggerMode):
+    cam = _cam(hCam)
+    if nTriggerMode == IS_GET_EXTERNALTRIGGER:
+        return cam.trigger_mode
+    if nTriggerMode not in (IS_SET_TRIGGER_OFF, IS_SET_TRIGGER_HI_LO, IS_SET_TRIGGER_LO_HI, IS_SET_TRIGGER_SOFTWARE):
+        return IS_INVALID_PARAMETER
+    cam.trigger_mode = nTriggerMode
+    return IS_SUCCESS
+
+
+def fire(*hids):
+    """Edge on the trigger input of cameras `hids` in hardware trigger mode, e.g. from a common pulse generator."""
+    for hid in hids:
+        cam = _handles[hid]
+        if cam.running and cam.trigger_mode in (IS_SET_TRIGGER_HI_LO, IS_SET_TRIGGER_LO_HI):
+            cam.trigger()
+
+
+def is_StopLiveVideo(hCam, wait):
+    _cam(hCam).stop()
+    return IS_SUCCESS
+
+
+def is_InquireImageMem(hCam, pcMem, memID, width, height, bits, pitch):
+    cam = _cam(hCam)
+    _, b, w, h = cam.memories[memID.value]
+    width.value, height.value, bits.value = w, h, b
+    pitch.value = w * b // 8
+    return IS_SUCCESS
+
+
+def is_WaitForNextImage(hCam, timeout, pcMem, memID):
+    cam = _cam(hCam)
+    with cam.cond:
+        if not cam.queue and timeout:
+            cam.cond.wait(timeout / 1e3)
+        if not cam.queue:
+            return IS_TIMED_OUT
+        mem_id, number, stamp = cam.queue.popleft()
+        cam.locked[mem_id] = (number, stamp)
+    pcMem.value, memID.value = mem_id, mem_id
+    return IS_SUCCESS
+
+
+def is_GetImageInfo(hCam, memID, info, size):
+    cam = _cam(hCam)
+    number, stamp = cam.locked[memID.value]
+    info.u64FrameNumber.value, info.u64TimestampDevice.value = number, stamp
+    return IS_SUCCESS
+
+
+def is_UnlockSeqBuf(hCam, nNum, pcMem):
+    cam = _cam(hCam)
+    with cam.cond:
+        mem_id = nNum.value if hasattr(nNum, 'value') else nNum
+        if cam.locked.pop(mem_id, None) is not None and mem_id in cam.sequence:
+            cam.free.append(mem_id)
+    return IS_SUCCESS
+
+
+def get_data(image_mem, x, y, bits, pitch, copy):
+    cam = next(c for c in _handles.values() if image_mem.value in c.memories)
+    buf = cam.memories[image_mem.value][0]
+    data = buf[:y.value * pitch.value]
+    return data.copy() if copy else data
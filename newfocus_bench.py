@@ -0,0 +1,133 @@
+"""
+Throughput/latency benchmark for the 8742 drivers.
+
+Runs the drivers against the simulated controller from `newfocus_sim.py`
+(USB endpoints and TCP server), so protocol changes can be measured without
+hardware. For every path it reports commands/sec and p50/p99 latency of one
+transaction:
+
+    do          one command per transfer, no reply
+    ask         one query per transfer, one-request-at-a-time
+    batch       `batch_size` queries packed in one line
+    pipelined   `depth` queries kept in flight (TCP only)
+"""
+import json
+import itertools
+import argparse
+import asyncio
+from time import perf_counter
+import numpy as np
+from newfocus_v2 import NewFocus8742TCP, NewFocus8742USB
+from newfocus_sim import NewFocus8742Model, NewFocus8742Server, SimulatedUSBEndpoints
+
+
+def report(name, latencies, elapsed, per=1):
+    """Print and return commands/sec and round-trip percentiles.
+
+    Args:
+        latencies (ndarray): seconds per transaction
+        elapsed (float): wall time of the whole run
+        per (int): commands per transaction
+    """
+    lat = np.asarray(latencies) * 1e3
+    r = {
+        'name': name,
+        'cmd_per_s': per * len(lat) / elapsed,
+        'p50_ms': np.percentile(lat, 50),
+        'p99_ms': np.percentile(lat, 99),
+    }
+    print(f"{name:>24}: {r['cmd_per_s']:9.0f} cmd/s   "
+          f"p50 {r['p50_ms']:7.3f} ms   p99 {r['p99_ms']:7.3f} ms")
+    return r
+
+
+def timed(f, n):
+    latencies = np.empty(n)
+    t0 = perf_counter()
+    for i in range(n):
+        t = perf_counter()
+        f()
+        latencies[i] = perf_counter() - t
+    return latencies, perf_counter() - t0
+
+
+def bench_do(mc, n):
+    # alternate the value: the shadow skips a write that changes nothing, which would never reach the wire
+    values = itertools.cycle((2000, 2001))
+    return timed(lambda: mc.set_velocity(1, next(values)), n)
+
+
+def bench_sequential(mc, n, cmd='1TP?'):
+    return timed(lambda: mc.ask(cmd), n)
+
+
+def bench_batch(mc, n, batch_size=4):
+    def f():
+        with mc.batch() as b:
+            for i in range(batch_size):
+                b.position(1 + i % 4)
+    return timed(f, n)
+
+
+def bench_pipelined(mc, n, depth, cmd='1TP?'):
+    async def worker(latencies, idx):
+        for i in idx:
+            t = perf_counter()
+            await mc.aask(cmd)
+            latencies[i] = perf_counter() - t
+
+    async def main():
+        latencies = np.empty(n)
+        t0 = perf_counter()
+        await asyncio.gather(*(worker(latencies, range(k, n, depth)) for k in range(depth)))
+        return latencies, perf_counter() - t0
+    return asyncio.run(main())
+
+
+def bench_all(mc, name, n, batch_size=4, depths=()):
+    results = [
+        report(f'{name} do', *bench_do(mc, n)),
+        report(f'{name} ask', *bench_sequential(mc, n)),
+        report(f'{name} batch x{batch_size}', *bench_batch(mc, n, batch_size), per=batch_size),
+    ]
+    for depth in depths:
+        results.append(report(f'{name} pipelined x{depth}', *bench_pipelined(mc, n, depth)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='n', help='Number of transactions per run', type=int, default=2000)
+    parser.add_argument('-L', '--latency', dest='latency', help='Simulated one-way transfer latency [s]', type=float, default=0.)
+    parser.add_argument('-T', '--motion-time', dest='motion_time', help='Scale on simulated move durations', type=float, default=1.)
+    parser.add_argument('-B', '--batch', dest='batch_size', help='Queries per batched line', type=int, default=4)
+    parser.add_argument('-D', '--depth', dest='depths', help='Pipeline depths to try', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('-H', '--host', dest='host', help='Benchmark a real controller at this address instead of the simulated TCP one', type=str)
+    parser.add_argument('-U', '--usb', dest='usb', help='Benchmark the real USB controller instead of the simulated one', action='store_true')
+    parser.add_argument('-o', '--output', dest='output', help='Also write the results to this JSON file', type=str)
+    args = parser.parse_args()
+
+    results = []
+    if args.usb:
+        mc = NewFocus8742USB.create('0x104d', '0x4000')
+    else:
+        ep = SimulatedUSBEndpoints(NewFocus8742Model(motion_time=args.motion_time), latency=args.latency)
+        mc = NewFocus8742USB.from_endpoints(ep, ep)
+    with mc:
+        results += bench_all(mc, 'usb', args.n, args.batch_size)
+
+    server = None
+    if args.host is None:
+        model = NewFocus8742Model(motion_time=args.motion_time)
+        server = NewFocus8742Server(latency=args.latency, model=model).start()
+        host, port = server.host, server.port
+    else:
+        host, port = args.host, 23
+    with NewFocus8742TCP.create(host, port) as mc:
+        results += bench_all(mc, 'tcp', args.n, args.batch_size, args.depths)
+    if server is not None:
+        server.stop()
+
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
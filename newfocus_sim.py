@@ -0,0 +1,360 @@
+"""
+Software stand-in for the New Focus/Newport 8742 picomotor controller.
+
+:class:`NewFocus8742Model` models the controller itself: per axis position,
+velocity, acceleration and motion timing, motion done (MD?) and the error
+FIFO (TE?/TB?). It is served on the 8742 ASCII line protocol either over TCP
+(:class:`NewFocus8742Server`, for `NewFocus8742TCP`) or through a pair of fake
+USB endpoints (:class:`SimulatedUSBEndpoints`, for `NewFocus8742USB`), so the
+drivers in `newfocus_v2.py` can be exercised and benchmarked without hardware.
+"""
+import re
+import asyncio
+import threading
+from collections import deque
+from time import monotonic, sleep
+import usb.core
+
+#commands are an optional axis number, a mnemonic, an optional '?' and the parameters
+ADDRESS_RE = re.compile(r'^\s*(\d+)>')
+CMD_RE = re.compile(r'^\s*(\d*)\s*([A-Za-z*]+)(\??)\s*(.*)$')
+IDN = 'New_Focus 8742 v2.2 08/01/13 {serial}'
+# the real controller sends these 6 (telnet negotiation) bytes on every new connection
+TELNET_PREAMBLE = b'\xff\xfb\x01\xff\xfb\x03'
+
+ERRORS = {
+    0: 'NO ERROR DETECTED',
+    6: 'COMMAND DOES NOT EXIST',
+    7: 'PARAMETER OUT OF RANGE',
+    37: 'AXIS NUMBER MISSING',
+    38: 'COMMAND PARAMETER MISSING',
+    # axis errors, reported as 100*axis + code
+    10: 'MAXIMUM VELOCITY EXCEEDED',
+    11: 'MAXIMUM ACCELERATION EXCEEDED',
+    14: 'MOTION IN PROGRESS',
+}
+AXIS_ERRORS = (10, 11, 14)
+
+
+class SimulatedAxis:
+    """One picomotor channel; moves are linear in time between start and target."""
+    max_velocity = 2000
+    max_acceleration = 200_000
+
+    def __init__(self):
+        self.velocity = 2000
+        self.acceleration = 100_000
+        self.motor_type = 2
+        self.home = 0
+        self.start = self.target = 0
+        self.t_start = self.t_end = 0.
+        self.direction = 0  # +-1 while running an indefinite (MV) move
+
+    def moving(self, t):
+        return t < self.t_end
+
+    def position(self, t):
+        if not self.moving(t):
+            return self.target
+        if self.direction:
+            return self.start + int(self.direction * self.velocity * (t - self.t_start))
+        f = (t - self.t_start) / (self.t_end - self.t_start)
+        return self.start + int(round(f * (self.target - self.start)))
+
+    def duration(self, steps):
+        """Move time [s] of a trapezoidal velocity profile."""
+        v, a = self.velocity, self.acceleration
+        steps = abs(steps)
+        if steps * a >= v * v:
+            return steps / v + v / a
+        return 2 * (steps / a) ** .5
+
+    def move_to(self, target, t, time_scale):
+        self.start, self.target = self.position(t), target
+        self.t_start = t
+        self.t_end = t + time_scale * self.duration(target - self.start)
+        self.direction = 0
+
+    def run(self, direction, t):
+        self.start = self.position(t)
+        self.t_start, self.t_end = t, float('inf')
+        self.direction = direction
+
+    def stop(self, t):
+        self.start = self.target = self.position(t)
+        self.t_end = t
+        self.direction = 0
+
+
+class NewFocus8742Model:
+    """Behavioural model of the controller.
+
+    Args:
+        n_axes (int): motor channels
+        motion_time (float): scale on the modelled move durations; 1 moves in
+            real time, 0 makes every move complete instantly
+        clock (callable): time source, in seconds
+        address (int): RS-485 address, 1 for the master
+        secondaries (dict, optional): daisy-chained controllers behind this
+            one, {address: NewFocus8742Model}
+        serial (str): serial number reported by *IDN?
+    """
+    error_depth = 10
+
+    def __init__(self, n_axes=4, motion_time=1., clock=monotonic, address=1, secondaries=None, serial='00000'):
+        self.n_axes = n_axes
+        self.serial = serial
+        self.motion_time = motion_time
+        self.clock = clock
+        self.address = address
+        # daisy-chained controllers, {address: NewFocus8742Model}, reached with "n>"
+        self.secondaries = {} if secondaries is None else secondaries
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.axes = {xx: SimulatedAxis() for xx in range(1, self.n_axes + 1)}
+        self.errors = deque(maxlen=self.error_depth)
+
+    def error(self, code, xx=None):
+        self.errors.append(100 * xx + code if code in AXIS_ERRORS else code)
+
+    def handle(self, line):
+        """Execute one line received from the host, return the reply lines.
+
+        A line can hold several commands separated by ``;``, every query in
+        it gets its own reply line.
+        """
+        replies = []
+        with self.lock:
+            t = self.clock()
+            for cmd in line.split(';'):
+                replies.extend(self.handle_cmd(cmd, t))
+        return replies
+
+    def handle_cmd(self, line, t):
+        m = ADDRESS_RE.match(line)
+        if m is not None and int(m.group(1)) != self.address:
+            secondary = self.secondaries.get(int(m.group(1)))
+            if secondary is None:
+                return []  # nobody on the network answers
+            replies = secondary.handle_cmd(line[m.end():], t)
+            return [f'{secondary.address}>{r}' for r in replies]
+        elif m is not None:
+            line = line[m.end():]
+        m = CMD_RE.match(line)
+        if m is None:
+            if line.strip():
+                self.error(6)
+            return []
+        xx, cmd, query, args = m.groups()
+        cmd = cmd.upper()
+        xx = int(xx) if xx else None
+        if xx is not None and xx not in self.axes:
+            self.error(7)
+            return []
+        if query:
+            r = self.query(cmd, xx, t)
+            return [] if r is None else [r]
+        if cmd == 'MV':
+            nn = [-1 if args.strip() == '-' else 1]
+        else:
+            try:
+                nn = [int(n) for n in args.split(',') if n.strip()]
+            except ValueError:
+                self.error(7)
+                return []
+        self.command(cmd, xx, nn, t)
+        return []
+
+    def query(self, cmd, xx, t):
+        if cmd in ('*IDN', 'VE'):
+            return IDN.format(serial=self.serial)
+        if cmd == 'TE':
+            return str(self.errors.popleft() if self.errors else 0)
+        if cmd == 'TB':
+            code = self.errors.popleft() if self.errors else 0
+            return f'{code}, {ERRORS[code % 100 if code >= 100 else code]}'
+        if cmd == 'SA':
+            return str(self.address)
+        if cmd == 'SC':
+            return str(sum(1 << n for n in [self.address, *self.secondaries]))
+        if cmd == 'SD':
+            return '1'
+        if cmd == 'MD':
+            if xx is None:
+                return str(int(not any(a.moving(t) for a in self.axes.values())))
+            return str(int(not self.axes[xx].moving(t)))
+        if xx is None:
+            self.error(37)
+            return None
+        axis = self.axes[xx]
+        if cmd in ('PA', 'PR'):
+            return str(axis.target)
+        if cmd == 'TP':
+            return str(axis.position(t))
+        if cmd in ('AC', 'VA', 'QM', 'DH'):
+            attr = {'AC': 'acceleration', 'VA': 'velocity', 'QM': 'motor_type', 'DH': 'home'}[cmd]
+            return str(getattr(axis, attr))
+        self.error(6)
+        return None
+
+    def command(self, cmd, xx, nn, t):
+        if cmd == '*RST':
+            self.reset()
+            return
+        if cmd in ('*RCL', 'MC', 'SM', 'SC'):
+            return
+        if cmd in ('AB', 'ST') and xx is None:
+            for axis in self.axes.values():
+                axis.stop(t)
+            return
+        if cmd not in ('AB', 'ST', 'AC', 'VA', 'QM', 'DH', 'MV', 'PA', 'PR'):
+            self.error(6)
+            return
+        if xx is None:
+            self.error(37)
+            return
+        axis = self.axes[xx]
+        if cmd in ('AB', 'ST'):
+            axis.stop(t)
+        elif cmd == 'DH':
+            if axis.moving(t):
+                return self.error(14, xx)
+            axis.home = axis.start = axis.target = nn[0] if nn else 0
+        elif not nn:
+            self.error(38)
+        elif cmd == 'VA':
+            if not 0 < nn[0] <= axis.max_velocity:
+                return self.error(10, xx)
+            axis.velocity = nn[0]
+        elif cmd == 'AC':
+            if not 0 < nn[0] <= axis.max_acceleration:
+                return self.error(11, xx)
+            axis.acceleration = nn[0]
+        elif cmd == 'QM':
+            axis.motor_type = nn[0]
+        elif axis.moving(t):
+            self.error(14, xx)
+        elif cmd == 'MV':
+            axis.run(nn[0], t)
+        elif cmd == 'PA':
+            axis.move_to(nn[0], t, self.motion_time)
+        elif cmd == 'PR':
+            axis.move_to(axis.target + nn[0], t, self.motion_time)
+
+
+class SimulatedUSBEndpoints:
+    """Bulk OUT/IN endpoint pair in front of a :class:`NewFocus8742Model`.
+
+    Mimics the parts of the pyusb endpoint API the USB driver uses, one
+    object stands for both endpoints (see `NewFocus8742USB.from_endpoints`).
+    Replies are cut into `wMaxPacketSize` packets.
+
+    Args:
+        model (NewFocus8742Model, optional)
+        latency (float): seconds each transfer spends on the bus; a write
+            blocks for that long and its reply shows up that long after
+    """
+    wMaxPacketSize = 64
+    eol_read = b'\r'
+    eol_write = b'\r\n'
+
+    def __init__(self, model=None, latency=0.):
+        self.model = NewFocus8742Model() if model is None else model
+        self.latency = latency
+        self.packets = deque()  # (time available, bytes)
+
+    def write(self, data, timeout=None):
+        if self.latency:
+            sleep(self.latency)
+        replies = self.model.handle(bytes(data).rstrip(self.eol_read).decode())
+        data_in = b''.join(r.encode() + self.eol_write for r in replies)
+        t = monotonic() + self.latency
+        for i in range(0, len(data_in), self.wMaxPacketSize):
+            self.packets.append((t, data_in[i:i + self.wMaxPacketSize]))
+        return len(data)
+
+    def read(self, size_or_buffer, timeout=None):
+        if not self.packets:
+            sleep((timeout or 0) / 1e3)
+            raise usb.core.USBTimeoutError('simulated read timed out')
+        t, packet = self.packets[0]
+        wait = t - monotonic()
+        if wait > 0:
+            if timeout is not None and wait > timeout / 1e3:
+                sleep(timeout / 1e3)
+                raise usb.core.USBTimeoutError('simulated read timed out')
+            sleep(wait)
+        self.packets.popleft()
+        if isinstance(size_or_buffer, int):
+            return packet
+        size_or_buffer[:len(packet)] = type(size_or_buffer)('B', packet)
+        return len(packet)
+
+
+class NewFocus8742Server:
+    """TCP server exposing a :class:`NewFocus8742Model` on the 8742 line protocol.
+
+    Runs its own event loop in a background thread, so it can serve a
+    blocking client living in the same process.
+
+    Args:
+        host (str): interface to listen on
+        port (int): 0 picks a free port, see :attr:`port` once started
+        latency (float): seconds every reply spends "on the wire". Replies are
+            delayed without holding up the next command, like a real link.
+    """
+    eol_read = b'\r'
+    eol_write = b'\r\n'
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0., model=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.model = NewFocus8742Model() if model is None else model
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    async def _start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        async def _stop():
+            self._server.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(_stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def _serve(self, reader, writer):
+        writer.write(TELNET_PREAMBLE)
+        try:
+            while True:
+                line = await reader.readuntil(self.eol_read)
+                replies = self.model.handle(line[:-1].decode())
+                data = b''.join(r.encode() + self.eol_write for r in replies)
+                if not data:
+                    continue
+                if self.latency:
+                    self._loop.call_later(self.latency, writer.write, data)
+                else:
+                    writer.write(data)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -1,4 +1,5 @@
 import sys
+import array
 import argparse
 import asyncio
 import usb.util
@@ -7,21 +8,22 @@ import libusb_package
 import usb.core
 import usb.backend.libusb1
 from contextlib import contextmanager
-import cv2
 from datetime import datetime 
-from collections import deque
+from collections import deque, namedtuple
 from tqdm import tqdm, trange
 from enum import IntEnum
-from queue import Queue
-from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QThread
-from PyQt5.QtWidgets import QTextEdit, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QMainWindow, QMessageBox, QApplication, QLabel
+from queue import Queue, Empty
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QPlainTextEdit, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QMainWindow, QMessageBox, QApplication, QLabel
 from PyQt5.QtGui import QTextCursor
 import threading
-from time import sleep
+from time import sleep, monotonic, perf_counter, time
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
 import pyqtgraph as pg
 from pyueye import ueye
 import numpy as np
 import os 
+import atexit
 import re 
 
 #many open functions are imported, need just this to write to a file!
@@ -54,31 +56,116 @@ def with_error_catcher(f, f_c=None, *args, **kwargs):
         if f_c is not None: f_c()
 
 class customLogger:
-    def __init__(self, fname=None):
-        if fname is None:
-            t = re.match(r'(.+)\.(.+)', str(datetime.now()), re.M | re.I).group(1) #remove microseconds
-            now = t.split(' ')
-            self.fname = f'starguide_{now[0]}_{now[1]}.log'
-        else:
-            self.fname = fname
+    """Log sink: prints every message and appends it to `fname` from a writer thread.
+
+    :meth:`log` only formats the message and queues it, so the camera and
+    control threads never wait for the disk. The writer thread, started on
+    the first message, appends whatever has queued up in one write. The
+    file is rotated to `fname`.1 ... `fname`.`backups` when it grows past
+    `max_bytes` or was opened more than `max_age` s ago. :meth:`close`,
+    also run at exit, writes what is left.
+
+    Args:
+        fname (str): log file; None only prints, until :meth:`open`
+        level (log_levels): messages below are dropped
+    """
+    MAX_BYTES = 10 * 2**20
+    MAX_AGE = 24 * 3600.  # s
+    BACKUPS = 5
+
+    def __init__(self, fname=None, level=log_levels.DEBUG, max_bytes=MAX_BYTES, max_age=MAX_AGE, backups=BACKUPS):
+        self.fname = fname
         self.d = {}
         for l in list(log_levels):
             self.d[l.value] = l.name
-        self.uninit_msgs = ""
-        self.data = "" #list of strings to save
+        self.level = level
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self._queue = Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
 
     def log(self, s, level=0, init=False):
+        """Print and queue `s` for the file; `init` is kept for old callers, every message is saved."""
+        if level < self.level:
+            return
         t = datetime.now()
         msg = f'{t.date()} {t.time()}   -   {__name__}   -   {self.d[level]}   -   {s}'
-        if init: self.uninit_msgs = self.uninit_msgs + '\n' + msg
         print(msg)
-
-    def write_to_file(self):
-        C_STDOUT = sys.stdout
-        sys.stdout = O_STDOUT
-        with open_builtin(self.fname, 'w') as sys.stdout:
-            print(self.uninit_msgs + '\n' + self.data)
-        sys.stdout = C_STDOUT
+        if self.fname is None:
+            return
+        self._queue.put(msg + '\n')
+        if self._thread is None:
+            self._start()
+
+    def open(self, fname=None):
+        """Save the messages from now on to `fname`, starguide_<date>_<time>.log if None."""
+        self.fname = datetime.now().strftime('starguide_%Y-%m-%d_%H-%M-%S.log') if fname is None else fname
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.__writer, name='customLogger', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def flush(self, timeout=None):
+        """Block until everything logged so far is written; False on timeout."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5.):
+        """Write what is queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _rollover(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.fname}.{i}'):
+                os.replace(f'{self.fname}.{i}', f'{self.fname}.{i + 1}')
+        if self.backups and os.path.exists(self.fname):
+            os.replace(self.fname, f'{self.fname}.1')
+
+    def __writer(self):
+        fh, opened = None, 0.
+        running = True
+        while running:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            lines = [item for item in items if isinstance(item, str)]
+            try:
+                if lines:
+                    if fh is not None and (fh.tell() >= self.max_bytes or time() - opened >= self.max_age):
+                        fh.close()
+                        fh = None
+                        self._rollover()
+                    if fh is None:
+                        fh, opened = open_builtin(self.fname, 'a'), time()
+                    fh.write(''.join(lines))
+                    fh.flush()
+            except OSError as e:
+                O_STDOUT.write(f'customLogger: could not write {self.fname}: {e}\n')
+            for item in items:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    item.set()
+        if fh is not None:
+            fh.close()
+
+# default sink so the drivers can log when imported: prints INFO and up, saves nothing.
+# StarGuide opens a log file on it, running as a script replaces it
+logger = customLogger(level=log_levels.INFO)
 
 @contextmanager
 def gui_environment():
@@ -107,20 +194,47 @@ def rowmajor_axisorder():
 class StarGuideError(Exception):
     pass
 
-class Editor(QTextEdit):
-    def __init__(self):
+class LogConsole(QPlainTextEdit):
+    """Read-only console of the last MAX_LINES lines written to a WriteStream queue.
+
+    Text queued from any thread is taken in the GUI thread once every
+    FLUSH_INTERVAL ms and inserted at once; the document drops lines beyond
+    MAX_LINES from the top, so the cost of a write stays the same however
+    long the run. The log file is written by customLogger, not from here.
+    """
+    MAX_LINES = 1000
+    FLUSH_INTERVAL = 100  # ms
+
+    def __init__(self, queue):
         super().__init__()
+        self.queue = queue
         self.setReadOnly(True)
-        self.textChanged.connect(self.autoResize)
-
-    def autoResize(self):
-        self.document().setTextWidth(self.viewport().width())
-        margins = self.contentsMargins()
-        height = int(self.document().size().height() + margins.top() + margins.bottom())
-        self.setFixedHeight(min(height, 100))
+        self.setMaximumBlockCount(self.MAX_LINES)
+        self.setFixedHeight(100)
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.flush)
+        self.timer.start(self.FLUSH_INTERVAL)
 
-    def resizeEvent(self, event):
-        self.autoResize()
+    def flush(self):
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.queue.get_nowait())
+            except Empty:
+                break
+        if not chunks:
+            return
+        text = ''.join(chunks)
+        if text.count('\n') > self.MAX_LINES:
+            text = '\n'.join(text.split('\n')[-self.MAX_LINES - 1:])
+        # follow the end unless scrolled up to read
+        scrollbar = self.verticalScrollBar()
+        at_end = scrollbar.value() == scrollbar.maximum()
+        cursor = self.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        if at_end:
+            scrollbar.setValue(scrollbar.maximum())
 
 # The new Stream Object which replaces the default stream associated with sys.stdout
 # This object just puts data in a queue!
@@ -135,22 +249,6 @@ class WriteStream(object):
     def flush(self):
         return
 
-# A QObject (to be run in a QThread) which sits waiting for data to come through a Queue.Queue().
-# It blocks until data is available, and one it has got something from the queue, it sends
-# it to the "MainThread" by emitting a Qt Signal 
-class Receiver(QObject):
-    mysignal = pyqtSignal(str)
-
-    def __init__(self,queue,*args,**kwargs):
-        QObject.__init__(self,*args,**kwargs)
-        self.queue = queue
-
-    @pyqtSlot()
-    def run(self):
-        while True:
-            text = self.queue.get()
-            self.mysignal.emit(text)
-
 
 def _make_do(cmd, doc=None):
     def f(self, xx=None, *nn):
@@ -163,9 +261,7 @@ def _make_do(cmd, doc=None):
 def _make_ask(cmd, doc=None, conv=int):
     assert cmd.endswith("?")
     def f(self, xx=None, *nn):
-        ret = self.ask(cmd, xx, *nn)
-        ret = conv(ret)
-        return ret
+        return self._query(conv, cmd, xx, *nn)
     if doc is not None:
         f.__doc__ = doc
     return f
@@ -178,6 +274,13 @@ class NewFocus8742Protocol:
     https://www.newport.com/p/8742
     """
     poll_interval = .01
+    retries = 0  # extra attempts for a query that timed out
+
+    def __init__(self):
+        # one command/response exchange at a time when shared between threads
+        self.lock = threading.RLock()
+        self.shadow = NewFocus8742Shadow(self.lock)
+        self.stats = None  # NewFocus8742Stats to instrument the transport
 
     def fmt_cmd(self, cmd, xx=None, *nn):
         """Format a command.
@@ -196,36 +299,112 @@ class NewFocus8742Protocol:
     def do(self, cmd, xx=None, *nn):
         """Format and send a command to the device
 
+        Settings writes that would not change a register known to
+        :attr:`shadow` are skipped.
+
         See Also:
             :meth:`fmt_cmd`: for the formatting and additional
                 parameters.
         """
-        cmd = self.fmt_cmd(cmd, xx, *nn)
-        assert len(cmd) < 64
-        # logger.debug("do %s", cmd)
-        self._writeline(cmd)
+        if self.shadow.unchanged(cmd, xx, nn):
+            return
+        line = self.fmt_cmd(cmd, xx, *nn)
+        assert len(line) < 64
+        # logger.debug("do %s", line)
+        try:
+            self._do(line)
+        except Exception:
+            self.shadow.invalidate()
+            raise
+        self.shadow.wrote(cmd, xx, nn)
 
     def ask(self, cmd, xx=None, *nn):
         """Execute a command and return a response.
 
-        The command needs to include the final question mark.
+        The command needs to include the final question mark. Registers
+        known to :attr:`shadow` are answered without asking the device.
 
         See Also:
             :meth:`fmt_cmd`: for the formatting and additional
                 parameters.
         """
         assert cmd.endswith("?")
-        self.do(cmd, xx, *nn)
-        ret = self._readline()
+        ret = self.shadow.get(cmd, xx) if not nn else None
+        if ret is not None:
+            return str(ret)
+        line = self.fmt_cmd(cmd, xx, *nn)
+        for attempt in range(self.retries + 1):
+            try:
+                ret = self._ask(line)
+                break
+            except TIMEOUT_ERRORS:
+                self.shadow.invalidate()
+                if attempt == self.retries:
+                    raise
+                if self.stats is not None:
+                    self.stats.retry(line)
+            except Exception:
+                self.shadow.invalidate()
+                raise
+        self.shadow.read(cmd, xx, ret)
         # logger.debug("ret %s", ret)
         return ret
 
+    def _do(self, line):
+        self._transact(line, 0)
+
+    def _ask(self, line):
+        return self._transact(line, 1)[0]
+
+    def _query(self, conv, cmd, xx=None, *nn):
+        return conv(self.ask(cmd, xx, *nn))
+
+    def _transact(self, line, n_replies):
+        """Send an already formatted line, return its `n_replies` responses."""
+        with self.lock:
+            t = perf_counter()
+            try:
+                self._writeline(line)
+                r = [self._readline() for _ in range(n_replies)]
+            except Exception as e:
+                if self.stats is not None:
+                    self.stats.record(line, None, perf_counter() - t, e)
+                if isinstance(e, TIMEOUT_ERRORS):
+                    # retried or not, a late reply to this line must not answer the next one
+                    self._recover()
+                raise
+        if self.stats is not None:
+            self.stats.record(line, r, perf_counter() - t)
+        return r
+
     def _writeline(self, cmd):
         return
 
     def _readline(self):
         return
 
+    def _recover(self):
+        """Resynchronize after a timed out transfer, under the lock."""
+        return
+
+    def batch(self):
+        """Collect commands and send them packed into as few lines as possible.
+
+        Use as a context manager; everything is sent when the block exits
+        and the converted query responses end up in ``results``::
+
+            with mc.batch() as b:
+                b.set_relative(1, 100)
+                b.set_relative(2, -50)
+                b.done(1)
+                b.done(2)
+            moved = all(b.results)
+
+        See Also:
+            :class:`NewFocus8742Batch`
+        """
+        return NewFocus8742Batch(self)
+
     identify = _make_ask("*IDN?",
             """Get product identification string.
 
@@ -450,9 +629,34 @@ class NewFocus8742Protocol:
             error buffer is cleared by one(1) element. This means that an error
             can be read only once, with either command.""")
 
+    get_address = _make_ask("SA?",
+            """Get controller address.
+
+            This command is used to query the address of the controller on
+            the RS-485 network of daisy-chained controllers. The master, the
+            one connected to the host, has address 1 by default.""")
+
+    scan_network = _make_do("SC",
+            """Scan RS-485 network.
+
+            This command is used to initiate a scan of controllers on the
+            RS-485 network. Poll :meth:`scan_done` for completion.""")
+
+    get_network = _make_ask("SC?",
+            """Get RS-485 network controller addresses.
+
+            Returns a 32-bit integer; bit n set means a controller answers
+            at address n. Bit 0 flags an address conflict.""")
+
+    scan_done = _make_ask("SD?",
+            """Get RS-485 network scan status.
+
+            Returns 1 once the scan started with :meth:`scan_network` has
+            completed.""")
+
     def finish(self, xx=None):
         while not self.done(xx):
-            asyncio.sleep(self.poll_interval)
+            sleep(self.poll_interval)
 
     def ping(self):
         try:
@@ -460,13 +664,653 @@ class NewFocus8742Protocol:
         except asyncio.CancelledError:
             raise
         except:
-            logger.warning("ping failed", exc_info=True)
+            logger.log("ping failed", log_levels.ERROR)
             return False
         return True
 
+TIMEOUT_ERRORS = (TimeoutError, asyncio.TimeoutError, usb.core.USBTimeoutError)
+MNEMONIC_RE = re.compile(r'^(?:\d+>)?\d*([A-Za-z*]+\??)')
+
+class NewFocus8742Stats:
+    """Per-command counters, latency histograms and trace of a transport.
+
+    Attach to a driver with ``mc.stats = NewFocus8742Stats()``; leaving
+    ``mc.stats`` at None costs one attribute check per transfer. Every line
+    sent is accounted under its mnemonic (e.g. "PR", "MD?"), lines packing
+    several commands under "BATCH" with each packed mnemonic counted in
+    ``commands``. Latencies go into log-spaced bins, `bins_per_decade` per
+    decade from 10 us up to 10 s.
+
+    Args:
+        trace (int): number of recent (wall time, line, replies, seconds,
+            error) records to keep in :attr:`trace`, 0 to keep none
+    """
+    bins_per_decade = 4
+    min_decade = -5  # 10 us
+    n_bins = 6 * bins_per_decade  # up to 10 s
+
+    def __init__(self, trace=0):
+        self.lock = threading.Lock()
+        self.trace = deque(maxlen=trace) if trace else None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.entries = {}
+            self.commands = {}  # mnemonic -> times sent, batched or not
+            if self.trace is not None:
+                self.trace.clear()
+
+    @staticmethod
+    def mnemonic(cmd):
+        m = MNEMONIC_RE.match(cmd)
+        return m.group(1).upper() if m else cmd
+
+    def _entry(self, key):
+        e = self.entries.get(key)
+        if e is None:
+            e = self.entries[key] = {
+                'count': 0, 'total': 0., 'max': 0., 'errors': 0, 'timeouts': 0, 'retries': 0,
+                'hist': [0] * self.n_bins,
+            }
+        return e
+
+    def record(self, line, replies, dt, error=None):
+        """Account for one transfer of `line` that took `dt` seconds."""
+        cmds = line.split(';')
+        key = self.mnemonic(line) if len(cmds) == 1 else 'BATCH'
+        b = int((np.log10(max(dt, 1e-9)) - self.min_decade) * self.bins_per_decade)
+        with self.lock:
+            e = self._entry(key)
+            e['count'] += 1
+            e['total'] += dt
+            e['max'] = max(e['max'], dt)
+            e['hist'][min(max(b, 0), self.n_bins - 1)] += 1
+            if error is not None:
+                e['timeouts' if isinstance(error, TIMEOUT_ERRORS) else 'errors'] += 1
+            for cmd in cmds:
+                m = self.mnemonic(cmd)
+                self.commands[m] = self.commands.get(m, 0) + 1
+            if self.trace is not None:
+                self.trace.append((time(), line, replies, dt, error))
+
+    def retry(self, line):
+        with self.lock:
+            self._entry(self.mnemonic(line))['retries'] += 1
+
+    def bin_edges(self):
+        """Histogram bin edges [s], one more than there are bins."""
+        return 10. ** (self.min_decade + np.arange(self.n_bins + 1) / self.bins_per_decade)
+
+    def percentile(self, key, q):
+        """Latency percentile `q` (0-100) of `key`.
+
+        Interpolated log-linearly within its histogram bin, and never more
+        than the largest latency seen.
+        """
+        with self.lock:
+            e = self.entries[key]
+            return self._percentile(list(e['hist']), e['max'], q)
+
+    def _percentile(self, hist, largest, q):
+        hist = np.array(hist)
+        cum = np.cumsum(hist)
+        target = q / 100 * cum[-1]
+        i = min(int(np.searchsorted(cum, target)), self.n_bins - 1)
+        lo, hi = self.bin_edges()[i:i + 2]
+        frac = (target - (cum[i - 1] if i else 0)) / hist[i] if hist[i] else 1.
+        return min(lo * (hi / lo) ** frac, largest)
+
+    def summary(self):
+        """{mnemonic: {count, mean, p50, p99, max, errors, timeouts, retries}}, seconds."""
+        # a snapshot, the transports keep recording meanwhile
+        with self.lock:
+            entries = {key: dict(e, hist=list(e['hist'])) for key, e in self.entries.items()}
+        out = {}
+        for key, e in entries.items():
+            out[key] = {
+                'count': e['count'], 'mean': e['total'] / max(e['count'], 1),
+                'p50': self._percentile(e['hist'], e['max'], 50), 'p99': self._percentile(e['hist'], e['max'], 99), 'max': e['max'],
+                'errors': e['errors'], 'timeouts': e['timeouts'], 'retries': e['retries'],
+            }
+        return out
+
+    def format(self):
+        lines = [f"{'cmd':>6} {'count':>8} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'err':>5} {'tmo':>5} {'rtry':>5}"]
+        for key, e in sorted(self.summary().items()):
+            lines.append(f"{key:>6} {e['count']:>8} {e['mean']*1e3:9.3f} {e['p50']*1e3:9.3f} {e['p99']*1e3:9.3f} "
+                         f"{e['max']*1e3:9.3f} {e['errors']:>5} {e['timeouts']:>5} {e['retries']:>5}")
+        return '\n'.join(lines)
+
+    def start_dump(self, interval=60., sink=None):
+        """Log :meth:`format` every `interval` seconds from a daemon thread."""
+        self._dumping = threading.Event()
+        def worker():
+            while not self._dumping.wait(interval):
+                (sink or (lambda msg: logger.log(msg, log_levels.DEBUG)))('motor controller stats\n' + self.format())
+        threading.Thread(target=worker, daemon=True).start()
+
+    def stop_dump(self):
+        self._dumping.set()
+
+class NewFocus8742Shadow:
+    """Write-through shadow of the controller registers.
+
+    Keeps the last known motor type (QM), velocity (VA), acceleration (AC),
+    home (DH) and target position (PA) per axis, from the values written and
+    read through the driver. Settings writes (QM, VA, AC) that would not
+    change a known value are skipped and reads of known values need no
+    round trip. Motion commands always go out; the target they set is only
+    recorded once MD? reports the axis done.
+
+    Entries are dropped whenever their value becomes uncertain: stops and
+    indefinite moves forget the target, reset/recall and motor check forget
+    everything they can change, an error read with TE?/TB? forgets its axis
+    (everything for non axis errors) and a failed transfer or a reconnect
+    clears the whole shadow.
+
+    Args:
+        lock: the protocol lock of the controller, taken for every update
+        enabled (bool): False to never skip writes nor answer reads
+    """
+    registers = ("QM", "VA", "AC", "DH", "PA")
+
+    def __init__(self, lock=None, enabled=True):
+        self.lock = lock if lock is not None else threading.RLock()
+        self.enabled = enabled
+        self.values = {}  # (register, axis) -> int
+        self._targets = {}  # axis -> target of a move not seen done yet
+
+    @staticmethod
+    def _register(cmd):
+        reg = cmd.upper().rstrip("?")
+        return "PA" if reg == "PR" and cmd.endswith("?") else reg
+
+    def get(self, cmd, xx):
+        """Shadowed value of a query, None when unknown."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            return self.values.get((self._register(cmd), xx))
+
+    def unchanged(self, cmd, xx, nn):
+        """True if the settings write would not change anything on the controller."""
+        if not self.enabled or xx is None or not nn:
+            return False
+        reg = self._register(cmd)
+        with self.lock:
+            return reg in ("QM", "VA", "AC") and self.values.get((reg, xx)) == nn[0]
+
+    def wrote(self, cmd, xx, nn):
+        """Record a write that went out to the controller."""
+        reg = self._register(cmd)
+        with self.lock:
+            if reg in ("*RST", "*RCL"):
+                self.invalidate()
+            elif reg == "MC":
+                self.forget("QM", "VA")
+            elif reg in ("AB", "ST", "MV"):
+                self.forget("PA", xx=xx)
+            elif xx is None:
+                return
+            elif reg in ("QM", "VA", "AC") and nn:
+                self.values[(reg, xx)] = nn[0]
+            elif reg in ("PA", "PR") and nn:
+                # the target is only known for sure once the move is seen done
+                base = 0 if reg == "PA" else self._targets.get(xx, self.values.get(("PA", xx)))
+                self.forget("PA", xx=xx)
+                if base is not None:
+                    self._targets[xx] = base + nn[0]
+            elif reg == "DH":
+                self._targets.pop(xx, None)
+                self.values[("DH", xx)] = self.values[("PA", xx)] = nn[0] if nn else 0
+
+    def read(self, cmd, xx, value):
+        """Record the response to a query."""
+        reg = self._register(cmd)
+        with self.lock:
+            if reg in ("TE", "TB"):
+                code = int(value.split(",")[0])
+                if code:
+                    self.invalidate(code // 100 or None)
+            elif reg == "MD" and xx in self._targets and int(value):
+                self.values[("PA", xx)] = self._targets.pop(xx)
+            elif reg in self.registers and xx is not None:
+                self.values[(reg, xx)] = int(value)
+
+    def discard(self, cmd, xx):
+        """Account for a write whose effect is not tracked: forget the axis."""
+        self.wrote(cmd, None, ())  # controller wide effects
+        self.invalidate(xx)
+
+    def forget(self, *regs, xx=None):
+        """Drop registers `regs`, of axis `xx` or of every axis if None."""
+        with self.lock:
+            for key in list(self.values):
+                if key[0] in regs and (xx is None or key[1] == xx):
+                    del self.values[key]
+            if "PA" in regs:
+                for axis in list(self._targets):
+                    if xx is None or axis == xx:
+                        del self._targets[axis]
+
+    def invalidate(self, xx=None):
+        """Drop everything known about axis `xx`, or about every axis."""
+        self.forget(*self.registers, xx=xx)
+
+ADDRESS_RE = re.compile(r'^\d+>')
+
+def _strip_address(r):
+    """Drop the "n>" prefix daisy-chained controllers put on their replies."""
+    m = ADDRESS_RE.match(r)
+    return r[m.end():] if m else r
+
+class NewFocus8742Batch(NewFocus8742Protocol):
+    """Command list for a :class:`NewFocus8742Protocol`.
+
+    Takes the same ``do``/``ask`` calls and named commands as the driver,
+    but only queues them. :meth:`send` joins them with the controller's
+    ``;`` separator into lines shorter than the 64 characters the
+    controller accepts, sends one transfer per line and returns the query
+    responses, in order, as a list. Each query is answered on its own line.
+    """
+    separator = ";"
+    max_line = 63  # a line has to fit in 64 characters
+
+    def __init__(self, mc):
+        self.mc = mc
+        # (formatted command, conv or None for commands without reply,
+        #  (shadow, cmd, xx, nn) to keep the controller's shadow up to date)
+        self.cmds = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.send()
+
+    def __len__(self):
+        return len(self.cmds)
+
+    def fmt_cmd(self, cmd, xx=None, *nn):
+        return self.mc.fmt_cmd(cmd, xx, *nn)
+
+    def add(self, mc, cmd, xx=None, *nn, conv=None):
+        """Queue a command formatted for controller `mc`, which may be a
+        secondary reached through this batch's connection.
+
+        Settings writes that :attr:`mc.shadow` knows to be no-ops are dropped.
+        """
+        if conv is None and mc.shadow.unchanged(cmd, xx, nn):
+            return
+        self.cmds.append((mc.fmt_cmd(cmd, xx, *nn), conv, (mc.shadow, cmd, xx, nn)))
+
+    def do(self, cmd, xx=None, *nn):
+        self.add(self.mc, cmd, xx, *nn)
+
+    def ask(self, cmd, xx=None, *nn):
+        return self._query(str, cmd, xx, *nn)
+
+    def _query(self, conv, cmd, xx=None, *nn):
+        assert cmd.endswith("?")
+        self.add(self.mc, cmd, xx, *nn, conv=conv)
+
+    def lines(self):
+        """Pack the queued commands into lines, yield (line, [entry, ...])."""
+        line, entries = "", []
+        for entry in self.cmds:
+            cmd = entry[0]
+            assert len(cmd) <= self.max_line
+            if line and len(line) + len(self.separator) + len(cmd) > self.max_line:
+                yield line, entries
+                line, entries = "", []
+            line = line + self.separator + cmd if line else cmd
+            entries.append(entry)
+        if line:
+            yield line, entries
+
+    def send(self):
+        """Send every queued command, return the list of query responses."""
+        self.results = []
+        for line, entries in self.lines():
+            queries = [e for e in entries if e[1] is not None]
+            try:
+                replies = self.mc._transact(line, len(queries))
+            except Exception:
+                for _, _, (shadow, *_) in entries:
+                    shadow.invalidate()
+                raise
+            replies = iter(replies)
+            for _, conv, (shadow, cmd, xx, nn) in entries:
+                if conv is None:
+                    shadow.wrote(cmd, xx, nn)
+                    continue
+                r = _strip_address(next(replies))
+                shadow.read(cmd, xx, r)
+                self.results.append(conv(r))
+        self.cmds = []
+        return self.results
+
+class NewFocus8742MotionWaiter:
+    """Motion completion tracking for a :class:`NewFocus8742Protocol`.
+
+    Register every move with :meth:`expect` right after commanding it, and
+    get back a :class:`concurrent.futures.Future` that resolves (to the
+    `monotonic` time the axis was seen done) once motion done (MD?) reports
+    the axis has stopped. A single background thread polls all moving axes
+    in one batched MD? query.
+
+    Polling is scheduled from the predicted move duration, computed from the
+    commanded steps and the axis velocity and acceleration: the first poll
+    goes out just before the motor should stop, later ones back off
+    exponentially from `min_interval` to `max_interval`. An axis still moving
+    long after its prediction fails its futures with :class:`StarGuideError`.
+
+    Args:
+        mc (NewFocus8742Protocol): controller to poll
+        velocity (int): default velocity [steps/s], see :meth:`set_velocity`
+        acceleration (int): default acceleration [steps/s^2]
+    """
+    min_interval = .002
+    max_interval = .02
+    early = .9  # first poll at this fraction of the predicted move time
+    timeout_factor = 3  # give up after this many predicted move times ...
+    timeout_min = 2.  # ... but never before this many seconds
+
+    def __init__(self, mc, velocity=2000, acceleration=100_000):
+        self.mc = mc
+        self.default_velocity = velocity
+        self.default_acceleration = acceleration
+        self.velocity = {}
+        self.acceleration = {}
+        self._moves = {}  # axis -> [(sequence number, future)]
+        self._seq = 0  # moves expected so far
+        self._due = {}  # axis -> monotonic time of the next poll
+        self._interval = {}  # axis -> current backoff interval
+        self._deadline = {}  # axis -> monotonic time to give up
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def set_velocity(self, xx, velocity):
+        self.velocity[xx] = velocity
+
+    def set_acceleration(self, xx, acceleration):
+        self.acceleration[xx] = acceleration
+
+    def predict(self, xx, steps):
+        """Predicted duration [s] of a move of `steps` on axis `xx`."""
+        v = self.velocity.get(xx, self.default_velocity)
+        a = self.acceleration.get(xx, self.default_acceleration)
+        steps = abs(steps)
+        if steps * a >= v * v:  # trapezoidal profile reaches full velocity
+            return steps / v + v / a
+        return 2 * np.sqrt(steps / a)  # triangular profile
+
+    def expect(self, xx, steps=None, callback=None):
+        """Track a move just commanded on axis `xx`.
+
+        Args:
+            xx (int): motor channel
+            steps (int, optional): commanded distance, None when unknown
+                (e.g. absolute moves); polling then starts right away
+            callback (callable, optional): called with the future when done
+        Returns:
+            concurrent.futures.Future: resolves when the axis has stopped.
+        """
+        fut = Future()
+        if callback is not None:
+            fut.add_done_callback(callback)
+        now = monotonic()
+        t = self.predict(xx, steps) if steps is not None else 0.
+        with self._cond:
+            self._seq += 1
+            self._moves.setdefault(xx, []).append((self._seq, fut))
+            self._due[xx] = max(self._due.get(xx, now), now + self.early * t)
+            self._interval[xx] = self.min_interval
+            self._deadline[xx] = max(self._deadline.get(xx, now),
+                now + max(self.timeout_factor * t, self.timeout_min))
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._poll_worker, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return fut
+
+    def wait(self, futures, timeout=None):
+        """Block until every future in `futures` is done, re-raising failures."""
+        done, not_done = wait_futures(futures, timeout)
+        if not_done:
+            raise StarGuideError(f'{len(not_done)} moves still running after {timeout} s')
+        return [f.result() for f in futures]
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _poll_worker(self):
+        while True:
+            with self._cond:
+                while self._running and not self._moves:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                now = monotonic()
+                next_due = min(self._due.values())
+                if next_due > now:
+                    # new moves can come in meanwhile, re-evaluate on wake-up
+                    self._cond.wait(next_due - now)
+                    continue
+                axes = [xx for xx, t in self._due.items() if t <= now]
+                # a move expected after this point may not have started when MD? is answered
+                polled = self._seq
+            try:
+                with self.mc.batch() as b:
+                    for xx in axes:
+                        b.done(xx)
+                status = b.results
+            except Exception as e:
+                self._resolve(axes, polled, exc=e)
+                continue
+            now = monotonic()
+            finished, expired = [], []
+            with self._cond:
+                for xx, done in zip(axes, status):
+                    if done:
+                        finished.append(xx)
+                    elif now > self._deadline[xx]:
+                        expired.append(xx)
+                    else:
+                        self._interval[xx] = min(2 * self._interval[xx], self.max_interval)
+                        self._due[xx] = now + self._interval[xx]
+            self._resolve(finished, polled, result=now)
+            self._resolve(expired, polled, exc=StarGuideError(f'motors {expired} did not report motion done'))
+
+    def _resolve(self, axes, polled, result=None, exc=None):
+        """Settle the futures of `axes` expected up to sequence number `polled`; later ones stay tracked."""
+        with self._cond:
+            futs = []
+            for xx in axes:
+                moves = self._moves.get(xx, [])
+                futs.extend(fut for seq, fut in moves if seq <= polled)
+                later = [(seq, fut) for seq, fut in moves if seq > polled]
+                if later:
+                    self._moves[xx] = later
+                    continue
+                self._moves.pop(xx, None)
+                for d in (self._due, self._interval, self._deadline):
+                    d.pop(xx, None)
+        # outside the lock, done callbacks may register new moves
+        for fut in futs:
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(result)
+
+class NewFocus8742Address(NewFocus8742Protocol):
+    """Daisy-chained (RS-485) controller reached through a master's connection.
+
+    Every command is sent through the master's transport with the "n>"
+    address prefix, so one USB or TCP connection drives the whole chain.
+    Shares the master's lock.
+
+    Args:
+        mc (NewFocus8742Protocol): master controller, the one on the host
+        address (int): address of the secondary controller, 2-31
+    """
+    def __init__(self, mc, address):
+        self.mc = mc
+        self.address = address
+        self.lock = mc.lock
+        self.shadow = NewFocus8742Shadow(self.lock)
+        self.stats = None  # recorded by the master
+
+    def fmt_cmd(self, cmd, xx=None, *nn):
+        return "{:d}>".format(self.address) + super().fmt_cmd(cmd, xx, *nn)
+
+    def _transact(self, line, n_replies):
+        return [_strip_address(r) for r in self.mc._transact(line, n_replies)]
+
+class NewFocus8742Manager:
+    """All 8742 controllers of a setup, with logical axis routing.
+
+    Controllers are named by serial number (the last field of ``*IDN?``);
+    secondaries daisy-chained behind a master get ``"<serial>/<address>"``.
+    Logical axis names map to ``(controller name, channel)``.
+
+    Commands for several axes are grouped by physical connection: everything
+    for one connection, chained controllers included, is packed into one
+    batch, and different connections are served concurrently.
+
+    Args:
+        masters (list of NewFocus8742Protocol): controllers on the host
+        axes (dict, optional): logical name -> (controller name, channel)
+        chain (bool): also look for daisy-chained secondaries (SC?)
+    """
+    def __init__(self, masters, axes=None, chain=True):
+        self.controllers = {}
+        self.masters = {}  # controller name -> master it goes through
+        try:
+            for mc in masters:
+                serial = mc.identify().split()[-1]
+                self.controllers[serial] = mc
+                self.masters[serial] = mc
+                if chain:
+                    for address in self.chain_addresses(mc):
+                        name = f'{serial}/{address}'
+                        self.controllers[name] = NewFocus8742Address(mc, address)
+                        self.masters[name] = mc
+        except BaseException:
+            # the masters are ours from here on, do not leave them open
+            for mc in masters:
+                try:
+                    mc.close()
+                except Exception as e:
+                    logger.log(f'closing {mc} failed: {e}', log_levels.ERROR)
+            raise
+        self.axes = dict(axes) if axes is not None else {}
+        self.waiters = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(len(masters), 1))
+
+    @classmethod
+    def from_usb(cls, idVendor='0x104d', idProduct='0x4000', **kwargs):
+        """Manager over every 8742 on USB, see :class:`NewFocus8742Manager`."""
+        return cls(NewFocus8742USB.create_all(idVendor, idProduct), **kwargs)
+
+    @staticmethod
+    def chain_addresses(mc):
+        """Addresses of the secondaries answering on `mc`'s RS-485 network."""
+        own = mc.get_address()
+        bits = mc.get_network()
+        return [n for n in range(2, 32) if bits >> n & 1 and n != own]
+
+    def close(self):
+        self._pool.shutdown()
+        for w in self.waiters.values():
+            w.close()
+        for mc in set(self.masters.values()):
+            mc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def controller(self, name=None):
+        """Controller by name, the first one when `name` is None."""
+        if name is None and self.controllers:
+            return next(iter(self.controllers.values()))
+        if name not in self.controllers:
+            wanted = 'No 8742 controller' if name is None else f'No 8742 controller {name!r}'
+            raise ValueError(f'{wanted} found, connected: {", ".join(self.controllers) or "none"}')
+        return self.controllers[name]
+
+    def axis(self, name):
+        """Resolve a logical axis name to (controller, channel)."""
+        controller, xx = self.axes[name]
+        return self.controllers[controller], xx
+
+    def waiter(self, controller, **kwargs):
+        """:class:`NewFocus8742MotionWaiter` of a controller, made on first use."""
+        if controller not in self.waiters:
+            self.waiters[controller] = NewFocus8742MotionWaiter(self.controllers[controller], **kwargs)
+        return self.waiters[controller]
+
+    def run(self, cmds):
+        """Execute commands addressed by logical axis, return query responses.
+
+        Args:
+            cmds (list): (axis name, command, *parameters) tuples; queries
+                (ending in "?") take int responses
+        Returns:
+            list: responses of the queries in `cmds`, in order
+        """
+        groups = {}  # master -> (batch, [index of each query in cmds])
+        for i, (name, cmd, *nn) in enumerate(cmds):
+            controller, xx = self.axes[name]
+            master = self.masters[controller]
+            if master not in groups:
+                groups[master] = (NewFocus8742Batch(master), [])
+            batch, idx = groups[master]
+            batch.add(self.controllers[controller], cmd, xx, *nn, conv=int if cmd.endswith("?") else None)
+            if cmd.endswith("?"):
+                idx.append(i)
+        futures = [(self._pool.submit(batch.send), idx) for batch, idx in groups.values()]
+        results = {}
+        for fut, idx in futures:
+            results.update(zip(idx, fut.result()))
+        return [results[i] for i in sorted(results)]
+
+    def move_relative(self, moves):
+        """Relative moves given as {axis name: steps}, return one future per axis.
+
+        The futures come from the per-controller motion waiters, see
+        :meth:`waiter`.
+        """
+        self.run([(name, "PR", int(steps)) for name, steps in moves.items()])
+        return {name: self.waiter(self.axes[name][0]).expect(self.axes[name][1], steps)
+                for name, steps in moves.items()}
+
 class NewFocus8742USB(NewFocus8742Protocol):
+    """USB transport for the 8742.
+
+    Responses are reassembled from IN packets into a persistent receive
+    buffer and split on `eol_read`, so replies longer than a packet, split
+    across packets or several replies in one packet (batched queries) are
+    all handled. Each packet is read into one preallocated array.
+    """
     eol_write = b"\r"
     eol_read = b"\r\n"
+    read_timeout = 1000  # ms allowed for a whole response line
+    write_timeout = 1000  # ms
+    flush_timeout = 1  # ms of silence taken as an empty input buffer
 
     @classmethod
     def create(cls, idVendor=0x104d, idProduct=0x4000):
@@ -474,19 +1318,33 @@ class NewFocus8742USB(NewFocus8742Protocol):
         self.idProduct = int(idProduct, 16)
         self.idVendor = int(idVendor, 16)
         self.connect()
-        self.flush()
         return self
 
-    def connect(self,**kwargs):
+    @classmethod
+    def create_all(cls, idVendor='0x104d', idProduct='0x4000'):
+        """Connect to every 8742 on the bus, not only the first one found."""
+        devs = usb.core.find(find_all=True, idProduct=int(idProduct, 16), idVendor=int(idVendor, 16))
+        mcs = []
+        for dev in devs:
+            self = NewFocus8742USB()
+            self.idProduct = dev.idProduct
+            self.idVendor = dev.idVendor
+            self.connect(dev=dev)
+            mcs.append(self)
+        return mcs
+
+    def connect(self, dev=None, **kwargs):
         """Connect to a Newfocus/Newport 8742 controller over USB.
         Args:
+            dev (usb.core.Device, optional): device to open, the first
+                one matching idVendor/idProduct when not given
             **kwargs: passed to `usb.core.find`
         Returns:
             NewFocus8742: Driver instance.
         """
 
         # find the device
-        self.dev = usb.core.find(
+        self.dev = dev if dev is not None else usb.core.find(
                         idProduct=self.idProduct,
                         idVendor=self.idVendor, **kwargs
                         )
@@ -504,7 +1362,7 @@ class NewFocus8742USB(NewFocus8742Protocol):
         cfg = self.dev.get_active_configuration()
         intf = cfg[(0,0)]
 
-        self.ep_out = usb.util.find_descriptor(
+        ep_out = usb.util.find_descriptor(
             intf,
             # match the first OUT endpoint
             custom_match = \
@@ -512,7 +1370,7 @@ class NewFocus8742USB(NewFocus8742Protocol):
                 usb.util.endpoint_direction(e.bEndpointAddress) == \
                 usb.util.ENDPOINT_OUT)
 
-        self.ep_in = usb.util.find_descriptor(
+        ep_in = usb.util.find_descriptor(
             intf,
             # match the first IN endpoint
             custom_match = \
@@ -520,28 +1378,57 @@ class NewFocus8742USB(NewFocus8742Protocol):
                 usb.util.endpoint_direction(e.bEndpointAddress) == \
                 usb.util.ENDPOINT_IN)
 
+        self._setup(ep_out, ep_in)
+
+    @classmethod
+    def from_endpoints(cls, ep_out, ep_in):
+        """Driver on already opened endpoints, e.g. `newfocus_sim.SimulatedUSBEndpoints`."""
+        self = cls()
+        self.dev = None
+        self._setup(ep_out, ep_in)
+        return self
+
+    def _setup(self, ep_out, ep_in):
+        self.ep_out = ep_out
+        self.ep_in = ep_in
         assert (self.ep_out and self.ep_in) is not None
+        self._packet = array.array('B', bytes(self.ep_in.wMaxPacketSize))
+        self._rbuf = bytearray()
+        self._scanned = 0  # bytes of _rbuf already searched for eol_read
+        # drop whatever a previous session left behind before the first query
+        self.flush()
+        self.shadow.invalidate()
         # Confirm connection to user
         resp = self.ask('VE?')
         # print(resp)
         # print("Connected to Motor Controller Model {}. Firmware {} {} {}\n".format(*resp.split(' ')))
-        for m in range(1, 5):
-            resp = self.ask("{}QM?".format(m))
-            # print("Motor #{motor_number}: {status}".format(
-            #     motor_number=m,
-            #     status=MOTOR_TYPE[resp[-1]]
-            # ))
+        # prime the shadow registers, so settings already in place are not rewritten
+        with self.batch() as b:
+            for m in range(1, 5):
+                b.get_type(m)
+                b.get_velocity(m)
+                b.get_acceleration(m)
+                # print("Motor #{motor_number}: {status}".format(
+                #     motor_number=m,
+                #     status=MOTOR_TYPE[resp[-1]]
+                # ))
 
     def flush(self):
         """Drain the input buffer from read data."""
         while True:
             try:
-                self.ep_in.read(64, timeout=10)
+                self.ep_in.read(self._packet, timeout=self.flush_timeout)
             except usb.core.USBError:
                 break
+        del self._rbuf[:]
+        self._scanned = 0
 
     def close(self):
-        usb.util.dispose_resources(self.dev)
+        if self.dev is not None:
+            usb.util.dispose_resources(self.dev)
+
+    def _recover(self):
+        self.flush()
 
     def __enter__(self):
         return self
@@ -550,20 +1437,55 @@ class NewFocus8742USB(NewFocus8742Protocol):
         self.close()
 
     def _writeline(self, cmd):
-        self.ep_out.write(cmd.encode() + self.eol_write)
+        self.ep_out.write(cmd.encode() + self.eol_write, timeout=self.write_timeout)
         # logger.debug(f"Successfully wrote {cmd.encode()}", exc_info=True)
 
     def _readline(self):
-        # This is obviously not asynchronous
-        r = self.ep_in.read(64).tobytes()
-        assert r.endswith(self.eol_read)
-        r = r[:-2].decode()
-        # logger.debug(f"Successfully read {r}", exc_info=True)
-        return r
+        """Return the next response line, reading packets until one is complete.
+
+        Raises:
+            usb.core.USBTimeoutError: no complete line within `read_timeout`.
+        """
+        deadline = monotonic() + self.read_timeout / 1e3
+        while True:
+            # the eol may straddle the last packet boundary, rescan one byte back
+            i = self._rbuf.find(self.eol_read, max(self._scanned - 1, 0))
+            if i >= 0:
+                r = self._rbuf[:i].decode()
+                del self._rbuf[:i + len(self.eol_read)]
+                self._scanned = 0
+                # logger.debug(f"Successfully read {r}", exc_info=True)
+                return r
+            self._scanned = len(self._rbuf)
+            timeout = int((deadline - monotonic()) * 1e3)
+            if timeout <= 0:
+                raise usb.core.USBTimeoutError(f'no complete response line in {self.read_timeout} ms')
+            n = self.ep_in.read(self._packet, timeout=timeout)
+            self._rbuf += memoryview(self._packet)[:n]
 
 class NewFocus8742TCP(NewFocus8742Protocol):
+    """Ethernet/TCP transport for the 8742.
+
+    The socket is driven by an asyncio event loop living in a background
+    thread, so commands can be kept in flight while earlier ones are still
+    waiting for their reply. The controller answers queries in the order they
+    were sent, so replies are matched to requests first-in first-out.
+
+    The controller sends nothing back for an invalid query, which would
+    shift every later reply onto the wrong request. So when a reply times
+    out, all queries still waiting fail with that same timeout and the
+    connection is reopened, to start matching again on a clean stream; new
+    requests wait for the new connection. Queries pipelined behind the one
+    without a reply may have taken a shifted reply before the timeout.
+
+    Both an awaitable (:meth:`ado`, :meth:`aask`) and a blocking (:meth:`do`,
+    :meth:`ask`) API are offered. :meth:`ask_future` returns a
+    :class:`concurrent.futures.Future` so blocking callers can pipeline too.
+    """
     eol_write = b"\r"
     eol_read = b"\r\n"
+    timeout = 1.  # seconds to wait for a reply
+    max_in_flight = 16  # queries sent but not yet answered
 
     @classmethod
     def create(cls, host, port=23, **kwargs):
@@ -576,16 +1498,57 @@ class NewFocus8742TCP(NewFocus8742Protocol):
     def connect(self, **kwargs):
         """Connect to a Newfocus/Newport 8742 controller over Ethernet/TCP.
         Args:
-            host (str): Hostname or IP address of the target device.
+            **kwargs: passed to `asyncio.open_connection`
         Returns:
             NewFocus8742: Driver instance.
         """
-        reader, writer = asyncio.open_connection(self.host, self.port, **kwargs)
-        self._reader = reader
-        self._writer = writer
-        # undocumented? garbage?
-        v = reader.read(6)
-        logger.debug("identifier/serial (?): %s", v)
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+        self._run(self._connect(**kwargs)).result()
+
+    async def _connect(self, **kwargs):
+        self._connect_kwargs = kwargs
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._generation = 0  # connections opened after a lost reply
+        self._lost = None  # the timeout the last resync failed the waiting queries with
+        self._ready = asyncio.Event()  # cleared while resyncing
+        await self._open()
+        self._ready.set()
+
+    async def _open(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, **self._connect_kwargs), self.timeout)
+        # undocumented? garbage? telnet negotiation sent on every new connection
+        v = await asyncio.wait_for(self._reader.read(6), self.timeout)
+        logger.log(f"identifier/serial (?): {v}", log_levels.DEBUG)
+        self._pending = deque()
+        self._read_task = self._loop.create_task(self._read_worker())
+        self.shadow.invalidate()
+
+    async def _resync(self, cmd):
+        """Fail every query waiting for a reply and reopen the connection.
+
+        A reply still on its way to the old socket can then no longer be
+        taken for the answer to a later query, and no request is sent
+        before the new connection is up.
+        """
+        self._generation += 1
+        self._ready.clear()
+        logger.log(f"no reply to {cmd!r}, reconnecting", log_levels.ERROR)
+        self._lost = TimeoutError(f"no reply to {cmd!r} within {self.timeout} s")
+        self._fail_pending(self._lost)
+        self._read_task.cancel()
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        try:
+            await self._open()
+        finally:
+            # a failed reopen surfaces on the next write
+            self._ready.set()
 
     def __enter__(self):
         return self
@@ -594,70 +1557,482 @@ class NewFocus8742TCP(NewFocus8742Protocol):
         self.close()
 
     def close(self):
+        if self._loop.is_closed():
+            return
+        self._run(self._close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+    async def _close(self):
+        self._read_task.cancel()
         self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        self._fail_pending(ConnectionError("connection closed"))
 
-    def _writeline(self, cmd):
-        self._writer.write(cmd.encode() + self.eol_write)
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
 
-    def _readline(self):
-        r = self._reader.readline()
-        assert r.endswith(self.eol_read)
-        return r[:-2].decode()
+    def _fail_pending(self, exc):
+        while self._pending:
+            fut = self._pending.popleft()
+            if not fut.done():
+                fut.set_exception(exc)
+
+    async def _read_worker(self):
+        while True:
+            try:
+                r = await self._reader.readuntil(self.eol_read)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                self._fail_pending(ConnectionError(f"connection lost: {e}"))
+                return
+            if not self._pending:
+                logger.log(f"unsolicited reply dropped: {r}", log_levels.ERROR)
+                continue
+            fut = self._pending.popleft()
+            if not fut.done():  # the caller may have timed out already
+                fut.set_result(r[:-2].decode())
+
+    async def _request(self, cmd, n_replies):
+        """Send one line and wait for its `n_replies` responses.
+
+        Writing the line and queueing its futures happen in the same step of
+        the event loop, so the reply order always matches the queue order no
+        matter in which order concurrent requests got scheduled.
+        """
+        assert len(cmd) < 64
+        acquired = 0
+        try:
+            for _ in range(n_replies):
+                await self._in_flight.acquire()
+                acquired += 1
+            while not self._ready.is_set():
+                await self._ready.wait()
+            t = perf_counter()
+            generation = self._generation
+            try:
+                self._writer.write(cmd.encode() + self.eol_write)
+                futs = [self._loop.create_future() for _ in range(n_replies)]
+                self._pending.extend(futs)
+                await self._writer.drain()
+                # shield: the futures stay queued until resolved or failed by _resync,
+                # so the replies that do arrive are consumed in order
+                replies = asyncio.gather(*futs)
+                r = await asyncio.wait_for(asyncio.shield(replies), self.timeout)
+            except asyncio.TimeoutError:
+                # nobody waits for the replies any more, _resync fails them
+                replies.add_done_callback(lambda f: f.cancelled() or f.exception())
+                if generation == self._generation:
+                    await self._resync(cmd)
+                # every query that was waiting fails with the one timeout
+                if self.stats is not None:
+                    self.stats.record(cmd, None, perf_counter() - t, self._lost)
+                raise self._lost from None
+            except Exception as e:
+                if self.stats is not None:
+                    self.stats.record(cmd, None, perf_counter() - t, e)
+                raise
+        finally:
+            for _ in range(acquired):
+                self._in_flight.release()
+        if self.stats is not None:
+            self.stats.record(cmd, r, perf_counter() - t)
+        return r
+
+    def do_future(self, cmd, xx=None, *nn):
+        """Schedule a command, return a :class:`concurrent.futures.Future`.
+
+        Bypasses the shadow, which just forgets what the command may change.
+        """
+        self.shadow.discard(cmd, xx)
+        return self._run(self._request(self.fmt_cmd(cmd, xx, *nn), 0))
+
+    async def _ask_one(self, cmd):
+        return (await self._request(cmd, 1))[0]
+
+    def ask_future(self, cmd, xx=None, *nn):
+        """Schedule a query, return a :class:`concurrent.futures.Future`
+        resolving to the response string. Bypasses the shadow."""
+        assert cmd.endswith("?")
+        return self._run(self._ask_one(self.fmt_cmd(cmd, xx, *nn)))
+
+    async def ado(self, cmd, xx=None, *nn):
+        """Awaitable :meth:`do`, usable from any event loop."""
+        return await asyncio.wrap_future(self.do_future(cmd, xx, *nn))
+
+    async def aask(self, cmd, xx=None, *nn):
+        """Awaitable :meth:`ask`, usable from any event loop."""
+        return await asyncio.wrap_future(self.ask_future(cmd, xx, *nn))
+
+    def _do(self, line):
+        self._run(self._request(line, 0)).result()
+
+    def _ask(self, line):
+        return self._run(self._ask_one(line)).result()
+
+    def _transact(self, line, n_replies):
+        return self._run(self._request(line, n_replies)).result()
 
 # ____________________________________________________________________________________________________________________________
 
 #Libraries
 from pyueye import ueye
 import numpy as np
+import centroids as centroid_algorithms
+from centroid_log import CentroidLogWriter
+from centroid_bus import CentroidPublisher
+from drift_stats import DriftStats
+
+Frame = namedtuple('Frame', ['image', 'seq', 'timestamp', 'device_timestamp', 'origin'], defaults=((0, 0),))
+Frame.__doc__ = """A captured image, with the driver frame number (`seq`), the host
+wall time it was received (`timestamp`, s since epoch), the camera
+clock timestamp (`device_timestamp`, s) and the sensor (y, x) of its
+top left pixel (`origin`), not (0, 0) when the sensor AOI is reduced."""
+
+CameraProfile = namedtuple('CameraProfile', ['mono', 'binning', 'subsampling', 'pixel_clock', 'fps', 'exposure'],
+                           defaults=(True, 1, 1, None, None, None))
+CameraProfile.__doc__ = """Capture settings for :meth:`uEyeCamera.configure`: 8 bit `mono`
+instead of the colour depth of the sensor, sensor `binning` and
+`subsampling` factors (the same along x and y), `pixel_clock` [MHz],
+frame rate `fps` [Hz] and `exposure` [ms]. A None pixel clock or frame
+rate picks the fastest one; a None exposure keeps the current one, as far
+as the frame rate allows."""
+
+FrameStack = namedtuple('FrameStack', ['images', 'seq', 'timestamp', 'origin'])
+FrameStack.__doc__ = """Consecutive mono frames: (N, H, W) `images`, with the (N,) frame
+numbers `seq` and host `timestamp`s and the (N, 2) sensor (y, x) `origin`
+of each frame."""
+
+FrameSet = namedtuple('FrameSet', ['frames', 'timestamp', 'skew', 'arrival_skew'])
+FrameSet.__doc__ = """Frames exposed together by a :class:`uEyeCaptureGroup`, one per
+camera, with their mean host arrival `timestamp` (s since epoch). `skew`
+is the spread of the exposure starts as far as the host can tell (of the
+software triggers, else of the arrivals) and `arrival_skew` the spread of
+the arrival times, both in s."""
+
+class StackRequest:
+    """A stack of the next `n` frames of a camera, filled as they arrive.
+
+    The (n, H, W) array is allocated up front for the current AOI and frames
+    are copied straight into it; frames of another size (the AOI changed
+    meanwhile) are skipped.
+    """
+    def __init__(self, n, shape):
+        self.n = n
+        self.count = 0
+        self.images = np.empty((n,) + tuple(shape), dtype=np.uint8)
+        self.seq = np.empty(n, dtype=np.int64)
+        self.timestamp = np.empty(n)
+        self.origin = np.empty((n, 2), dtype=int)
+        self.future = Future()
+
+    def add(self, frame):
+        """Copy `frame` into the stack; True once it is full."""
+        image = centroid_algorithms.mono(frame.image)
+        if image.shape != self.images.shape[1:]:
+            return False
+        i = self.count
+        self.images[i] = image
+        self.seq[i], self.timestamp[i], self.origin[i] = frame.seq, frame.timestamp, frame.origin
+        self.count += 1
+        if self.count == self.n:
+            self.future.set_result(FrameStack(self.images, self.seq, self.timestamp, self.origin))
+            return True
+        return False
+
+    def result(self, timeout=None):
+        """Block for the full :class:`FrameStack`.
+
+        Raises:
+            StarGuideError: not filled within `timeout` s, or capture failed.
+        """
+        done, _ = wait_futures([self.future], timeout)
+        if not done:
+            raise StarGuideError(f'{self.count} of {self.n} frames within {timeout} s')
+        return self.future.result()
+
+CentroidSample = namedtuple('CentroidSample', ['position', 'seq', 'timestamp'])
+CentroidSample.__doc__ = """Beam centroid (`position`, (y, x) px) of the frame `seq` captured
+at `timestamp` (s since epoch)."""
+
+class CentroidBuffer:
+    """Preallocated ring buffer of the timestamped centroids of a camera.
+
+    Besides the last `maxlen` samples it keeps, for every sample, the
+    running count, sum and sum of squares of the valid (not NaN) positions,
+    so the mean and variance over the last n samples or seconds are the
+    difference of two entries. The median partitions a per thread scratch
+    copy of the window. Nothing is allocated per sample.
+
+    Filled by one writer (the camera acquisition worker) under a lock. The
+    control loop and the viewer read without locking: a read works on the
+    samples published when it starts and is retried if the writer wrapped
+    around onto them meanwhile. Windows span at most maxlen - RESERVE
+    samples. Once per lap of the ring the sums are rebuilt around the
+    newest position, so they neither grow nor lose precision as the beam
+    drifts away from where it started.
+
+    Args:
+        maxlen (int): samples kept
+    """
+    RESERVE = 16  # samples the writer may add while a read is in progress
+
+    def __init__(self, maxlen=1000):
+        self.maxlen = maxlen
+        self.position = np.full((maxlen, 2), np.nan)
+        self.seq = np.full(maxlen, -1, dtype=np.int64)
+        self.timestamp = np.zeros(maxlen)
+        # running (count, sum y, sum x, sum y^2, sum x^2) up to each sample, slot i+1 for sample i;
+        # positions enter as offsets from the first one so the sums stay small
+        self._sums = np.zeros((maxlen + 1, 5))
+        self._delta = np.empty(2)
+        self._origin = None
+        self._local = threading.local()
+        self._generation = 0  # odd while the sums are rebuilt
+        self.count = 0  # samples ever appended, published once a sample is complete
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return min(self.count, self.maxlen)
+
+    def append(self, position, seq, timestamp):
+        with self._cond:
+            i = self.count
+            k = i % self.maxlen
+            self.position[k] = position
+            self.seq[k], self.timestamp[k] = seq, timestamp
+            previous, sums = self._sums[i % (self.maxlen + 1)], self._sums[(i + 1) % (self.maxlen + 1)]
+            if np.isnan(self.position[k]).any():
+                sums[:] = previous
+            else:
+                if self._origin is None:
+                    self._origin = self.position[k].copy()
+                np.subtract(self.position[k], self._origin, out=self._delta)
+                sums[0] = previous[0] + 1
+                np.add(previous[1:3], self._delta, out=sums[1:3])
+                np.add(previous[3:5], self._delta ** 2, out=sums[3:5])
+            self.count = i + 1
+            if self.count % self.maxlen == 0:
+                self._rebase()
+            self._cond.notify_all()
+
+    def _rebase(self):
+        """Rebuild the running sums of the buffered samples as offsets from the newest position."""
+        start, stop = self.count - self.maxlen, self.count
+        positions = self._copy(start, stop)
+        valid = ~np.isnan(positions[:, 0])
+        if not valid.any():
+            return
+        self._generation += 1
+        self._origin = positions[valid][-1].copy()
+        delta = np.where(valid[:, None], positions - self._origin, 0)
+        slots = np.arange(start + 1, stop + 1) % (self.maxlen + 1)
+        self._sums[start % (self.maxlen + 1)] = 0
+        self._sums[slots, 0] = np.cumsum(valid)
+        self._sums[slots, 1:3] = np.cumsum(delta, axis=0)
+        self._sums[slots, 3:5] = np.cumsum(delta ** 2, axis=0)
+        self._generation += 1
+
+    def _first_after(self, t, start, stop):
+        """First sample index in [start, stop) with a timestamp after `t`, `stop` if none."""
+        while start < stop:
+            mid = (start + stop) // 2
+            if self.timestamp[mid % self.maxlen] > t:
+                stop = mid
+            else:
+                start = mid + 1
+        return start
+
+    def _read(self, f, n=None, seconds=None):
+        """f(start, stop) on the sample indices of the last `n` samples or `seconds`."""
+        while True:
+            generation = self._generation
+            if generation % 2:
+                sleep(0)
+                continue
+            stop = self.count
+            span = self.maxlen - self.RESERVE if n is None else min(n, self.maxlen - self.RESERVE)
+            start = max(stop - span, 0)
+            if seconds is not None:
+                start = self._first_after(time() - seconds, start, stop)
+            result = f(start, stop)
+            # the sample being written may have reused the slot of `start`, or the sums were rebuilt
+            if self.count + 1 - start <= self.maxlen and generation == self._generation:
+                return result
+
+    def _window_sums(self, start, stop):
+        """Origin and (count, sum y, sum x, sum y^2, sum x^2) of the samples [start, stop)."""
+        return self._origin, self._sums[stop % (self.maxlen + 1)] - self._sums[start % (self.maxlen + 1)]
+
+    def _copy(self, start, stop):
+        """The positions of samples [start, stop) in a per thread scratch array."""
+        scratch = getattr(self._local, 'scratch', None)
+        if scratch is None:
+            scratch = self._local.scratch = np.empty((self.maxlen, 2))
+        m, k = stop - start, start % self.maxlen
+        first = min(m, self.maxlen - k)
+        scratch[:first] = self.position[k:k + first]
+        scratch[first:m] = self.position[:m - first]
+        return scratch[:m]
+
+    def latest(self):
+        """Newest sample, None if empty."""
+        c = self.count
+        if not c:
+            return None
+        k = (c - 1) % self.maxlen
+        return CentroidSample(self.position[k].copy(), int(self.seq[k]), float(self.timestamp[k]))
+
+    def valid(self, n=None, seconds=None):
+        """Number of samples with a spot among the last `n` samples, or the last `seconds`."""
+        return int(self._read(self._window_sums, n, seconds)[1][0])
+
+    def mean(self, n=None, seconds=None):
+        """(y, x) mean of the last `n` samples or `seconds`, NaN without a spot in them."""
+        origin, sums = self._read(self._window_sums, n, seconds)
+        if not sums[0]:
+            return np.array([np.nan, np.nan])
+        return origin + sums[1:3] / sums[0]
+
+    def var(self, n=None, seconds=None):
+        """(y, x) variance of the last `n` samples or `seconds`."""
+        _, sums = self._read(self._window_sums, n, seconds)
+        if not sums[0]:
+            return np.array([np.nan, np.nan])
+        return np.maximum(sums[3:5] / sums[0] - (sums[1:3] / sums[0]) ** 2, 0)
+
+    def std(self, n=None, seconds=None):
+        return np.sqrt(self.var(n, seconds))
+
+    def median(self, n=None, seconds=None):
+        """(y, x) median of the last `n` samples or `seconds`, O(window)."""
+        window = self._read(self._copy, n, seconds)
+        valid = len(window) - int(np.isnan(window[:, 0]).sum())
+        if not valid:
+            return np.array([np.nan, np.nan])
+        # NaNs sort last, the median is among the first `valid`
+        lo, hi = (valid - 1) // 2, valid // 2
+        window.partition([lo, hi], axis=0)
+        return (window[lo] + window[hi]) / 2
+
+    def positions(self, n=None, seconds=None):
+        """(m, 2) copy of the last `n` positions or those of the last `seconds`, oldest first."""
+        return self._read(self._copy, n, seconds).copy()
+
+    def wait(self, n=1, after=None, timeout=None):
+        """Block until `n` samples newer than `after` are buffered and return them.
+
+        Args:
+            after (float): timestamp, defaults to now
+            timeout (float): seconds
+
+        Raises:
+            StarGuideError: fewer than `n` new samples within `timeout`.
+        """
+        after = time() if after is None else after
+        new = lambda: self.count - self._first_after(after, max(self.count - len(self), 0), self.count)
+        with self._cond:
+            if not self._cond.wait_for(lambda: new() >= n, timeout):
+                raise StarGuideError(f'{new()} of {n} centroids within {timeout} s')
+            stop = self.count
+        return [CentroidSample(self.position[i % self.maxlen].copy(), int(self.seq[i % self.maxlen]),
+                               float(self.timestamp[i % self.maxlen])) for i in range(stop - n, stop)]
 
 class uEyeCamera:
-    def __init__(self, HID=0):
+    """uEye camera capturing into a ring of image memories.
+
+    The driver fills `N_BUFFERS` image memories in turn (an image memory
+    sequence in queue mode) and hands out every completed frame once, locked,
+    so frames are never read while being written. :meth:`wait_for_frame`
+    blocks for the next frame; :meth:`get_image` returns the newest one
+    without waiting.
+
+    :meth:`start` runs a worker that takes every frame at the sensor frame
+    rate, centroids it and stores the result in `centroids`, a
+    :class:`CentroidBuffer`; while it runs, the get_* methods only read
+    what the worker produced.
+
+    :meth:`track` switches to ROI tracking: only a window around the last
+    centroid is processed, so the cost per frame follows the spot size
+    instead of the sensor size. Centroids are always in full resolution
+    sensor pixels, whatever the AOI, binning or subsampling.
+
+    :meth:`set_trigger` switches from free run to software or hardware
+    triggered exposures, as used by :class:`uEyeCaptureGroup`.
+
+    Args:
+        HID (int): 0 for the first available camera, 1-254 for a camera ID
+        backend (module, optional): pyueye ``ueye`` API implementation,
+            e.g. `fake_ueye` to run without a camera
+        centroider (str or callable): centroid algorithm, a name in
+            `centroids.ALGORITHMS` or an instance (see `centroids.py`)
+        profile (CameraProfile, optional): capture settings to apply, see
+            :meth:`configure`; by default a 12 MHz pixel clock and, for colour
+            sensors, the colour depth of the desktop
+    """
+    N_BUFFERS = 8  # image memories in the capture ring
+    FRAME_TIMEOUT = 1.  # default seconds to wait for a frame
+    ROI_HALF_SIZE = 48  # half side of the tracking window [px]
+    AOI_STEP = 8  # granularity of the sensor AOI position and size [px]
+    TRIGGER_MODES = {
+        'freerun': 'IS_SET_TRIGGER_OFF',  # live video at the set frame rate
+        'software': 'IS_SET_TRIGGER_SOFTWARE',  # one frame per trigger()
+        'hardware': 'IS_SET_TRIGGER_LO_HI',  # one frame per rising edge on the trigger input
+    }
+
+    def __init__(self, HID=0, backend=None, centroider='threshold', profile=None):
         #---------------------------------------------------------------------------------------------------------------------------------------
 
         #Variables
-        self.hCam = ueye.HIDS(HID)             #0: first available camera;  1-254: The camera with the specified camera ID
-        self.sInfo = ueye.SENSORINFO()
-        self.cInfo = ueye.CAMINFO()
-        self.pcImageMemory = ueye.c_mem_p()
-        self.MemID = ueye.int()
-        self.rectAOI = ueye.IS_RECT()
-        self.pitch = ueye.INT()
-        self.nBitsPerPixel = ueye.INT(24)    #24: bits per pixel for color mode; take 8 bits per pixel for monochrome
+        self.ueye = ueye if backend is None else backend
+        self.centroider = centroid_algorithms.get_algorithm(centroider)
+        self.hCam = self.ueye.HIDS(HID)             #0: first available camera;  1-254: The camera with the specified camera ID
+        self.sInfo = self.ueye.SENSORINFO()
+        self.cInfo = self.ueye.CAMINFO()
+        self.pcImageMemory = self.ueye.c_mem_p()
+        self.MemID = self.ueye.int()
+        self.buffers = []  # (pcImageMemory, MemID) of the capture ring
+        self.rectAOI = self.ueye.IS_RECT()
+        self.pitch = self.ueye.INT()
+        self.nBitsPerPixel = self.ueye.INT(24)    #24: bits per pixel for color mode; take 8 bits per pixel for monochrome
         self.channels = 3                        #3: channels for color mode(RGB); take 1 channel for monochrome
-        self.m_nColorMode = ueye.INT()       # Y8/RGB16/RGB24/REG32
+        self.m_nColorMode = self.ueye.INT()       # Y8/RGB16/RGB24/REG32
         self.bytes_per_pixel = int(self.nBitsPerPixel / 8)
-        self.pixelclock = ueye.UINT()
+        self.pixelclock = self.ueye.UINT()
         #---------------------------------------------------------------------------------------------------------------------------------------
         # print("START")
         # print()
 
 
         # Starts the driver and establishes the connection to the camera
-        self.nRet = ueye.is_InitCamera(self.hCam, None)
-        if self.nRet != ueye.IS_SUCCESS:
+        self.nRet = self.ueye.is_InitCamera(self.hCam, None)
+        if self.nRet != self.ueye.IS_SUCCESS:
             print("is_InitCamera ERROR")
 
         # Reads out the data hard-coded in the non-volatile camera memory and writes it to the data structure that cInfo points to
-        self.nRet = ueye.is_GetCameraInfo(self.hCam, self.cInfo)
-        if self.nRet != ueye.IS_SUCCESS:
+        self.nRet = self.ueye.is_GetCameraInfo(self.hCam, self.cInfo)
+        if self.nRet != self.ueye.IS_SUCCESS:
             print("is_GetCameraInfo ERROR")
 
         # You can query additional information about the sensor type used in the camera
-        self.nRet = ueye.is_GetSensorInfo(self.hCam, self.sInfo)
-        if self.nRet != ueye.IS_SUCCESS:
+        self.nRet = self.ueye.is_GetSensorInfo(self.hCam, self.sInfo)
+        if self.nRet != self.ueye.IS_SUCCESS:
             print("is_GetSensorInfo ERROR")
 
-        self.nRet = ueye.is_ResetToDefault( self.hCam)
-        if self.nRet != ueye.IS_SUCCESS:
+        self.nRet = self.ueye.is_ResetToDefault( self.hCam)
+        if self.nRet != self.ueye.IS_SUCCESS:
             print("is_ResetToDefault ERROR")
 
         # Set display mode to DIB
-        self.nRet = ueye.is_SetDisplayMode(self.hCam, ueye.IS_SET_DM_DIB)
+        self.nRet = self.ueye.is_SetDisplayMode(self.hCam, self.ueye.IS_SET_DM_DIB)
 
         # Set the right color mode
-        if int.from_bytes(self.sInfo.nColorMode.value, byteorder='big') == ueye.IS_COLORMODE_BAYER:
+        if int.from_bytes(self.sInfo.nColorMode.value, byteorder='big') == self.ueye.IS_COLORMODE_BAYER:
             # setup the color depth to the current windows setting
-            ueye.is_GetColorDepth(self.hCam, self.nBitsPerPixel, self.m_nColorMode)
+            self.ueye.is_GetColorDepth(self.hCam, self.nBitsPerPixel, self.m_nColorMode)
             self.bytes_per_pixel = int(self.nBitsPerPixel / 8)
             # print("IS_COLORMODE_BAYER: ", )
             # print("\tm_nColorMode: \t\t", self.m_nColorMode)
@@ -665,10 +2040,10 @@ class uEyeCamera:
             # print("\tbytes_per_pixel: \t\t", self.bytes_per_pixel)
             # print()
 
-        elif int.from_bytes(self.sInfo.nColorMode.value, byteorder='big') == ueye.IS_COLORMODE_CBYCRY:
+        elif int.from_bytes(self.sInfo.nColorMode.value, byteorder='big') == self.ueye.IS_COLORMODE_CBYCRY:
             # for color camera models use RGB32 mode
-            self.m_nColorMode = ueye.IS_CM_BGRA8_PACKED
-            self.nBitsPerPixel = ueye.INT(32)
+            self.m_nColorMode = self.ueye.IS_CM_BGRA8_PACKED
+            self.nBitsPerPixel = self.ueye.INT(32)
             self.bytes_per_pixel = int(self.nBitsPerPixel / 8)
             # print("IS_COLORMODE_CBYCRY: ", )
             # print("\tm_nColorMode: \t\t", self.m_nColorMode)
@@ -676,10 +2051,10 @@ class uEyeCamera:
             # print("\tbytes_per_pixel: \t\t", self.bytes_per_pixel)
             # print()
 
-        elif int.from_bytes(self.sInfo.nColorMode.value, byteorder='big') == ueye.IS_COLORMODE_MONOCHROME:
+        elif int.from_bytes(self.sInfo.nColorMode.value, byteorder='big') == self.ueye.IS_COLORMODE_MONOCHROME:
             # for color camera models use RGB32 mode
-            self.m_nColorMode = ueye.IS_CM_MONO8
-            self.nBitsPerPixel = ueye.INT(8)
+            self.m_nColorMode = self.ueye.IS_CM_MONO8
+            self.nBitsPerPixel = self.ueye.INT(8)
             self.bytes_per_pixel = int(self.nBitsPerPixel / 8)
             # print("IS_COLORMODE_MONOCHROME: ", )
             # print("\tm_nColorMode: \t\t", self.m_nColorMode)
@@ -689,23 +2064,23 @@ class uEyeCamera:
 
         else:
             # for monochrome camera models use Y8 mode
-            self.m_nColorMode = ueye.IS_CM_MONO8
-            self.nBitsPerPixel = ueye.INT(8)
+            self.m_nColorMode = self.ueye.IS_CM_MONO8
+            self.nBitsPerPixel = self.ueye.INT(8)
             self.bytes_per_pixel = int(self.nBitsPerPixel / 8)
             # print("else")
 
         # Can be used to set the size and position of an "area of interest"(AOI) within an image
-        self.nRet = ueye.is_AOI(self.hCam, ueye.IS_AOI_IMAGE_GET_AOI, self.rectAOI, ueye.sizeof(self.rectAOI))
-        # if self.nRet != ueye.IS_SUCCESS:
+        self.nRet = self.ueye.is_AOI(self.hCam, self.ueye.IS_AOI_IMAGE_GET_AOI, self.rectAOI, self.ueye.sizeof(self.rectAOI))
+        # if self.nRet != self.ueye.IS_SUCCESS:
             # print("is_AOI ERROR")
 
         self.width = self.rectAOI.s32Width
         self.height = self.rectAOI.s32Height
 
         # Set PixelClock
-        if ueye.is_PixelClock(self.hCam, ueye.IS_PIXELCLOCK_CMD_SET, ueye.UINT(12), ueye.sizeof(self.pixelclock)):
+        if self.ueye.is_PixelClock(self.hCam, self.ueye.IS_PIXELCLOCK_CMD_SET, self.ueye.UINT(12), self.ueye.sizeof(self.pixelclock)):
             print('error while setting pixelclock')
-        ueye.is_PixelClock(self.hCam, ueye.IS_PIXELCLOCK_CMD_GET, self.pixelclock, ueye.sizeof(self.pixelclock))
+        self.ueye.is_PixelClock(self.hCam, self.ueye.IS_PIXELCLOCK_CMD_GET, self.pixelclock, self.ueye.sizeof(self.pixelclock))
 
         # Prints out some information about the camera and the sensor
         # print("Camera model:\t\t", self.sInfo.strSensorName.decode('utf-8'))
@@ -713,84 +2088,625 @@ class uEyeCamera:
         # print("Maximum image width:\t", self.width)
         # print("Maximum image height:\t", self.height)
 
+        self._capture_lock = threading.Lock()
+        self.trigger_mode = 'freerun'
+        self.group = None  # uEyeCaptureGroup taking the frames
         self.allocate_image_memory()     
-        self.centroids = deque(maxlen=1000)
-        self.centroids.append([np.NaN, np.NaN])
-        self.centroids.append([np.NaN, np.NaN])
+        self.sensor_shape = (self.height.value, self.width.value)
+        self.aoi_origin = (0, 0)
+        self.tracking = False
+        self.hardware_roi = False
+        self.roi_half_size = self.ROI_HALF_SIZE
+        self.roi = None  # (y0, y1, x0, x1) tracking window in image pixels, None for full frame
+        self.pixel_scale = 1  # sensor pixels per image pixel, from binning and subsampling
+        self._threshold = None  # spot threshold from the last full frame
+        self.frame = np.zeros((self.height.value, self.width.value, self.bytes_per_pixel), dtype=np.uint8)
+        self.last_frame = Frame(self.frame, -1, 0., 0.)
+        self._centroid_seq = -1  # frame number of the last centroid appended
+        self.centroid = np.array([np.nan, np.nan])
+        self.centroid_result = centroid_algorithms.no_spot()  # with the width, SNR and quality of the last centroid
+        self.centroids = CentroidBuffer(maxlen=1000)
+        self._acquisition_thread = None
+        self._acquisition_running = False
+        self._stack_lock = threading.Lock()
+        self._stacks = []  # StackRequests filled by the acquisition worker
+        self.profile = None
+        if profile is not None:
+            self.configure(profile)
 
     def allocate_image_memory(self):
         #---------------------------------------------------------------------------------------------------------------------------------------
 
-        # Allocates an image memory for an image having its dimensions defined by width and height and its color depth defined by nBitsPerPixel
-        self.nRet = ueye.is_AllocImageMem(self.hCam, self.width, self.height, self.nBitsPerPixel, self.pcImageMemory, self.MemID)
-        if self.nRet != ueye.IS_SUCCESS:
-            print("is_AllocImageMem ERROR")
-        else:
-            # Makes the specified image memory the active memory
-            self.nRet = ueye.is_SetImageMem(self.hCam, self.pcImageMemory, self.MemID)
-            if self.nRet != ueye.IS_SUCCESS:
-                print("is_SetImageMem ERROR")
-            else:
-                # Set the desired color mode
-                self.nRet = ueye.is_SetColorMode(self.hCam, self.m_nColorMode)
-
-
-
-        # Activates the camera's live video mode (free run mode)
-        self.nRet = ueye.is_CaptureVideo(self.hCam, ueye.IS_DONT_WAIT)
-        if self.nRet != ueye.IS_SUCCESS:
+        # Allocates the ring of image memories, each for an image having its dimensions defined by width
+        # and height and its color depth defined by nBitsPerPixel, and adds them to the capture sequence
+        for _ in range(self.N_BUFFERS):
+            pcImageMemory, MemID = self.ueye.c_mem_p(), self.ueye.int()
+            self.nRet = self.ueye.is_AllocImageMem(self.hCam, self.width, self.height, self.nBitsPerPixel, pcImageMemory, MemID)
+            if self.nRet != self.ueye.IS_SUCCESS:
+                print("is_AllocImageMem ERROR")
+                break
+            self.nRet = self.ueye.is_AddToSequence(self.hCam, pcImageMemory, MemID)
+            if self.nRet != self.ueye.IS_SUCCESS:
+                print("is_AddToSequence ERROR")
+            self.buffers.append((pcImageMemory, MemID))
+        self.pcImageMemory, self.MemID = self.buffers[0]
+
+        # Set the desired color mode
+        self.nRet = self.ueye.is_SetColorMode(self.hCam, self.m_nColorMode)
+
+        # Enables the queue mode for existing image memory sequences: every completed
+        # frame stays locked until handed out and released with is_UnlockSeqBuf
+        self.nRet = self.ueye.is_InitImageQueue(self.hCam, 0)
+        if self.nRet != self.ueye.IS_SUCCESS:
+            print("is_InitImageQueue ERROR")
+
+        # Activates the camera's live video mode (free run mode, or waiting for triggers)
+        self.nRet = self._start_video()
+        if self.nRet != self.ueye.IS_SUCCESS:
             print("is_CaptureVideo ERROR")
 
-        # Enables the queue mode for existing image memory sequences
-        self.nRet = ueye.is_InquireImageMem(self.hCam, self.pcImageMemory, self.MemID, self.width, self.height, self.nBitsPerPixel, self.pitch)
-        if self.nRet != ueye.IS_SUCCESS:
+        self.nRet = self.ueye.is_InquireImageMem(self.hCam, self.pcImageMemory, self.MemID, self.width, self.height, self.nBitsPerPixel, self.pitch)
+        if self.nRet != self.ueye.IS_SUCCESS:
             print("is_InquireImageMem ERROR")
         # else:
             # print("Press q to leave the programm")
 
+    def free_image_memory(self):
+        """Stop live video and release the image memory ring."""
+        self.ueye.is_StopLiveVideo(self.hCam, self.ueye.IS_FORCE_VIDEO_STOP)
+        self.ueye.is_ExitImageQueue(self.hCam)
+        self.ueye.is_ClearSequence(self.hCam)
+        # Releases the image memories that were allocated using is_AllocImageMem() and removes them from the driver management
+        for pcImageMemory, MemID in self.buffers:
+            self.ueye.is_FreeImageMem(self.hCam, pcImageMemory, MemID)
+        self.buffers = []
+
+    def _start_video(self):
+        # with software triggers every frame is taken by is_FreezeVideo, in trigger()
+        if self.trigger_mode == 'software':
+            return self.ueye.IS_SUCCESS
+        return self.ueye.is_CaptureVideo(self.hCam, self.ueye.IS_DONT_WAIT)
+
+    def _check(self, nRet, what):
+        if nRet != self.ueye.IS_SUCCESS:
+            raise StarGuideError(f'camera {self.hCam.value}: {what} failed with error {nRet}')
+
+    def _factor_mode(self, kind, factor):
+        """is_SetBinning/is_SetSubSampling mode of `factor` along x and y, checked against the sensor."""
+        if factor == 1:
+            return getattr(self.ueye, f'IS_{kind}_DISABLE')
+        vertical = getattr(self.ueye, f'IS_{kind}_{factor}X_VERTICAL', None)
+        horizontal = getattr(self.ueye, f'IS_{kind}_{factor}X_HORIZONTAL', None)
+        set_mode = self.ueye.is_SetBinning if kind == 'BINNING' else self.ueye.is_SetSubSampling
+        supported = set_mode(self.hCam, getattr(self.ueye, f'IS_GET_SUPPORTED_{kind}'))
+        if vertical is None or horizontal is None or (vertical | horizontal) & supported != vertical | horizontal:
+            raise StarGuideError(f'camera {self.hCam.value} does not support {kind.lower()} by {factor}')
+        return vertical | horizontal
+
+    def configure(self, profile):
+        """Apply a :class:`CameraProfile`, checked against the limits of the camera.
+
+        Mono8 moves a third of the data of 24 bit colour per frame, and
+        binning or subsampling by n another n^2 less, so the pixel clock can
+        reach higher frame rates. The frame rate range depends on the pixel
+        clock and the AOI, and the exposure range on the frame rate, so they
+        are set and checked in that order. Live video is restarted with a new
+        image memory ring; the acquisition worker must be stopped.
+
+        Raises:
+            StarGuideError: a setting the camera does not support or outside its
+                range. Capture resumes with the settings applied so far.
+        """
+        if self._streaming():
+            raise StarGuideError(f'camera {self.hCam.value}: stop the acquisition before configuring')
+        ue = self.ueye
+        with self._capture_lock:
+            self.free_image_memory()
+            try:
+                if profile.mono:
+                    self.m_nColorMode, self.nBitsPerPixel = ue.IS_CM_MONO8, ue.INT(8)
+                self._check(ue.is_SetColorMode(self.hCam, self.m_nColorMode), 'setting the color mode')
+                self.bytes_per_pixel = int(self.nBitsPerPixel / 8)
+                self.channels = self.bytes_per_pixel
+
+                binning, subsampling = self._factor_mode('BINNING', profile.binning), self._factor_mode('SUBSAMPLING', profile.subsampling)
+                self._check(ue.is_SetBinning(self.hCam, binning), 'setting the binning')
+                self._check(ue.is_SetSubSampling(self.hCam, subsampling), 'setting the subsampling')
+                # full sensor AOI of the binned/subsampled image
+                factor = profile.binning * profile.subsampling
+                self.rectAOI.s32X.value, self.rectAOI.s32Y.value = 0, 0
+                self.rectAOI.s32Width.value = self.sInfo.nMaxWidth.value // factor // self.AOI_STEP * self.AOI_STEP
+                self.rectAOI.s32Height.value = self.sInfo.nMaxHeight.value // factor // self.AOI_STEP * self.AOI_STEP
+                self._check(ue.is_AOI(self.hCam, ue.IS_AOI_IMAGE_SET_AOI, self.rectAOI, ue.sizeof(self.rectAOI)), 'setting the AOI')
+                self.width.value, self.height.value = self.rectAOI.s32Width.value, self.rectAOI.s32Height.value
+
+                clock_range = (ue.UINT * 3)()
+                self._check(ue.is_PixelClock(self.hCam, ue.IS_PIXELCLOCK_CMD_GET_RANGE, clock_range, ue.sizeof(clock_range)), 'reading the pixel clock range')
+                low, high, _ = (int(v) for v in clock_range)
+                clock = high if profile.pixel_clock is None else profile.pixel_clock
+                if not low <= clock <= high:
+                    raise StarGuideError(f'camera {self.hCam.value}: pixel clock {clock} MHz outside {low}-{high} MHz')
+                self._check(ue.is_PixelClock(self.hCam, ue.IS_PIXELCLOCK_CMD_SET, ue.UINT(clock), ue.sizeof(self.pixelclock)), 'setting the pixel clock')
+                ue.is_PixelClock(self.hCam, ue.IS_PIXELCLOCK_CMD_GET, self.pixelclock, ue.sizeof(self.pixelclock))
+
+                t_min, t_max, t_inc = ue.double(), ue.double(), ue.double()
+                self._check(ue.is_GetFrameTimeRange(self.hCam, t_min, t_max, t_inc), 'reading the frame time range')
+                fps_low, fps_high = 1 / t_max.value, 1 / t_min.value
+                fps = fps_high if profile.fps is None else profile.fps
+                if not fps_low * (1 - 1e-6) <= fps <= fps_high * (1 + 1e-6):
+                    raise StarGuideError(f'camera {self.hCam.value}: {fps} fps outside {fps_low:.3g}-{fps_high:.3g} fps at {clock} MHz')
+                new_fps = ue.double()
+                self._check(ue.is_SetFrameRate(self.hCam, ue.double(fps), new_fps), 'setting the frame rate')
+                self.fps = new_fps.value
+
+                exposure_range = (ue.double * 3)()
+                self._check(ue.is_Exposure(self.hCam, ue.IS_EXPOSURE_CMD_GET_EXPOSURE_RANGE, exposure_range, ue.sizeof(exposure_range)), 'reading the exposure range')
+                low, high, _ = (float(v) for v in exposure_range)
+                exposure = ue.double()
+                if profile.exposure is None:
+                    ue.is_Exposure(self.hCam, ue.IS_EXPOSURE_CMD_GET_EXPOSURE, exposure, ue.sizeof(exposure))
+                    exposure.value = min(exposure.value, high)
+                elif low <= profile.exposure <= high:
+                    exposure.value = profile.exposure
+                else:
+                    raise StarGuideError(f'camera {self.hCam.value}: exposure {profile.exposure} ms outside {low:.3g}-{high:.3g} ms at {self.fps:.3g} fps')
+                self._check(ue.is_Exposure(self.hCam, ue.IS_EXPOSURE_CMD_SET_EXPOSURE, exposure, ue.sizeof(exposure)), 'setting the exposure')
+                self.exposure = exposure.value
+                self.pixel_scale = factor
+                self.profile = profile
+            finally:
+                self.allocate_image_memory()
+                self.sensor_shape = (self.height.value, self.width.value)
+                self.aoi_origin, self.roi = (0, 0), None
+                self.frame = np.zeros((self.height.value, self.width.value, self.bytes_per_pixel), dtype=np.uint8)
+                self.last_frame = Frame(self.frame, -1, 0., 0.)
+
+    def _next_frame(self, timeout):
+        """Take the next queued frame out of the ring, None after `timeout` s."""
+        pcImageMemory, MemID = self.ueye.c_mem_p(), self.ueye.int()
+        self.nRet = self.ueye.is_WaitForNextImage(self.hCam, int(timeout * 1e3), pcImageMemory, MemID)
+        if self.nRet != self.ueye.IS_SUCCESS:
+            return None
+        try:
+            info = self.ueye.UEYEIMAGEINFO()
+            self.ueye.is_GetImageInfo(self.hCam, MemID, info, self.ueye.sizeof(info))
+            array = self.ueye.get_data(pcImageMemory, self.width, self.height, self.nBitsPerPixel, self.pitch, copy=False)
+            # ...copy it into a numpy array, the memory goes back to the driver right after; rows
+            # keep the pitch of the memory when the AOI is smaller
+            image = np.reshape(array, (self.height.value, self.pitch.value))[:, :self.width.value * self.bytes_per_pixel]
+            image = image.reshape(self.height.value, self.width.value, self.bytes_per_pixel).copy()
+        finally:
+            self.ueye.is_UnlockSeqBuf(self.hCam, MemID, pcImageMemory)
+        # device timestamps count in 0.1 us
+        return Frame(image, int(info.u64FrameNumber.value), time(), info.u64TimestampDevice.value * 1e-7, self.aoi_origin)
+
+    def wait_for_frame(self, timeout=None):
+        """Block until the next frame is captured.
+
+        Raises:
+            StarGuideError: no frame within `timeout` (default FRAME_TIMEOUT) s.
+        """
+        timeout = self.FRAME_TIMEOUT if timeout is None else timeout
+        with self._capture_lock:
+            frame = self._next_frame(timeout)
+            if frame is None:
+                raise StarGuideError(f'no frame from camera {self.hCam.value} within {timeout} s')
+            self.last_frame, self.frame = frame, frame.image
+        return frame
+
+    def get_frame(self):
+        """Newest captured frame, without waiting; the previous one if none is new."""
+        if self._streaming():
+            return self.last_frame
+        with self._capture_lock:
+            while True:
+                frame = self._next_frame(0)
+                if frame is None:
+                    break
+                self.last_frame, self.frame = frame, frame.image
+        return self.last_frame
+
     def get_image(self):
-        array = ueye.get_data(self.pcImageMemory, self.width, self.height, self.nBitsPerPixel, self.pitch, copy=False)
-        self.bytes_per_pixel = int(self.nBitsPerPixel / 8)
-        # ...reshape it in an numpy array...
-        self.frame = np.reshape(array,(self.height.value, self.width.value, self.bytes_per_pixel))
-        return self.frame
+        return self.get_frame().image
+
+    def sensor_image(self, frame):
+        """Image of `frame` placed on the full sensor, blank outside a reduced AOI."""
+        if frame.image.shape[:2] == self.sensor_shape:
+            return frame.image
+        image = np.zeros(self.sensor_shape + frame.image.shape[2:], dtype=frame.image.dtype)
+        (y0, x0), (h, w) = frame.origin, frame.image.shape[:2]
+        image[y0:y0 + h, x0:x0 + w] = frame.image
+        return image
+
+    def set_aoi(self, rect=None):
+        """Reprogram the sensor AOI, restarting live video.
+
+        Args:
+            rect (tuple): (x, y, width, height) in image pixels, multiples of
+                AOI_STEP; the full sensor if None
+
+        Raises:
+            StarGuideError: the camera refused the AOI.
+        """
+        height, width = self.sensor_shape
+        x, y, w, h = (0, 0, width, height) if rect is None else rect
+        with self._capture_lock:
+            self.ueye.is_StopLiveVideo(self.hCam, self.ueye.IS_FORCE_VIDEO_STOP)
+            # frames of the old AOI still queued are discarded
+            self.ueye.is_ExitImageQueue(self.hCam)
+            old = (self.rectAOI.s32X.value, self.rectAOI.s32Y.value, self.width.value, self.height.value)
+            self.rectAOI.s32X.value, self.rectAOI.s32Y.value = x, y
+            self.rectAOI.s32Width.value, self.rectAOI.s32Height.value = w, h
+            self.nRet = self.ueye.is_AOI(self.hCam, self.ueye.IS_AOI_IMAGE_SET_AOI, self.rectAOI, self.ueye.sizeof(self.rectAOI))
+            if self.nRet != self.ueye.IS_SUCCESS:
+                self.rectAOI.s32X.value, self.rectAOI.s32Y.value, self.rectAOI.s32Width.value, self.rectAOI.s32Height.value = old
+            else:
+                self.aoi_origin = (y, x)
+            self.width.value, self.height.value = self.rectAOI.s32Width.value, self.rectAOI.s32Height.value
+            self.ueye.is_InitImageQueue(self.hCam, 0)
+            self._start_video()
+        if self.nRet != self.ueye.IS_SUCCESS:
+            raise StarGuideError(f'camera {self.hCam.value} refused AOI {rect}: error {self.nRet}')
+
+    def set_trigger(self, mode):
+        """Switch between free run and triggered capture, restarting live video.
+
+        Frames still queued are discarded.
+
+        Args:
+            mode (str): a key of TRIGGER_MODES; 'software' exposes one frame
+                per :meth:`trigger`, 'hardware' one per rising edge on the
+                trigger input
+
+        Raises:
+            StarGuideError: the camera refused the trigger mode; it stays in
+                the previous one.
+        """
+        if mode not in self.TRIGGER_MODES:
+            raise ValueError(f'unknown trigger mode {mode!r}, use one of {list(self.TRIGGER_MODES)}')
+        with self._capture_lock:
+            self.ueye.is_StopLiveVideo(self.hCam, self.ueye.IS_FORCE_VIDEO_STOP)
+            self.ueye.is_ExitImageQueue(self.hCam)
+            self.nRet = self.ueye.is_SetExternalTrigger(self.hCam, getattr(self.ueye, self.TRIGGER_MODES[mode]))
+            if self.nRet == self.ueye.IS_SUCCESS:
+                self.trigger_mode = mode
+            self.ueye.is_InitImageQueue(self.hCam, 0)
+            self._start_video()
+        self._check(self.nRet, f'setting the {mode} trigger')
+
+    def trigger(self):
+        """Start the exposure of one frame in software trigger mode, without waiting for it.
+
+        Returns:
+            float: host time of the trigger (s since epoch)
+        """
+        t = time()
+        self._check(self.ueye.is_FreezeVideo(self.hCam, self.ueye.IS_DONT_WAIT), 'software trigger')
+        return t
+
+    def track(self, enable=True, half_size=None, hardware=False):
+        """Switch ROI tracking of the beam spot on or off.
+
+        The spot is found on a full frame, then only a window of
+        2 * `half_size` px around the last centroid is centroided, with the
+        threshold of that full frame. When the spot is lost the next frame
+        is searched in full again.
+
+        Args:
+            half_size (int): half side of the window, ROI_HALF_SIZE if None
+            hardware (bool): also reduce the sensor AOI around the window to
+                cut readout bandwidth. The AOI is twice the window and only
+                moves when the window leaves it, since each change restarts
+                live video.
+        """
+        self.tracking = enable
+        self.roi_half_size = self.ROI_HALF_SIZE if half_size is None else half_size
+        self.roi = None
+        if self.hardware_roi and not (enable and hardware):
+            self.set_aoi(None)
+        self.hardware_roi = enable and hardware
+
+    def _window(self, center, half, step=1):
+        """(y0, y1, x0, x1) square of half side `half` around `center`, on `step` px, inside the sensor."""
+        bounds = []
+        for c, size in zip(center, self.sensor_shape):
+            lo = int(np.clip(c - half, 0, size)) // step * step
+            hi = min(-(-int(np.ceil(c + half)) // step) * step, size)
+            bounds += [lo, max(hi, lo + step)]
+        return tuple(bounds)
+
+    def _track(self, centroid):
+        """Move the tracking window (and the sensor AOI) after `centroid`."""
+        if np.isnan(centroid).any():
+            # lost the spot: search the full frame again
+            self.roi = None
+            if self.hardware_roi and (self.aoi_origin != (0, 0) or (self.height.value, self.width.value) != self.sensor_shape):
+                self.set_aoi(None)
+            return
+        self.roi = self._window(centroid, self.roi_half_size)
+        if self.hardware_roi:
+            y0, y1, x0, x1 = self.roi
+            (ay, ax), aoi_h, aoi_w = self.aoi_origin, self.height.value, self.width.value
+            full = (aoi_h, aoi_w) == self.sensor_shape
+            if full or y0 < ay or x0 < ax or y1 > ay + aoi_h or x1 > ax + aoi_w:
+                ay0, ay1, ax0, ax1 = self._window(centroid, 2 * self.roi_half_size, self.AOI_STEP)
+                self.set_aoi((ax0, ay0, ax1 - ax0, ay1 - ay0))
+
+    def compute_centroid(self, image, threshold=None):
+        """Centroid of the beam spot in `image` with the camera's centroid algorithm.
+
+        Returns:
+            CentroidResult: position (y, x) in pixels of `image`, NaN if no spot.
+        """
+        return self.centroider(image, threshold)
+
+    def sensor_pixels(self, position):
+        """Full resolution sensor coordinates of an image `position` (undoes binning/subsampling)."""
+        return np.asarray(position) * self.pixel_scale + (self.pixel_scale - 1) / 2
+
+    def image_pixels(self, position):
+        """Image coordinates of a sensor `position`, the inverse of :meth:`sensor_pixels`."""
+        return (np.asarray(position) - (self.pixel_scale - 1) / 2) / self.pixel_scale
+
+    def _add_centroid(self, frame):
+        (oy, ox), image = frame.origin, frame.image
+        if self.tracking and self.roi is not None:
+            y0, y1, x0, x1 = self.roi
+            y0, x0 = max(y0 - oy, 0), max(x0 - ox, 0)
+            result = self.compute_centroid(image[y0:y1 - oy, x0:x1 - ox], self._threshold)
+            centroid = result.position + (y0 + oy, x0 + ox)
+        else:
+            self._threshold = self.centroider.threshold(image)
+            result = self.compute_centroid(image, self._threshold)
+            centroid = result.position + (oy, ox)
+        if self.tracking:
+            self._track(centroid)
+        self.centroid = self.sensor_pixels(centroid)
+        self.centroid_result = result._replace(position=self.centroid, width=result.width * self.pixel_scale)
+        # a frame already accounted for must not weigh twice in the mean
+        if frame.seq != self._centroid_seq:
+            self._centroid_seq = frame.seq
+            self.centroids.append(self.centroid, frame.seq, frame.timestamp)
+        return self.centroid
 
     def get_centroid(self):
-        self.get_image()
-        try:
-            MAX = max(np.percentile(self.frame, 99), 127)
-            ret,thresh = cv2.threshold(self.frame,MAX,255,0)
-            M = cv2.moments(thresh)
+        if self._streaming():
+            latest = self.centroids.latest()
+            return self.centroid if latest is None else latest.position
+        return self._add_centroid(self.get_frame())
+
+    def _streaming(self):
+        """True while frames are taken in the background, by the acquisition worker or a capture group."""
+        return self._acquisition_running or self.group is not None
+
+    def start(self):
+        """Start the acquisition worker: capture and centroid every frame in the background."""
+        if self._acquisition_running:
+            return
+        if self.group is not None:
+            raise StarGuideError(f'camera {self.hCam.value} is captured by a capture group')
+        self._acquisition_running = True
+        self._acquisition_thread = threading.Thread(
+            target=self.__acquisition_worker, name=f'uEyeCamera-{self.hCam.value}', daemon=True)
+        self._acquisition_thread.start()
+
+    def stop(self):
+        """Stop the acquisition worker, back to capturing on demand."""
+        self._acquisition_running = False
+        if self._acquisition_thread is not None:
+            self._acquisition_thread.join()
+            self._acquisition_thread = None
+        with self._stack_lock:
+            stacks, self._stacks = self._stacks, []
+        for stack in stacks:
+            stack.future.set_exception(StarGuideError(f'camera {self.hCam.value} acquisition stopped'))
+
+    def __acquisition_worker(self):
+        while self._acquisition_running:
             try:
-                self.centroid = np.array([ float(M['m01']/M['m00']), float(M['m10']/M['m00'])])
-            except ZeroDivisionError:
-                self.centroid = np.array([np.nan, np.nan])
-            # self.frame = self.get_image()
-            # m,n, _ = self.frame.shape
-            # self.centroid = np.unravel_index(np.argmax(self.frame), (m,n))
-            # print(centroid, self.centroid)
-        except (RuntimeWarning, ValueError) as e:
-            self.centroid = np.array([np.nan, np.nan])
-            pass
-        self.centroids.append(self.centroid)
-        return self.centroid
+                frame = self.wait_for_frame()
+            except StarGuideError as e:
+                logger.log(str(e), log_levels.ERROR)
+                continue
+            self._process_frame(frame)
+
+    def _process_frame(self, frame):
+        """Feed a frame taken in the background to the stack requests and the centroids."""
+        if self._stacks:
+            with self._stack_lock:
+                self._stacks = [stack for stack in self._stacks if not stack.add(frame)]
+        self._add_centroid(frame)
+
+    def request_stack(self, n):
+        """Start stacking the next `n` frames, see :meth:`grab_stack`.
+
+        Returns:
+            StackRequest: call its `result` for the stack. Requests on several
+            cameras fill at the same time.
+        """
+        stack = StackRequest(n, (self.height.value, self.width.value))
+        if self._streaming():
+            with self._stack_lock:
+                self._stacks.append(stack)
+            return stack
+        try:
+            while not stack.add(self.wait_for_frame()):
+                pass
+        except StarGuideError as e:
+            stack.future.set_exception(e)
+        return stack
+
+    def grab_stack(self, n, timeout=None):
+        """The next `n` frames, as one (n, H, W) array.
+
+        Args:
+            timeout (float): seconds, n * FRAME_TIMEOUT by default
+
+        Returns:
+            FrameStack
+        """
+        return self.request_stack(n).result(n * self.FRAME_TIMEOUT if timeout is None else timeout)
+
+    def centroid_stack(self, stack):
+        """Centroid statistics of a :class:`FrameStack`, in sensor pixels.
+
+        All frames are centroided in one vectorized pass where the centroid
+        algorithm supports it (see `centroids.py`).
+
+        Returns:
+            StackCentroid: (y, x) mean, median and std over the `count`
+            frames with a spot.
+        """
+        return centroid_algorithms.summarize(self.sensor_pixels(self.centroider.stack(stack.images) + stack.origin))
+
+    def stack_centroid(self, n, timeout=None):
+        """:meth:`centroid_stack` of the next `n` frames."""
+        return self.centroid_stack(self.grab_stack(n, timeout))
 
     def get_mean_centroid(self, num_c):
-        centroids = np.array(self.centroids)
-        if len(centroids) < num_c:
-            return np.nanmean(centroids, axis=0)[::-1]
-        else:
-            return np.nanmean(centroids[:num_c:-1, :], axis=0)[::-1]
+        """(x, y) mean of the last `num_c` centroids."""
+        return self.centroids.mean(num_c)[::-1]
 
     def __del__(self):
         name = self.sInfo.strSensorName.decode('utf-8')
-        # Releases an image memory that was allocated using is_AllocImageMem() and removes it from the driver management
-        ueye.is_FreeImageMem(self.hCam, self.pcImageMemory, self.MemID)
+        self.stop()
+        self.free_image_memory()
 
         # Disables the hCam camera handle and releases the data structures and memory areas taken up by the uEye camera
-        ueye.is_ExitCamera(self.hCam)
+        self.ueye.is_ExitCamera(self.hCam)
         # print(f'Camera {name} closed')
 
+class uEyeCaptureGroup:
+    """Synchronized capture with several uEyeCameras.
+
+    Each :meth:`capture` exposes all cameras at once, then waits for, reads
+    and centroids their frames on one thread per camera, so a sample of
+    all cameras costs one exposure and readout instead of one per camera.
+    The trigger is one of:
+
+        software    the software triggers of all cameras are fired back to back
+        hardware    the cameras expose on a rising edge at their trigger
+                    inputs, wired to a common pulse source
+        freerun     no trigger: live video, pairing the frames closest in time
+
+    Without software triggers, frames arriving more than `max_skew` s
+    apart were not exposed together (a missed trigger edge, or free
+    running cameras a frame apart): the cameras behind take their next
+    frame until the set matches. Software triggered frames are paired by
+    their triggers instead, since a camera behind gets no next frame
+    until it is triggered again; their arrival skew is only measured.
+
+    The cameras' own acquisition workers are stopped; the frames go to
+    their centroid buffers and stack requests instead, so stacks requested
+    on several cameras hold frames exposed together, and then to the
+    `listeners`, called with each FrameSet. :meth:`start` keeps capturing
+    in the background, :meth:`close` gives the cameras back in free run.
+
+    Args:
+        cams (list): uEyeCameras
+        trigger (str): 'software', 'hardware' or 'freerun'
+        max_skew (float): largest arrival skew of matching frames [s], half
+            the shortest frame period if None
+    """
+    MAX_RESYNC = 3  # frames a camera may skip to match the others
+
+    def __init__(self, cams, trigger='software', max_skew=None):
+        if trigger not in uEyeCamera.TRIGGER_MODES:
+            raise ValueError(f'unknown trigger mode {trigger!r}, use one of {list(uEyeCamera.TRIGGER_MODES)}')
+        self.cams = list(cams)
+        self.trigger = trigger
+        if max_skew is None:
+            fps = [cam.fps for cam in self.cams if getattr(cam, 'fps', None)]
+            max_skew = 0.5 / max(fps) if fps else np.inf
+        self.max_skew = max_skew
+        self.last = None  # newest FrameSet
+        self.skews = deque(maxlen=1000)  # skew of the last FrameSets [s]
+        self.listeners = []  # called with every FrameSet, in the capturing thread
+        self._pool = ThreadPoolExecutor(max_workers=len(self.cams), thread_name_prefix='uEyeCaptureGroup')
+        self._thread = None
+        self._running = False
+        for cam in self.cams:
+            cam.stop()
+            cam.group = self
+            cam.set_trigger(trigger)
+
+    def _wait_frames(self, cams, timeout):
+        futures = [self._pool.submit(cam.wait_for_frame, timeout) for cam in cams]
+        return [future.result() for future in futures]
+
+    def capture(self, timeout=None):
+        """Expose all cameras together and return their frames.
+
+        Args:
+            timeout (float): seconds to wait for each frame, FRAME_TIMEOUT by default
+
+        Returns:
+            FrameSet
+
+        Raises:
+            StarGuideError: a camera gave no frame in time.
+        """
+        timeout = uEyeCamera.FRAME_TIMEOUT if timeout is None else timeout
+        triggers = [cam.trigger() for cam in self.cams] if self.trigger == 'software' else None
+        frames = self._wait_frames(self.cams, timeout)
+        if triggers is not None:
+            # a frame older than its trigger is a leftover of a capture that timed out
+            for _ in range(self.MAX_RESYNC):
+                stale = [i for i, (frame, t) in enumerate(zip(frames, triggers)) if frame.timestamp < t]
+                if not stale:
+                    break
+                for i, frame in zip(stale, self._wait_frames([self.cams[i] for i in stale], timeout)):
+                    frames[i] = frame
+        for _ in range(0 if triggers is not None else self.MAX_RESYNC):
+            newest = max(frame.timestamp for frame in frames)
+            behind = [i for i, frame in enumerate(frames) if frame.timestamp < newest - self.max_skew]
+            if not behind:
+                break
+            for i, frame in zip(behind, self._wait_frames([self.cams[i] for i in behind], timeout)):
+                frames[i] = frame
+        for future in [self._pool.submit(cam._process_frame, frame) for cam, frame in zip(self.cams, frames)]:
+            future.result()
+        arrivals = [frame.timestamp for frame in frames]
+        starts = arrivals if triggers is None else triggers
+        frame_set = FrameSet(frames, float(np.mean(arrivals)), max(starts) - min(starts), max(arrivals) - min(arrivals))
+        self.last = frame_set
+        self.skews.append(frame_set.skew)
+        for listener in self.listeners:
+            listener(frame_set)
+        return frame_set
+
+    def start(self):
+        """Capture continuously in the background."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.__capture_worker, name='uEyeCaptureGroup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop capturing in the background; pending stack requests fail."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for cam in self.cams:
+            cam.stop()
+
+    def __capture_worker(self):
+        while self._running:
+            try:
+                self.capture()
+            except StarGuideError as e:
+                logger.log(str(e), log_levels.ERROR)
+
+    def close(self):
+        """Stop and release the cameras, back in free run."""
+        self.stop()
+        for cam in self.cams:
+            cam.group = None
+            cam.set_trigger('freerun')
+        self._pool.shutdown()
+
 # ____________________________________________________________________________________________________________________________
 class uEyeMainWindow(QMainWindow):
     def __init__(self, parent, cam1, cam2, target1=None, target2=None, logging=True, **kwargs):
@@ -811,10 +2727,20 @@ class uEyeViewer(QWidget):
     """
     Widget containing a main viewer, plus some cursor information.
 
+    The frames of both cameras are shown side by side as one uint8 image,
+    downsampled to about the screen resolution of the view and written in
+    place into a display buffer that is only reallocated when the zoom or
+    the camera settings change. The centroid and target lines are created
+    once and moved. Redraws are skipped when no camera has a new frame; the
+    render rate and time per redraw are shown below the image.
+
     Parameters
     ----------
     image : ndarray
     """
+    RENDER_INTERVAL = 20  # ms between checks for new frames
+    LOG_INTERVAL = 0.1  # s between logged centroids
+    CENTROID_LOG = 'positions.sglog'  # see centroid_log.py
 
     def __init__(self, parent, cam1, cam2, target1=None, target2=None, logging=True, **kwargs):
         super().__init__(parent, **kwargs)
@@ -827,12 +2753,27 @@ class uEyeViewer(QWidget):
         self.target1 = target1
         self.target2 = target2
         self.current_hists = []
-        self.current_plot_lines = []
-        self.acc = 1
-        self.times = deque(maxlen=100)
-        self.centroids = deque(maxlen=100)
+        self.centroid_log = CentroidLogWriter(self.CENTROID_LOG) if logging else None
+        self.drawn_seqs = None  # frame numbers on screen
+        self.display = None  # uint8 buffer on screen, both cameras downsampled by `downsample`
+        self.downsample = 1
+        self.offsets = [0, 0]  # image x of the left edge of each camera
+        self.layout_key = None  # what the display buffer and the lines were laid out for
+        self.render_ticks = deque(maxlen=100)  # perf_counter of the last redraws
+        self.render_times = deque(maxlen=100)  # s per redraw
+        self.last_log = 0.
         self.cursor_info = QLabel("")
         self.cursor_info.setAlignment(pg.QtCore.Qt.AlignCenter)
+        self.render_info = QLabel("")
+        self.render_info.setAlignment(pg.QtCore.Qt.AlignCenter)
+
+        self.viewer.setImage(np.zeros((1, 1), dtype=np.uint8), levels=(0, 255), autoRange=False, autoHistogramRange=False)
+        self.image_item = self.viewer.getImageItem()
+        # (vertical, horizontal) lines per camera, only moved from here on
+        self.centroid_lines = [(pg.PlotCurveItem(pen=pg.mkPen('g')), pg.PlotCurveItem(pen=pg.mkPen('g'))) for _ in range(2)]
+        self.target_lines = [(pg.PlotCurveItem(pen=pg.mkPen('r')), pg.PlotCurveItem(pen=pg.mkPen('r'))) for _ in range(2)]
+        for item in (item for lines in self.centroid_lines + self.target_lines for item in lines):
+            self.viewer.getView().addItem(item)
 
         self.engage_closed_loop_btn = QPushButton('Engage lock')
         self.engage_closed_loop_btn.setEnabled(True)
@@ -851,18 +2792,13 @@ class uEyeViewer(QWidget):
         #do things to redirect stdout
         self.queue = Queue()
         sys.stdout = WriteStream(self.queue)
-        # Create thread that will listen on the other end of the queue, and send the text to the textedit in our application
-        self.stdout_thread = QThread()
-        self.receiver = Receiver(self.queue)
-        self.receiver.mysignal.connect(self.append_text)
-        self.receiver.moveToThread(self.stdout_thread)
-        self.stdout_thread.started.connect(self.receiver.run)
-        self.stdout_thread.start()
-        self.stdout_box = Editor() #custom QTextEdit class with autoadjust height
+        # the console takes the queued text on a timer
+        self.stdout_box = LogConsole(self.queue)
 
         layout = QVBoxLayout(self)
         layout.addWidget(self.viewer)
         layout.addWidget(self.cursor_info)
+        layout.addWidget(self.render_info)
 
         btns = QHBoxLayout()
         btns.addWidget(self.acquire_motion_matrix_btn)
@@ -875,7 +2811,7 @@ class uEyeViewer(QWidget):
 
         self.timer = pg.QtCore.QTimer()
         self.timer.timeout.connect(self.update)
-        self.timer.start(int(1e2))  # fires every 100ms (frame rate 10 Hz, max 14 Hz)
+        self.timer.start(self.RENDER_INTERVAL)  # the cameras capture at their own frame rate; only new frames are drawn
 
 
     def update_cursor_info(self, event):
@@ -883,19 +2819,15 @@ class uEyeViewer(QWidget):
         mouse_point = self.viewer.getView().mapSceneToView(event[0])
         i, j = int(mouse_point.y()), int(mouse_point.x())
         try:
-            val = self.viewer.getImageItem().image[i, j][0]
-        except IndexError:
+            val = self.display[i // self.downsample, j // self.downsample] if i >= 0 and j >= 0 else 0
+        except (IndexError, TypeError):
             val = 0
         self.cursor_info.setText(
             f"Position: ({i},{j}) | Pixel value: {val:.2f} cnts"
         )
     
     def __del__(self):
-        self.stdout_thread.terminate()
-
-    def append_text(self,text):
-        self.stdout_box.moveCursor(QTextCursor.End)
-        self.stdout_box.insertPlainText( text )
+        sys.stdout = O_STDOUT
 
     def acquire_matrix(self):
         dialog = QMessageBox.question(
@@ -930,70 +2862,210 @@ class uEyeViewer(QWidget):
         else:
             self.parent.parent.stop()
 
+    def _layout(self):
+        """(Re)allocate the display buffer and place the target lines, when the zoom or the cameras changed."""
+        # one display pixel per screen pixel at the current zoom, full resolution when zoomed in
+        pixel_size = self.viewer.getView().viewPixelSize()
+        downsample = max(1, int(min(pixel_size))) if all(np.isfinite(pixel_size)) else self.downsample
+        cams = (self.cam1, self.cam2)
+        key = (downsample,) + tuple((cam.sensor_shape, cam.pixel_scale) for cam in cams)
+        if key == self.layout_key:
+            return
+        self.layout_key, self.downsample = key, downsample
+        first = self.display is None
+        shapes = [(-(-h // downsample), -(-w // downsample)) for h, w in (cam.sensor_shape for cam in cams)]
+        self.display = np.zeros((max(h for h, _ in shapes), sum(w for _, w in shapes)), dtype=np.uint8)
+        self.offsets = [0, shapes[0][1] * downsample]
+        self.image_item.setImage(self.display, autoLevels=False)
+        # display pixels cover `downsample` image pixels, the lines and cursor stay in image pixels
+        self.image_item.setRect(pg.QtCore.QRectF(0, 0, self.display.shape[1] * downsample, self.display.shape[0] * downsample))
+        if first:
+            # show both cameras; the next tick downsamples for this zoom
+            self.viewer.getView().autoRange()
+        for cam, origin, target, (x_line, y_line) in zip(cams, self.offsets, (self.target1, self.target2), self.target_lines):
+            height, width = cam.sensor_shape
+            if target is None:
+                x_line.setVisible(False)
+                y_line.setVisible(False)
+                continue
+            x, y = cam.image_pixels(target)
+            x_line.setData(x=[origin + x, origin + x], y=[0, height])
+            y_line.setData(x=[origin, origin + width], y=[y, y])
+        self.drawn_seqs = None
+
+    def _blit(self, cam, frame, origin):
+        """Write `frame`, downsampled, into the part of the display buffer of `cam`."""
+        ds = self.downsample
+        (y0, x0), (h, w) = frame.origin, frame.image.shape[:2]
+        left = origin // ds
+        region = self.display[:, left:left - (-cam.sensor_shape[1] // ds)]
+        if (h, w) != cam.sensor_shape:
+            # blank around a reduced AOI
+            region[...] = 0
+        # sample on the grid of the full sensor, also when the AOI is reduced
+        ry, rx = -(-y0 // ds), -(-x0 // ds)
+        image = centroid_algorithms.mono(frame.image[ry * ds - y0::ds, rx * ds - x0::ds])
+        region[ry:ry + image.shape[0], rx:rx + image.shape[1]] = image
+
     def update(self):
-        self.image1 = self.cam1.get_image().astype(float)
-        self.image1 /= self.image1.max()
-        self.image2 = self.cam2.get_image().astype(float)
-        self.image2 /= self.image2.max()
-        self.frame = np.concatenate((self.image1, self.image2), axis=1)
-        self.viewer.setImage(self.frame, autoLevels=False, autoRange=False, autoHistogramRange=False)
-        # self.viewer.setLevels(min=0, max=np.percentile(self.frame, 99))
-
-        self.centroid_viewer = self.viewer.getView()
-        for line in self.current_plot_lines: 
-            self.centroid_viewer.removeItem(line)
-        self.current_plot_lines = []
+        # the cameras capture and centroid on their own; only draw what is new since the last tick
+        frame1, frame2 = self.cam1.get_frame(), self.cam2.get_frame()
+        self._layout()
+        if (frame1.seq, frame2.seq) == self.drawn_seqs:
+            return
+        t = perf_counter()
+        for cam, frame, origin in zip((self.cam1, self.cam2), (frame1, frame2), self.offsets):
+            self._blit(cam, frame, origin)
+        self.drawn_seqs = (frame1.seq, frame2.seq)
+        self.image_item.setImage(self.display, autoLevels=False)
+
         centroids = []
-        for idc, (cam, btn, target) in enumerate(zip([self.cam1, self.cam2], [self.viewer.ui.roiBtn, self.viewer.ui.menuBtn], [self.target1, self.target2])):
+        for cam, btn, origin, (x_line, y_line) in zip([self.cam1, self.cam2], [self.viewer.ui.roiBtn, self.viewer.ui.menuBtn], self.offsets, self.centroid_lines):
             y, x = cam.get_centroid()
             centroids.append([y,x])
             btn.setText(f'({x:3.1f},{y:3.1f})')
-            # if idc == 0: self.setWindowTitle(f"{x:3.0f}, {y:3.0f}")
-            origin = self.cam1.width.value if idc == 1 else 0
-
-            self.current_x_centroid = pg.PlotCurveItem(
-                x = origin + x*np.ones((100,)), y = np.linspace(0, cam.height.value, 100), pen=pg.mkPen('g')
-            )
-            self.current_y_centroid = pg.PlotCurveItem(
-                x = origin + np.linspace(0, cam.width.value, 100), y = y*np.ones((100,)), pen=pg.mkPen('g')
+            # draw in the pixels of the (binned) image
+            y, x = cam.image_pixels([y, x])
+            height, width = cam.sensor_shape
+            found = not np.isnan(x) and not np.isnan(y)
+            x_line.setVisible(found)
+            y_line.setVisible(found)
+            if found:
+                x_line.setData(x=[origin + x, origin + x], y=[0, height])
+                y_line.setData(x=[origin, origin + width], y=[y, y])
+
+        now = perf_counter()
+        self.render_times.append(now - t)
+        self.render_ticks.append(now)
+        if len(self.render_ticks) > 1:
+            fps = (len(self.render_ticks) - 1) / (self.render_ticks[-1] - self.render_ticks[0])
+            self.render_info.setText(
+                f"Render: {fps:.1f} fps | {1e3 * np.mean(self.render_times):.1f} ms/frame "
+                f"(max {1e3 * max(self.render_times):.1f} ms) | 1:{self.downsample}"
             )
 
-            if target is not None:
-                x_line = pg.PlotCurveItem(
-                    x = origin + target[0]*np.ones((100,)), y = np.linspace(0, cam.height.value, 100), pen=pg.mkPen('r')
-                )
-                y_line = pg.PlotCurveItem(
-                    x = origin + np.linspace(0, cam.width.value, 100), y = target[1]*np.ones((100,)), pen=pg.mkPen('r')
-                )
-                self.current_plot_lines.append(x_line)
-                self.current_plot_lines.append(y_line)         
-
-            self.current_plot_lines.append(self.current_x_centroid)
-            self.current_plot_lines.append(self.current_y_centroid)
-
-        if self.logging:
-            self.centroids.append(centroids)
-            self.times.append(datetime.now())
-            if self.acc % 100 == 0:
-                logger.data = "\n".join(self.stdout_box.toPlainText().split('\n'))
-                logger.write_to_file()
-                if os.path.exists('positions.npz'):
-                    previous_data = np.load('positions.npz', allow_pickle=True)
-                    p_c = previous_data['centroids'].reshape(-1, 2, 2)
-                    c_c =  np.array(self.centroids).reshape(-1,2,2)
-                    p_t = previous_data['times'].reshape(-1,)
-                    c_t = np.array(self.times).reshape(-1,)
-                    # logger.log(f"Previous c shape {p_c.shape}, Current {c_c.shape}")
-                    # logger.log(f"Previous time shape {p_t.shape}, Current {c_t.shape}")
-                    np.savez('positions.npz', 
-                        centroids = np.concatenate((p_c, c_c), axis=0), 
-                        times = np.concatenate((p_t,c_t), axis=0)
-                    )
-                else:
-                    np.savez('positions.npz', centroids = self.centroids, times = self.times)
-        for line in self.current_plot_lines: 
-            self.centroid_viewer.addItem(line)
-        self.acc += 1
+        if self.centroid_log is not None and now - self.last_log >= self.LOG_INTERVAL:
+            self.last_log = now
+            self.centroid_log.append(time(), centroids, (self.target1, self.target2), self.parent.parent._alignment_running)
+
+ControlCycle = namedtuple('ControlCycle', ['deadline', 'start', 'end', 'sample', 'compute', 'command', 'settle'])
+ControlCycle.__doc__ = """Timing of one cycle of a :class:`ControlLoopScheduler`: the
+`deadline` it was due, its `start` and `end` (perf_counter s), and the
+seconds spent waiting for the `sample`, to `compute` the correction, to
+`command` the motors and for them to `settle`."""
+
+class ControlLoopScheduler:
+    """Runs a control loop at a fixed `period` and times its cycles.
+
+    Cycle k is due at k * period after the first. The body marks the end of
+    each of its phases (:attr:`PHASES`) with :meth:`mark`, and after the body
+    the scheduler sleeps until the next deadline. A cycle running past the
+    next deadline is an overrun: the next cycle starts right away and the
+    deadlines after it are counted from there, so the loop does not burst
+    to catch up on the deadlines it `missed`.
+
+    The last `history` cycles are kept in :attr:`cycles` for
+    :meth:`summary`: achieved rate, jitter of the period and of the start
+    after the deadline, phase durations and overruns.
+
+    Args:
+        period (float): target seconds from the start of a cycle to the next
+        history (int): cycles kept for the statistics
+    """
+    PHASES = ('sample', 'compute', 'command', 'settle')
+    FINE_WAIT = .02  # last part of a wait slept instead of waited on the stop event, which can be a timer tick late
+
+    def __init__(self, period, history=1000):
+        self.period = period
+        self.cycles = deque(maxlen=history)
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._phases = None  # seconds per phase of the running cycle, None between cycles
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.cycles.clear()
+            self.count = 0
+            self.overruns = 0
+            self.missed = 0  # deadlines skipped after overruns
+
+    def run(self, body, running=lambda: True):
+        """Call `body` once per period while `running()`, until :meth:`stop`."""
+        self._stop.clear()
+        deadline = perf_counter()
+        while running() and not self._stop.is_set():
+            start = self._mark = perf_counter()
+            self._phases = dict.fromkeys(self.PHASES, 0.)
+            try:
+                body()
+            finally:
+                end = perf_counter()
+                self._record(ControlCycle(deadline, start, end, **self._phases))
+                self._phases = None
+            deadline += self.period
+            if end > deadline:
+                with self.lock:
+                    self.overruns += 1
+                    self.missed += int((end - deadline) / self.period)
+                deadline = end
+                continue
+            if deadline - end > self.FINE_WAIT:
+                self._stop.wait(deadline - end - self.FINE_WAIT)
+            remaining = deadline - perf_counter()
+            if remaining > 0 and not self._stop.is_set():
+                sleep(remaining)
+
+    def stop(self):
+        """End :meth:`run` after the running cycle, without waiting out the period."""
+        self._stop.set()
+
+    def mark(self, phase):
+        """End `phase` of the running cycle now; the time since the last mark goes to it. No-op outside :meth:`run`."""
+        if self._phases is None:
+            return
+        now = perf_counter()
+        self._phases[phase] += now - self._mark
+        self._mark = now
+
+    def _record(self, cycle):
+        with self.lock:
+            self.cycles.append(cycle)
+            self.count += 1
+
+    def summary(self):
+        """{cycles, overruns, missed, period, rate, interval, lateness, duration, <phase>} over the kept cycles.
+
+        `rate` is the achieved cycles per second, `interval` the time
+        between cycle starts, `lateness` the start after the deadline and
+        `duration` the time in the body; these and the phases are
+        {mean, std, p50, p99, max} in seconds.
+        """
+        with self.lock:
+            cycles = np.array(self.cycles, dtype=float).reshape(-1, len(ControlCycle._fields))
+            out = {'cycles': self.count, 'overruns': self.overruns, 'missed': self.missed, 'period': self.period}
+        deadline, start, end = cycles[:, 0], cycles[:, 1], cycles[:, 2]
+        out['rate'] = (len(start) - 1) / (start[-1] - start[0]) if len(start) > 1 else np.nan
+        series = {'interval': np.diff(start), 'lateness': start - deadline, 'duration': end - start}
+        series.update(zip(self.PHASES, cycles[:, 3:].T))
+        for key, values in series.items():
+            if len(values):
+                p50, p99 = np.percentile(values, [50, 99])
+                out[key] = {'mean': values.mean(), 'std': values.std(), 'p50': p50, 'p99': p99, 'max': values.max()}
+            else:
+                out[key] = dict.fromkeys(('mean', 'std', 'p50', 'p99', 'max'), np.nan)
+        return out
+
+    def format(self):
+        s = self.summary()
+        lines = [f"{s['cycles']} cycles at {s['rate']:.3f}/s (target {1 / s['period']:.3f}/s), "
+                 f"{s['overruns']} overruns, {s['missed']} deadlines missed",
+                 f"{'':>9} {'mean ms':>9} {'std ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for key in ('interval', 'lateness', 'duration') + self.PHASES:
+            e = s[key]
+            lines.append(f"{key:>9} {e['mean']*1e3:9.3f} {e['std']*1e3:9.3f} {e['p50']*1e3:9.3f} {e['p99']*1e3:9.3f} {e['max']*1e3:9.3f}")
+        return '\n'.join(lines)
+
 
 class MOTOR_TYPES(IntEnum):
     NO_MOTOR = 0
@@ -1007,12 +3079,18 @@ class StarGuide:
     M2X = 3
     M2Y = 4
     MOTOR_CHANNELS = [M1X, M1Y, M2X, M2Y]
+    MOTOR_SERIAL = None  # serial number of the 8742 to use, first found if None
     MOTOR_TYPE = MOTOR_TYPES.TINY
     MOTOR_VELOCITY = 1000  # was 1750
     MOTOR_ACCELERATION = 10_000  # was 100_000
     AMM_STEP = 200
 
     CAM_CHANNELS = [1, 2]
+    CAM_PROFILE = CameraProfile()  # mono8 at the fastest pixel clock and frame rate
+    CAM_TRIGGER = 'software'  # exposes both cameras together, see uEyeCaptureGroup
+    PUBLISH = True  # send every centroid sample to local subscribers, see centroid_bus.py
+    DRIFT_SNAPSHOT = 'drift_stats.npz'  # drift statistics for StarGuideExpress, see drift_stats.py
+    DRIFT_INTERVAL = 1.  # s between snapshots of the drift statistics
     C1_TARGET = (610, 547)
     C2_TARGET = (560, 581)
     TARGETS = [C1_TARGET, C2_TARGET]
@@ -1022,6 +3100,8 @@ class StarGuide:
     MOVEMENT_THRESHOLD = 2500  # max motor movement
     MIN_MOVEMENT_THRESHOLD = 0.2
     SAMPLES = 10
+    SETTLE_TIME = 0.  # extra wait after the motors report motion done
+    CONTROL_PERIOD = 1.  # s from one alignment correction to the next, see ControlLoopScheduler
 
     MOTION_MATRIX_CONSTRAINT = np.array([
         [1, 0, 1, 0],
@@ -1031,6 +3111,9 @@ class StarGuide:
     ])
 
     def __init__(self, motion_matrix=None, debug=False):
+        if logger.fname is None:
+            logger.open()
+            logger.level = log_levels.DEBUG
         if motion_matrix is not None:
             self.mm = motion_matrix
         else:
@@ -1039,20 +3122,63 @@ class StarGuide:
         self.debug = debug
 
         usb.backend.libusb1.get_backend(find_library=libusb_package.find_library)
-        self.mc = NewFocus8742USB.create('0x104d', '0x4000')
-        self.cams = [uEyeCamera(self.CAM_CHANNELS[0]), uEyeCamera(self.CAM_CHANNELS[1])]
+        self.controllers = NewFocus8742Manager.from_usb('0x104d', '0x4000')
+        try:
+            self.mc = self.controllers.controller(self.MOTOR_SERIAL)
+        except ValueError:
+            self.controllers.close()
+            raise
+        self._alignment_running = False
+        self.control = ControlLoopScheduler(self.CONTROL_PERIOD)
+        self._moves_lock = threading.Lock()
+        self._pending_moves = np.zeros(len(self.MOTOR_CHANNELS))  # steps sent since the last published sample
+        self.bus = None
+        if self.PUBLISH:
+            try:
+                self.bus = CentroidPublisher()
+            except OSError as e:
+                logger.log(f'not publishing centroids: {e}', log_levels.ERROR)
+        self.cams = [uEyeCamera(ch, profile=self.CAM_PROFILE) for ch in self.CAM_CHANNELS]
+        self.capture_group = uEyeCaptureGroup(self.cams, self.CAM_TRIGGER)
+        self.drift = DriftStats()  # Allan deviation, PSD and RMS of every centroid sample, see drift_stats.py
+        self._last_drift_save = -np.inf
+        self.capture_group.listeners.append(self.__add_drift)
+        if self.bus is not None:
+            self.capture_group.listeners.append(self.__publish)
+        self.capture_group.start()
         self.ui_thread = threading.Thread(target=self.__view_worker)
         self.ui_thread.start()
-        self._alignment_running = False
-        for m_channel in self.MOTOR_CHANNELS:
-            self.mc.set_type(m_channel, self.MOTOR_TYPE)
-            self.mc.set_velocity(m_channel, self.MOTOR_VELOCITY)
-            self.mc.set_acceleration(m_channel, self.MOTOR_ACCELERATION)
+        self.motion = NewFocus8742MotionWaiter(self.mc, self.MOTOR_VELOCITY, self.MOTOR_ACCELERATION)
+        # only settings that differ from the controller's are actually sent
+        with self.mc.batch() as b:
+            for m_channel in self.MOTOR_CHANNELS:
+                b.set_type(m_channel, self.MOTOR_TYPE)
+                b.set_velocity(m_channel, self.MOTOR_VELOCITY)
+                b.set_acceleration(m_channel, self.MOTOR_ACCELERATION)
 
     def __del__(self):
         if hasattr(self, 'ui_thread'):
             self.ui_thread.join()
 
+    def __publish(self, frame_set):
+        with self._moves_lock:
+            moves, self._pending_moves = self._pending_moves, np.zeros(len(self.MOTOR_CHANNELS))
+        self.bus.publish(frame_set.timestamp, [cam.centroid for cam in self.cams], self.TARGETS, moves, self._alignment_running)
+
+    def __add_drift(self, frame_set):
+        self.drift.add(frame_set.timestamp, [cam.centroid for cam in self.cams])
+        now = monotonic()
+        if now - self._last_drift_save >= self.DRIFT_INTERVAL:
+            self._last_drift_save = now
+            try:
+                self.drift.save(self.DRIFT_SNAPSHOT)
+            except OSError as e:
+                logger.log(f'drift statistics not saved: {e}', log_levels.ERROR)
+
+    def __record_move(self, motor_channel, dist):
+        with self._moves_lock:
+            self._pending_moves[self.MOTOR_CHANNELS.index(motor_channel)] += dist
+
     def __view_worker(self):
         with rowmajor_axisorder():
             app = QApplication([])
@@ -1061,23 +3187,28 @@ class StarGuide:
             app.exec_()
 
     def __align_worker(self):
-        while True:
-            if self._alignment_running:
-                self.align_beam()
-            else:
-                break
+        self.control.run(self.align_beam, lambda: self._alignment_running)
 
-    def run(self):
+    def run(self, period=None):
+        """Start aligning, one correction every `period` s (CONTROL_PERIOD by default)."""
+        if period is not None:
+            self.control.period = period
+        self.control.reset()  # the timing of this run only
         self._alignment_running = True
-        self._alignment_thread = threading.Thread(target=with_error_catcher(self.__align_worker, self.stop))
+        self._alignment_thread = threading.Thread(target=lambda: with_error_catcher(self.__align_worker, self.stop),
+                                                  name='StarGuide alignment')
         self._alignment_thread.start()
 
     def stop(self):
-        try:
-            self._alignment_running = False
-            self._alignment_thread.join()
-        except AttributeError:
-            self._alignment_running = False
+        """Stop aligning, without waiting out the period of the running cycle."""
+        self._alignment_running = False
+        self.control.stop()
+        thread = getattr(self, '_alignment_thread', None)
+        if thread is None:
+            return
+        if thread is not threading.current_thread():  # stop() also runs in the loop when it fails
+            thread.join()
+        logger.log(f'alignment loop timing\n{self.control.format()}', log_levels.INFO)
         # self.viewer.close()
         # self.ui_thread.join()
 
@@ -1087,20 +3218,14 @@ class StarGuide:
             mm_n = np.zeros((4,4))
             for i, m_channel in tqdm(enumerate(self.MOTOR_CHANNELS), total=len(self.MOTOR_CHANNELS), desc='motors', leave=False):
                 self.__move_rel(m_channel, -self.AMM_STEP)
-                old_cam_poss = []
-                for k, cam in enumerate(self.cams):
-                    sleep(self.SAMPLES / 9)
-                    cam_pos_x, cam_pos_y = cam.get_mean_centroid(self.SAMPLES)
-                    old_cam_poss.append((cam_pos_x, cam_pos_y))
-                    if self.debug:
+                old_cam_poss = self.__cam_positions()
+                if self.debug:
+                    for k, (cam_pos_x, cam_pos_y) in enumerate(old_cam_poss):
                         logger.log(f'for cam {k} found old pos: {cam_pos_x}, {cam_pos_y}')
                 self.__move_rel(m_channel, 2*self.AMM_STEP)
-                new_cam_poss = []
-                for k, cam in enumerate(self.cams):
-                    sleep(self.SAMPLES / 9)
-                    cam_pos_x, cam_pos_y = cam.get_mean_centroid(self.SAMPLES)
-                    new_cam_poss.append((cam_pos_x, cam_pos_y))
-                    if self.debug:
+                new_cam_poss = self.__cam_positions()
+                if self.debug:
+                    for k, (cam_pos_x, cam_pos_y) in enumerate(new_cam_poss):
                         logger.log(f'for cam {k} found new pos: {cam_pos_x}, {cam_pos_y}')
                 for j, (new_pos, old_pos) in enumerate(zip(new_cam_poss, old_cam_poss)):
                     mm_n[2*j, i] = (new_pos[0]-old_pos[0])/self.AMM_STEP
@@ -1116,39 +3241,88 @@ class StarGuide:
         self.mm = np.linalg.inv(np.average(mm, axis=0))
         logger.log(f'final motion matrix has sum: {self.mm.sum()}\n{self.mm}')
 
-    def __move_rel(self, motor_channel, dist, blocking=True):
+    def __cam_positions(self):
+        """(x, y) mean centroid of each camera over its next SAMPLES frames, exposed together by the capture group."""
+        stacks = [cam.request_stack(self.SAMPLES) for cam in self.cams]
+        positions = []
+        for cam, stack in zip(self.cams, stacks):
+            stats = cam.centroid_stack(stack.result(self.SAMPLES * cam.FRAME_TIMEOUT))
+            if self.debug and stats.count < self.SAMPLES:
+                logger.log(f'camera {cam.hCam.value}: spot in {stats.count} of {self.SAMPLES} frames')
+            positions.append(stats.mean[::-1])
+        return positions
+
+    def __steps(self, dist):
         sign = int((int(dist>0))-(int(dist<0)))
         if abs(dist) < self.MIN_MOVEMENT_THRESHOLD:
-            dist = 0
+            return 0
         elif abs(dist) < 1:
-            dist = 1*sign
-        else:
-            dist = int(np.rint(dist))
+            return 1*sign
+        return int(np.rint(dist))
+
+    def __move_rel(self, motor_channel, dist, blocking=True):
+        dist = self.__steps(dist)
         self.mc.set_relative(motor_channel, dist)
+        self.__record_move(motor_channel, dist)
+        fut = self.motion.expect(motor_channel, dist)
         if self.debug:
             logger.log(f'rel moved motor {motor_channel}: {dist:4.7f}')            
         if blocking:
-            while not self.mc.done(motor_channel):
-                sleep(0.25)
-            sleep(0.25)
+            self.__wait_motion([fut])
+        return fut
+
+    def __wait_motion(self, futures):
+        self.motion.wait(futures)
+        if self.SETTLE_TIME:
+            sleep(self.SETTLE_TIME)
+
+    def __move_rel_all(self, dists, blocking=True):
+        """Relative move of every motor channel, sent as a single batch.
+
+        All moves go out in one line and motion done is polled for all
+        channels at once, instead of one transfer per command and axis.
+        """
+        moves = [(m_channel, self.__steps(dist)) for m_channel, dist in zip(self.MOTOR_CHANNELS, dists)]
+        moves = [(m_channel, dist) for m_channel, dist in moves if dist != 0]
+        if not moves:
+            return []
+        with self.mc.batch() as b:
+            for m_channel, dist in moves:
+                b.set_relative(m_channel, dist)
+        for m_channel, dist in moves:
+            self.__record_move(m_channel, dist)
+        futures = [self.motion.expect(m_channel, dist) for m_channel, dist in moves]
+        if self.debug:
+            for m_channel, dist in moves:
+                logger.log(f'rel moved motor {m_channel}: {dist:4.7f}')
+        if blocking:
+            self.__wait_motion(futures)
+        return futures
 
     def __move_abs(self, motor_channel, pos, blocking=True):
         self.mc.set_position(motor_channel, pos)
+        fut = self.motion.expect(motor_channel)
         if self.debug:
             logger.log(f'abs moved motor {motor_channel}: {pos:4.7f}')
         if blocking:
-            while not self.mc.done(motor_channel):
-                sleep(0.25)
-            sleep(0.25)
+            self.__wait_motion([fut])
+        return fut
 
     def align_beam(self):
+        """One correction: sample both cameras, compute and send the motor moves, wait for them to settle.
+
+        The phases are marked on :attr:`control` for the loop timing. When
+        either camera has no spot, the correction is skipped until the next
+        cycle.
+        """
         cam_offsets = []
-        sleep(self.SAMPLES / 9)
-        for cam, target in zip(self.cams, self.TARGETS):
-            cam_pos_x, cam_pos_y = cam.get_mean_centroid(self.SAMPLES)
-            if np.isnan(cam_pos_x) or np.isnan(cam_pos_y):
-                sleep(1)
-                cam_pos_x, cam_pos_y = cam.get_mean_centroid(self.SAMPLES)
+        positions = self.__cam_positions()
+        self.control.mark('sample')
+        if np.isnan(positions).any():
+            if self.debug:
+                logger.log('no spot on a camera, skipping this correction')
+            return
+        for (cam_pos_x, cam_pos_y), target in zip(positions, self.TARGETS):
             cam_movement_x = target[0] - cam_pos_x
             if np.abs(cam_movement_x) < self.ALIGNMENT_THRESHOLD:
                 cam_movement_x = 0
@@ -1167,12 +3341,16 @@ class StarGuide:
             if np.abs(motor_movement) > self.MOVEMENT_THRESHOLD:
                 logger.log(f'WARNING: motor {m_channel} movement too large: {motor_movement}')
                 return
-        for m_channel, motor_movement in zip(self.MOTOR_CHANNELS, motor_movements):
-            self.__move_rel(m_channel, motor_movement)
+        self.control.mark('compute')
+        futures = self.__move_rel_all(motor_movements, blocking=False)
+        self.control.mark('command')
+        if futures:
+            self.__wait_motion(futures)
+        self.control.mark('settle')
 
     def zero_all(self):
-        for m_channel in self.MOTOR_CHANNELS:
-            self.__move_abs(m_channel, 0)
+        futures = [self.__move_abs(m_channel, 0, blocking=False) for m_channel in self.MOTOR_CHANNELS]
+        self.__wait_motion(futures)
 
 if __name__ == "__main__":
     logger = customLogger('test.log')    
@@ -1182,6 +3360,7 @@ if __name__ == "__main__":
     parser.add_argument("-M", '--motion-matrix', dest = 'mm', help='File name of the motion matrix to load', type=str)
     parser.add_argument('-G', '--gain', dest='gain', help='Uniform level of gain to apply on stabilization', default=0.004)
     parser.add_argument('-N', '--no-run', dest='no_run', help='Only open GUI, do not apply stabilization', action='store_false')
+    parser.add_argument('-P', '--period', dest='period', help='Seconds between stabilization corrections', type=float, default=StarGuide.CONTROL_PERIOD)
     args = parser.parse_args()
     sg = None #load nothing by default
     if args.acquire:
@@ -1210,7 +3389,7 @@ if __name__ == "__main__":
         sys.exit(2)
     if not args.no_run:
         sg.GAIN = args.gain
-        sg.run()
+        sg.run(args.period)
         while True:
             try:
                 sleep(0.1)
@@ -0,0 +1,293 @@
+"""
+Tests of the StarGuide drivers and tools against the simulators.
+
+The 8742 tests run the drivers in `newfocus_v2.py` on `newfocus_sim` and
+the camera test runs `uEyeCamera` on `fake_ueye`; they are skipped where
+the packages `newfocus_v2` imports (PyQt5, pyqtgraph, pyueye, pyusb, ...)
+are missing. The rest only needs numpy.
+
+    python -m pytest -q test_starguide.py
+"""
+import os
+import socket
+from time import time
+import numpy as np
+import pytest
+import centroid_bus
+import centroid_log
+from centroid_bench import make_images
+from centroids import get_algorithm
+from drift_stats import DriftStats
+
+
+@pytest.fixture(scope='module')
+def nf():
+    return pytest.importorskip('newfocus_v2')
+
+
+@pytest.fixture(scope='module')
+def sim():
+    return pytest.importorskip('newfocus_sim')
+
+
+def usb_controller(nf, sim, packet_size=64, **kwargs):
+    """NewFocus8742USB on a simulated controller, its endpoints cutting replies into `packet_size` packets."""
+    ep = sim.SimulatedUSBEndpoints(sim.NewFocus8742Model(**kwargs))
+    ep.wMaxPacketSize = packet_size
+    return nf.NewFocus8742USB.from_endpoints(ep, ep), ep.model
+
+
+def record_lines(mc):
+    """Keep the lines `mc` sends in the returned list."""
+    lines = []
+    transact = mc._transact
+
+    def _transact(line, n_replies):
+        lines.append(line)
+        return transact(line, n_replies)
+    mc._transact = _transact
+    return lines
+
+
+# ____________________________________________________________________________ 8742 driver
+
+def test_batch_fills_lines_up_to_64_characters(nf, sim):
+    mc, _ = usb_controller(nf, sim)
+    b = nf.NewFocus8742Batch(mc)
+    for _ in range(9):
+        b.set_relative(1, 1000)  # "1PR1000", 7 characters
+    lines = [line for line, _ in b.lines()]
+    # 8 commands and their 7 separators make 63 characters, the ninth goes on a new line
+    assert lines == [';'.join(['1PR1000'] * 8), '1PR1000']
+
+
+def test_batch_splits_and_answers_in_order(nf, sim):
+    mc, _ = usb_controller(nf, sim)
+    lines = record_lines(mc)
+    with mc.batch() as b:
+        for m in range(1, 5):
+            b.set_velocity(m, 1000 + m)
+            b.set_acceleration(m, 50000 + m)
+            b.get_velocity(m)
+            b.get_acceleration(m)
+    assert len(lines) > 1
+    assert all(len(line) < 64 for line in lines)
+    commands = ';'.join(lines).split(';')
+    assert commands == [c for m in range(1, 5) for c in (f'{m}VA{1000 + m}', f'{m}AC{50000 + m}', f'{m}VA?', f'{m}AC?')]
+    assert [int(r) for r in b.results] == [v for m in range(1, 5) for v in (1000 + m, 50000 + m)]
+
+
+@pytest.mark.parametrize('packet_size', [3, 5, 64])
+def test_usb_reassembles_replies_across_packets(nf, sim, packet_size):
+    mc, model = usb_controller(nf, sim, packet_size)
+    assert mc.identify() == sim.IDN.format(serial=model.serial)
+    with mc.batch() as b:
+        for m in range(1, 5):
+            b.set_velocity(m, 1000 + m)
+        for _ in range(3):
+            for m in range(1, 5):
+                b.get_velocity(m)
+    # 12 replies of 6 bytes, more than a 64 byte packet
+    assert [int(r) for r in b.results] == [1000 + m for _ in range(3) for m in range(1, 5)]
+    assert mc.ask('*IDN?') == sim.IDN.format(serial=model.serial)
+
+
+def test_shadow_forgets_axis_on_axis_error(nf, sim):
+    mc, _ = usb_controller(nf, sim)
+    mc.set_velocity(1, 1500)
+    mc.set_velocity(2, 1200)
+    assert mc.shadow.get('VA?', 1) == 1500
+    mc.do('VA', 1, 5000)  # above the maximum velocity: refused, error 110
+    assert int(mc.error_code()) == 110
+    assert mc.shadow.get('VA?', 1) is None
+    assert mc.shadow.get('VA?', 2) == 1200
+    lines = record_lines(mc)
+    assert int(mc.get_velocity(1)) == 1500
+    assert lines == ['1VA?']
+
+
+def test_shadow_forgets_everything_on_controller_error(nf, sim):
+    mc, _ = usb_controller(nf, sim)
+    mc.set_velocity(2, 1200)
+    mc.do('ZZ')  # unknown command, error 6
+    assert mc.error_message().startswith('6')
+    assert mc.shadow.values == {}
+    lines = record_lines(mc)
+    assert int(mc.get_velocity(2)) == 1200
+    assert lines == ['2VA?']
+
+
+def test_shadow_keeps_moves_and_confirms_targets(nf, sim):
+    mc, _ = usb_controller(nf, sim, motion_time=.01)
+    lines = record_lines(mc)
+    mc.set_position(1, 100)
+    mc.set_position(1, 100)
+    mc.set_relative(1, 0)
+    assert lines == ['1PA100', '1PA100', '1PR0']
+    assert mc.shadow.get('PA?', 1) is None
+    while not int(mc.done(1)):
+        pass
+    assert mc.shadow.get('PA?', 1) == 100
+    mc.set_velocity(1, 1500)
+    del lines[:]
+    mc.set_velocity(1, 1500)
+    assert lines == []
+
+
+# ____________________________________________________________________________ centroids
+
+def test_centroid_buffer_windows(nf):
+    buf = nf.CentroidBuffer(maxlen=64)
+    rng = np.random.default_rng(0)
+    positions = 100 + rng.normal(size=(200, 2))
+    positions[::7] = np.nan
+    now = time()
+    stamps = now - (199 - np.arange(200)) * 1.  # a second apart, the newest now
+    for i in range(200):
+        buf.append(positions[i], i, stamps[i])
+    assert len(buf) == 64
+    assert buf.latest().seq == 199
+    for n in (1, 10, 40):
+        last = positions[-n:]
+        assert buf.valid(n) == np.isfinite(last[:, 0]).sum()
+        np.testing.assert_allclose(buf.mean(n), np.nanmean(last, axis=0))
+        np.testing.assert_allclose(buf.var(n), np.nanvar(last, axis=0), atol=1e-9)
+        np.testing.assert_allclose(buf.median(n), np.nanmedian(last, axis=0))
+        np.testing.assert_array_equal(buf.positions(n), last)
+    # the samples of the last 10.5 s are the newest 11
+    np.testing.assert_allclose(buf.mean(seconds=10.5), buf.mean(11))
+    # a window spans at most maxlen - RESERVE samples
+    assert len(buf.positions()) == 64 - buf.RESERVE
+    assert buf.valid(100) == buf.valid()
+
+
+@pytest.mark.parametrize('algorithm', ['weighted', 'windowed', 'gaussian'])
+def test_centroid_error_under_a_tenth_of_a_pixel(algorithm):
+    images, centers = make_images(20, (128, 128), rng=np.random.default_rng(1))
+    centroid = get_algorithm(algorithm)
+    positions = np.array([centroid(image).position for image in images])
+    assert np.sqrt(np.mean(np.sum((positions - centers) ** 2, axis=1))) < 0.1
+
+
+def test_camera_centroid_on_fake_ueye(nf):
+    import fake_ueye
+    fake_ueye.configure(91, spot=(610.3, 547.6), fps=50)
+    cam = nf.uEyeCamera(91, backend=fake_ueye, centroider='windowed')
+    try:
+        frame = cam.wait_for_frame()
+        np.testing.assert_allclose(cam.compute_centroid(frame.image).position, (547.6, 610.3), atol=0.1)
+    finally:
+        del cam
+
+
+# ____________________________________________________________________________ centroid log
+
+def write_log(path, n=200, rate=8, t0=1000.):
+    """Log n samples at `rate` per second from t0, centroids ((i, -i), (2i, 0)) for sample i."""
+    with centroid_log.CentroidLogWriter(path, chunk=16) as log:
+        for i in range(n):
+            log.append(t0 + i / rate, [[i, -i], [2 * i, 0]], [(610, 547), (560, 581)], locked=i % 2)
+
+
+def test_log_drops_partial_record(tmp_path):
+    path = str(tmp_path / 'positions.sglog')
+    write_log(path)
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 10)  # killed in the middle of a record
+    assert len(centroid_log.CentroidLog(path)) == 200
+    with centroid_log.CentroidLogWriter(path, levels=False) as log:
+        assert os.path.getsize(path) == size
+        log.append(2000., [[1, 2], [3, 4]])
+    log = centroid_log.CentroidLog(path)
+    assert len(log) == 201
+    assert log[199]['time'] == 1000. + 199 / 8
+    assert log[200]['time'] == 2000.
+    np.testing.assert_array_equal(log[200]['centroids'], [[1, 2], [3, 4]])
+
+
+def test_log_pyramid_cascade(tmp_path):
+    path = str(tmp_path / 'positions.sglog')
+    write_log(path)
+    log = centroid_log.CentroidLog(path)
+    seconds, tens = log.level('1s'), log.level('10s')
+    assert seconds.interval == 1. and tens.interval == 10.
+    # 25 s of 8 samples per second
+    assert len(seconds) == 25
+    np.testing.assert_array_equal(seconds.records['time'], 1000. + np.arange(25))
+    np.testing.assert_array_equal(seconds.records['count'], 8)
+    np.testing.assert_allclose(seconds.records['locked'], .5)
+    first = 8 * np.arange(25)
+    np.testing.assert_allclose(seconds.records['mean'][:, 0, 0], first + 3.5)
+    np.testing.assert_array_equal(seconds.records['min'][:, 0, 0], first)
+    np.testing.assert_array_equal(seconds.records['max'][:, 0, 0], first + 7)
+    np.testing.assert_array_equal(seconds.records['min'][:, 0, 1], -first - 7)
+    # each 10 s bucket aggregates the 1 s buckets in it
+    np.testing.assert_array_equal(tens.records['time'], [1000., 1010., 1020.])
+    np.testing.assert_array_equal(tens.records['count'], [80, 80, 40])
+    for bucket, parts in zip(tens.records, np.split(seconds.records, [10, 20])):
+        weights = parts['count'][:, None, None]
+        np.testing.assert_allclose(bucket['mean'], (parts['mean'] * weights).sum(axis=0) / weights.sum())
+        np.testing.assert_array_equal(bucket['min'], parts['min'].min(axis=0))
+        np.testing.assert_array_equal(bucket['max'], parts['max'].max(axis=0))
+    # and the minute buckets, which start on whole minutes, the 10 s ones in them
+    minutes = log.level('1min')
+    np.testing.assert_array_equal(minutes.records['time'], [960., 1020.])
+    np.testing.assert_array_equal(minutes.records['count'], [160, 40])
+    np.testing.assert_allclose(minutes.records['mean'][0], log.records['centroids'][:160].mean(axis=0))
+
+
+# ____________________________________________________________________________ centroid bus
+
+def test_slow_subscriber_drops_whole_records():
+    with centroid_bus.CentroidPublisher(port=0) as pub:
+        pub.MAX_BACKLOG = 8
+        port = pub._server.getsockname()[1]
+        with centroid_bus.CentroidSubscriber(port=port, timeout=1.) as sub:
+            sub._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            pub.publish(0., np.zeros((2, 2)))
+            subscriber, = pub.subscribers
+            subscriber.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            n = 2000
+            for i in range(1, n):
+                pub.publish(float(i), np.zeros((2, 2)))
+            assert pub.dropped == subscriber.dropped > 0
+            received = np.concatenate([sub.poll(timeout=.02) for _ in range(20)])
+    # nothing lost but the dropped records, and the stream stays aligned on records
+    waiting = len(subscriber.backlog) // centroid_bus.RECORD.itemsize
+    assert len(received) + pub.dropped + waiting == n
+    assert received['time'][0] == 0. and (np.diff(received['time']) > 0).all()
+
+
+# ____________________________________________________________________________ drift statistics
+
+@pytest.fixture(scope='module')
+def white_noise():
+    """DriftStats of unit white noise, 2**16 samples 10 ms apart."""
+    n = 2 ** 16
+    stats = DriftStats()
+    stats.extend(np.arange(n) * .01, np.random.default_rng(2).normal(size=(n, 2, 2)))
+    return stats
+
+
+def test_allan_deviation_of_white_noise(white_noise):
+    taus, adev, counts = white_noise.allan()
+    m = taus / white_noise.interval
+    short = m <= 128
+    assert short.sum() >= 10
+    # sigma / sqrt(tau)
+    np.testing.assert_allclose(adev[short] * np.sqrt(m[short, None]), 1., rtol=.15)
+
+
+def test_psd_of_white_noise(white_noise):
+    freqs, psd, segments = white_noise.psd()
+    assert (segments == 2 * 2 ** 16 // white_noise.nfft - 1).all()
+    assert freqs[-1] == pytest.approx(50.)
+    # flat at 2 sigma**2 dt, one-sided
+    np.testing.assert_allclose(psd[1:-1].mean(axis=0), 2 * .01, rtol=.05)
+    for band in np.array_split(psd[1:-1], 8):
+        np.testing.assert_allclose(band.mean(axis=0), 2 * .01, rtol=.15)
+
+
+def test_rms_of_white_noise(white_noise):
+    np.testing.assert_allclose(white_noise.rms(), 1., rtol=.1)